@@ -1,16 +1,117 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, Response
 import os
+import hashlib
+import json
 import threading
+import time
+import uuid
 from datetime import datetime
-from map_generator import create_detailed_city_wkt, test_city_availability
+from map_generator import WARM_UP_ZONES, configure_process_pool, create_detailed_city_wkt, get_process_pool, warm_up
+from geocoding import get_geocoding_service
+from data_sources import get_data_source
+from wkt_cache import WKTCache, make_cache_key
+from binary_formats import BINARY_FORMATS, EXTENSIONS, MIMETYPES, binary_path_for
+from compression import ENCODINGS, file_etags, variant_path
+from job_queue import JobScheduler, QueueFullError
+from batch_generator import parse_manifest, run_batch
+from simplification import parse_geometry_options
+from metrics import current_profile, increment, job_metrics, render_prometheus, stage
+from job_store import (ACTIVE_STATES, TERMINAL_STATES, MemoryJobStore, SQLiteJobStore, make_build_dir,
+                       publish_output, remove_build_dir, remove_stale_build_dirs, remove_stale_outputs)
 import tempfile
 import shutil
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
 
-# Store generation status
-generation_status = {}
+# Store generation status; every change bumps the job's 'version'.
+# Set MAPGEN_JOB_DB to a SQLite path to share job state between app processes.
+JOB_DB = os.environ.get('MAPGEN_JOB_DB', '')
+JOB_TTL_HOURS = float(os.environ.get('MAPGEN_JOB_TTL_HOURS', 24))
+MAX_JOBS = int(os.environ.get('MAPGEN_MAX_JOBS', 1000))
+JOB_GC_INTERVAL = 600
+if JOB_DB:
+    job_store = SQLiteJobStore(JOB_DB, ttl=JOB_TTL_HOURS * 3600, max_jobs=MAX_JOBS)
+else:
+    job_store = MemoryJobStore(ttl=JOB_TTL_HOURS * 3600, max_jobs=MAX_JOBS)
+# Longest a /status?since= request blocks, and the gap between /events keepalives
+LONG_POLL_TIMEOUT = 25
+EVENTS_KEEPALIVE = 15
+# Status shown for each progress stage reported by the generator
+STAGE_STATUS = {
+    'geocoded': 'downloading',
+    'downloading': 'downloading',
+    'downloaded': 'processing',
+    'reprojected': 'generating',
+    'serializing': 'generating',
+}
+
+# Cache of finished WKT files, shared by identical requests
+WKT_CACHE_DIR = os.path.join('wkt_output', 'cache')
+WKT_CACHE_MAX_MB = int(os.environ.get('WKT_CACHE_MAX_MB', 1024))
+WKT_CACHE_MAX_AGE_HOURS = float(os.environ.get('WKT_CACHE_MAX_AGE_HOURS', 24 * 7))
+# Precompressed variants stored with every cached file (zstd needs the zstandard package)
+WKT_CACHE_ENCODINGS = [enc for enc in os.environ.get('MAPGEN_COMPRESSION', 'zstd,gzip').split(',') if enc]
+wkt_cache = WKTCache(WKT_CACHE_DIR, max_bytes=WKT_CACHE_MAX_MB * 1024 * 1024,
+                     max_age=WKT_CACHE_MAX_AGE_HOURS * 3600, encodings=WKT_CACHE_ENCODINGS)
+
+# Bounded pool for generation jobs
+MAX_WORKERS = int(os.environ.get('MAPGEN_MAX_WORKERS', 2))
+MAX_QUEUED_JOBS = int(os.environ.get('MAPGEN_MAX_QUEUED_JOBS', 20))
+job_scheduler = JobScheduler(max_workers=MAX_WORKERS, max_queue=MAX_QUEUED_JOBS)
+# Areas generated at the same time within one /generate_batch job
+BATCH_WORKERS = int(os.environ.get('MAPGEN_BATCH_WORKERS', 2))
+
+# Binary formats written next to every WKT file and offered by /download (none unless enabled)
+BINARY_OUTPUT_FORMATS = [fmt for fmt in os.environ.get('MAPGEN_BINARY_FORMATS', '').split(',') if fmt]
+DOWNLOAD_MIMETYPES = {'wkt': 'text/plain', **MIMETYPES}
+
+# Set MAPGEN_PROFILE_DIR to dump a cProfile of every job to <dir>/<job_id>.prof
+PROFILE_DIR = os.environ.get('MAPGEN_PROFILE_DIR', '')
+
+# Optionally run the CPU-heavy download/project/serialize stages in worker processes
+configure_process_pool(int(os.environ.get('MAPGEN_PROCESS_WORKERS', 0)))
+# Set MAPGEN_WARM_UP=1 to load the geo libraries (and start the process pool) in the
+# background at startup instead of during the first job
+WARM_UP = os.environ.get('MAPGEN_WARM_UP', '') == '1'
+
+def collect_garbage():
+    """Drop expired jobs and delete the output files the app published that no remaining job refers to"""
+    expired = job_store.prune()
+    keep = job_store.referenced_paths()
+    keep |= {binary_path_for(path, fmt) for path in keep for fmt in BINARY_FORMATS}
+    gone = remove_stale_outputs(job_store.outputs(), keep, JOB_TTL_HOURS * 3600)
+    job_store.forget_outputs(gone)
+    removed_dirs = remove_stale_build_dirs('wkt_output', JOB_TTL_HOURS * 3600)
+    if expired or gone or removed_dirs:
+        print(f"[DEBUG] Expired {expired} jobs, removed {len(gone)} stale output files "
+              f"and {removed_dirs} build directories")
+
+def record_published(output_path):
+    """Track a published WKT file and its binary variants for collect_garbage"""
+    job_store.add_outputs([output_path, *(binary_path_for(output_path, fmt) for fmt in BINARY_OUTPUT_FORMATS)])
+
+def _garbage_collector():
+    while True:
+        try:
+            collect_garbage()
+        except Exception as e:
+            print(f"[DEBUG] Garbage collection failed: {e}")
+        time.sleep(JOB_GC_INTERVAL)
+
+threading.Thread(target=_garbage_collector, name='job-gc', daemon=True).start()
+
+def warm_up_app():
+    """Preload the generation path: geo libraries, UTM projections and process pool workers"""
+    try:
+        with stage('warm_up'):
+            warm_up(WARM_UP_ZONES)
+            get_process_pool()
+    except Exception as e:
+        print(f"[DEBUG] Warm-up failed: {e}")
+
+if WARM_UP:
+    threading.Thread(target=warm_up_app, name='warm-up', daemon=True).start()
 
 @app.route('/')
 def index():
@@ -42,93 +143,325 @@ def generate_wkt():
     except ValueError:
         flash('Invalid map size', 'error')
         return redirect(url_for('index'))
+
+    # Optional output reduction: Douglas-Peucker tolerance (m), decimals, degree-2 chain merging
+    try:
+        geometry = parse_geometry_options(request.form.get('simplify_tolerance', '').strip(),
+                                          request.form.get('precision', '').strip(),
+                                          request.form.get('merge_chains', ''))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('index'))
     
     # Create a unique job ID
-    job_id = f"{output_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    
+    job_id = f"{output_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    cache_key = make_cache_key(location, detail_level, map_size_int, geometry)
+
     # Initialize status
-    generation_status[job_id] = {
-        'status': 'starting',
-        'message': 'Initializing...',
-        'location': location,
-        'detail_level': detail_level,
-        'map_size': map_size_int,
-        'output_name': output_name,
-        'file_path': None,
-        'error': None
-    }
+    job_store.create(
+        job_id,
+        status='queued',
+        message='Waiting for a free worker...',
+        location=location,
+        detail_level=detail_level,
+        map_size=map_size_int,
+        geometry=geometry._asdict(),
+        output_name=output_name,
+        file_path=None,
+        error=None,
+        cached=False
+    )
+
+    # Cache hits complete right away instead of waiting behind builds for a worker
+    with job_metrics() as profile:
+        with stage('cache_lookup'):
+            cached = wkt_cache.get(cache_key)
+    if cached:
+        file_path, counts = cached
+        job_store.update(job_id, status='completed',
+                         message=f'Successfully generated {sum(counts.values())} road segments (from cache)',
+                         file_path=file_path, counts=counts, cached=True, metrics=profile.as_dict())
+        increment('mapgen_jobs_total', status='completed')
+        return render_template('generating.html', job_id=job_id, city_name=location, detail_level=detail_level)
+
+    # Queue generation; identical in-flight requests share one task
+    try:
+        task_id = job_scheduler.submit(job_id, cache_key, generate_wkt_background,
+                                       location, detail_level, map_size_int, output_name, cache_key, geometry)
+    except QueueFullError:
+        job_store.update(job_id, status='error', error='Job queue is full')
+        flash('The server is busy generating other maps. Please try again in a few minutes.', 'error')
+        return redirect(url_for('index'))
     
-    # Start generation in background thread
-    thread = threading.Thread(target=generate_wkt_background, args=(job_id, location, detail_level, map_size_int, output_name))
-    thread.daemon = True
-    thread.start()
+    if task_id != job_id:
+        # Attached to a running job: start from its current progress, unless the task
+        # already finished and pushed its final status to this job
+        task_status = job_status_snapshot(task_id) or {}
+        copied = ('status', 'message', 'stage', 'progress', 'edges', 'file_path', 'counts', 'cached', 'error')
+        if task_status.get('status') == 'cancelled':
+            # The owner job was cancelled, but the task runs on for its other jobs, this one included
+            copied = ('stage', 'progress', 'edges')
+        fields = {field: task_status[field] for field in copied if field in task_status}
+        job_store.update(job_id, only_from=ACTIVE_STATES, attached_to=task_id, **fields)
     
     return render_template('generating.html', job_id=job_id, city_name=location, detail_level=detail_level)
 
-def generate_wkt_background(job_id, location, detail_level, map_size, output_name):
-    """Background task to generate WKT file"""
+def update_job_status(task_id, **fields):
+    """
+    Update the status of every unfinished job attached to a scheduler task
+
+    When the task finishes, the stage timings collected for it are added as 'metrics'.
+    """
+    if fields.get('status') in TERMINAL_STATES:
+        profile = current_profile()
+        if profile is not None:
+            fields['metrics'] = profile.as_dict()
+        increment('mapgen_jobs_total', status=fields['status'])
+    for job_id in job_scheduler.subscribers(task_id):
+        job_store.update(job_id, only_from=ACTIVE_STATES, **fields)
+
+def with_queue_position(status, job_id):
+    """Add the job's queue position to a status copy while it is queued"""
+    if status is not None and status['status'] == 'queued':
+        status['queue_position'] = job_scheduler.queue_position(job_id)
+    return status
+
+def job_status_snapshot(job_id):
+    """Return a copy of a job's status, with its queue position while queued, or None if unknown"""
+    return with_queue_position(job_store.get(job_id), job_id)
+
+def wait_for_status_change(job_id, since, timeout):
+    """Block until a job's version differs from since (or timeout) and return its status snapshot"""
+    return with_queue_position(job_store.wait_for_change(job_id, since, timeout), job_id)
+
+def generate_wkt_background(task_id, cancel_event, *args):
+    """Background task to generate WKT file, timing its stages (and profiling it if PROFILE_DIR is set)"""
+    with job_metrics(PROFILE_DIR, task_id):
+        _generate_wkt(task_id, cancel_event, *args)
+
+def _generate_wkt(task_id, cancel_event, location, detail_level, map_size, output_name, cache_key, geometry=None):
     try:
-        generation_status[job_id]['status'] = 'testing'
-        generation_status[job_id]['message'] = f'Testing if {location} is available...'
-        # Try original location
-        available = test_city_availability(location)
-        # If not found, try appending ', Bangladesh' as fallback for cities like Dhaka
-        if not available and ',' not in location:
-            fallback_location = f"{location}, Bangladesh"
-            available = test_city_availability(fallback_location)
-            if available:
-                location = fallback_location
-        if not available:
-            generation_status[job_id]['status'] = 'error'
-            generation_status[job_id]['error'] = f'Location "{location}" not found in OpenStreetMap database. Please try a different name or add ", Country" suffix.'
+        # Checked again: an identical job may have finished while this one was queued
+        with stage('cache_lookup'):
+            cached = wkt_cache.get(cache_key)
+        if cached:
+            file_path, counts = cached
+            update_job_status(task_id, status='completed',
+                              message=f'Successfully generated {sum(counts.values())} road segments (from cache)',
+                              file_path=file_path, counts=counts, cached=True)
+            return
+
+        update_job_status(task_id, status='testing', message=f'Testing if {location} is available...')
+        # Geocode through the shared cache; falls back to e.g. ', Bangladesh' for bare city names
+        with stage('resolve'):
+            resolved = get_geocoding_service().resolve(location)
+        if resolved is None:
+            update_job_status(task_id, status='error',
+                              error=f'Location "{location}" not found in OpenStreetMap database. Please try a different name or add ", Country" suffix.')
+            return
+        if cancel_event.is_set():
             return
 
-        generation_status[job_id]['status'] = 'downloading'
-        generation_status[job_id]['message'] = f'Downloading map data for {location} (radius: {map_size}m)...'
+        location = resolved.query
+
+        update_job_status(task_id, status='downloading',
+                          message=f'Downloading map data for {location} (radius: {map_size}m)...')
 
         # Generate WKT file with custom size
-        success, counts, file_path = create_detailed_city_wkt(location, output_name, detail_level, map_size)
-        
-        if success and file_path:
-            # Ensure file_path is absolute and correct
-            if not os.path.isabs(file_path):
-                file_path = os.path.abspath(file_path)
-            
-            # Double-check file exists and create alternative path if needed
-            if os.path.exists(file_path):
-                generation_status[job_id]['status'] = 'completed'
-                generation_status[job_id]['message'] = f'Successfully generated {sum(counts.values())} road segments'
-                generation_status[job_id]['file_path'] = file_path
-                generation_status[job_id]['counts'] = counts
-            else:
-                # Try to find the file in wkt_output directory
-                alt_file_path = os.path.join('wkt_output', f"{output_name}.wkt")
-                if os.path.exists(alt_file_path):
-                    generation_status[job_id]['status'] = 'completed'
-                    generation_status[job_id]['message'] = f'Successfully generated {sum(counts.values())} road segments'
-                    generation_status[job_id]['file_path'] = os.path.abspath(alt_file_path)
-                    generation_status[job_id]['counts'] = counts
-                else:
-                    generation_status[job_id]['status'] = 'error'
-                    generation_status[job_id]['error'] = f'File was generated but cannot be found at {file_path} or {alt_file_path}'
-        else:
-            generation_status[job_id]['status'] = 'error'
-            generation_status[job_id]['error'] = f'Failed to generate WKT file for {location}'
-            
+        def report_progress(message, stage=None, **fields):
+            if stage is not None:
+                fields['stage'] = stage
+                fields['status'] = STAGE_STATUS.get(stage, 'downloading')
+            update_job_status(task_id, message=message, **fields)
+
+        # Build in a directory of this job's own: another job may be writing the same output_name
+        build_dir = make_build_dir('wkt_output', task_id)
+        try:
+            success, counts, file_path = create_detailed_city_wkt(location, output_name, detail_level, map_size,
+                                                                  save_path=build_dir,
+                                                                  progress_callback=report_progress,
+                                                                  binary_formats=BINARY_OUTPUT_FORMATS,
+                                                                  geometry=geometry, cancel_event=cancel_event)
+            if not success or not file_path:
+                # A cancelled generation stops early; its jobs were already marked cancelled
+                if not cancel_event.is_set():
+                    update_job_status(task_id, status='error', error=f'Failed to generate WKT file for {location}')
+                return
+            if not os.path.exists(file_path):
+                update_job_status(task_id, status='error', error=f'File was generated but cannot be found at {file_path}')
+                return
+
+            # Serve the stable cached copy, then publish wkt_output/<output_name>.wkt (a later
+            # job with the same name replaces it). Cache even if cancelled, so the work is not wasted.
+            with stage('cache_store'):
+                cached_path = wkt_cache.put(cache_key, file_path, counts, location=location,
+                                            detail_level=detail_level, map_size=map_size,
+                                            geometry=geometry._asdict() if geometry else None)
+            output_path = os.path.abspath(publish_output(file_path, 'wkt_output'))
+            record_published(output_path)
+            update_job_status(task_id, status='completed',
+                              message=f'Successfully generated {sum(counts.values())} road segments',
+                              file_path=cached_path, output_path=output_path, counts=counts)
+        finally:
+            remove_build_dir(build_dir)
+
     except Exception as e:
-        generation_status[job_id]['status'] = 'error'
-        generation_status[job_id]['error'] = f'Error: {str(e)}'
+        update_job_status(task_id, status='error', error=f'Error: {str(e)}')
+
+@app.route('/generate_batch', methods=['POST'])
+def generate_batch():
+    """Queue one job generating every item of a JSON manifest (see batch_generator)"""
+    try:
+        items = parse_manifest(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    job_id = f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    job_store.create(
+        job_id,
+        status='queued',
+        message='Waiting for a free worker...',
+        location=f'{len(items)} batch items',
+        detail_level=None,
+        map_size=None,
+        output_name=job_id,
+        file_path=None,
+        error=None,
+        cached=False,
+        items_total=len(items),
+        items_done=0
+    )
+
+    # Identical manifests submitted while one is queued or running share it
+    batch_key = 'batch:' + hashlib.sha256(json.dumps([item._asdict() for item in items]).encode('utf-8')).hexdigest()
+    try:
+        task_id = job_scheduler.submit(job_id, batch_key, generate_batch_background, items)
+    except QueueFullError:
+        job_store.update(job_id, status='error', error='Job queue is full')
+        return jsonify({'error': 'The server is busy. Please try again in a few minutes.'}), 503
+    if task_id != job_id:
+        job_store.update(job_id, attached_to=task_id)
+
+    return jsonify({'job_id': job_id,
+                    'status_url': url_for('get_status', job_id=job_id),
+                    'events_url': url_for('job_events', job_id=job_id)}), 202
+
+def generate_batch_background(task_id, cancel_event, items):
+    """Background task running a batch; each generated map also gets its own downloadable job"""
+    # Areas run on run_batch's threads, so their stages reach /metrics but not the job's metrics
+    with job_metrics(PROFILE_DIR, task_id):
+        _generate_batch(task_id, cancel_event, items)
+
+def _generate_batch(task_id, cancel_event, items):
+    update_job_status(task_id, status='generating', message=f'Generating {len(items)} batch items...')
+    done = [0]
+    lock = threading.Lock()
+
+    def on_result(result):
+        if result['file_path']:
+            if result['output_path']:
+                record_published(result['output_path'])
+            item_job_id = f"{task_id}_{result['indexes'][0]}"
+            job_store.create(item_job_id, status='completed', message=f"Batch item of {task_id}",
+                             location=result['location'], detail_level=result['detail_level'],
+                             map_size=result['map_size'], output_name=result['output_name'],
+                             file_path=result['file_path'], output_path=result['output_path'],
+                             counts=result['counts'], error=None,
+                             cached=result['status'] == 'cached')
+            result['job_id'] = item_job_id
+            result['download_url'] = f"/download/{item_job_id}"
+        with lock:
+            done[0] += len(result['indexes'])
+            update_job_status(task_id, items_done=done[0],
+                              message=f'Finished {done[0]} of {len(items)} batch items')
+
+    try:
+        report = run_batch(items, BATCH_WORKERS, cache=wkt_cache, cancel_event=cancel_event,
+                           on_result=on_result, binary_formats=BINARY_OUTPUT_FORMATS)
+        summary = report['summary']
+        update_job_status(task_id, status='completed', report=report,
+                          message=f"Generated {summary['completed']}, {summary['cached']} from cache, "
+                                  f"{summary['failed']} failed")
+    except Exception as e:
+        update_job_status(task_id, status='error', error=f'Error: {str(e)}')
 
 @app.route('/status/<job_id>')
 def get_status(job_id):
-    """Get generation status for AJAX polling"""
-    status = generation_status.get(job_id, {'status': 'not_found'})
+    """
+    Get generation status for AJAX polling
+
+    With ?since=<version> this long-polls: the response is held until the
+    job's version moves past since, it finishes, or LONG_POLL_TIMEOUT passes.
+    """
+    since = request.args.get('since', type=int)
+    status = job_status_snapshot(job_id)
+    if since is not None and status is not None and status['version'] == since and status['status'] not in TERMINAL_STATES:
+        status = wait_for_status_change(job_id, since, LONG_POLL_TIMEOUT)
+    if status is None:
+        return jsonify({'status': 'not_found'})
     return jsonify(status)
 
+@app.route('/events/<job_id>')
+def job_events(job_id):
+    """Server-Sent Events stream of a job's status, one event per change, ending when the job finishes"""
+    def stream():
+        last = None
+        while True:
+            status = wait_for_status_change(job_id, last['version'] if last else None, EVENTS_KEEPALIVE)
+            if status is None:
+                yield f"data: {json.dumps({'status': 'not_found'})}\n\n"
+                return
+            if status == last:
+                # Keeps proxies from timing out the idle connection
+                yield ": keepalive\n\n"
+                continue
+            # Queue positions change without a version bump; they are picked up on the keepalive tick
+            last = status
+            yield f"data: {json.dumps(status)}\n\n"
+            if status['status'] in TERMINAL_STATES:
+                return
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/cancel/<job_id>', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    status = job_store.get(job_id)
+    if status is None:
+        return jsonify({'cancelled': False, 'message': 'Job not found'}), 404
+    # The store transition decides races with completion; later progress updates are ignored
+    if job_store.update(job_id, only_from=ACTIVE_STATES, status='cancelled', message='Generation cancelled') is None:
+        status = job_store.get(job_id) or status
+        return jsonify({'cancelled': False, 'message': f'Job already {status["status"]}'}), 409
+    # Stops the work if this process runs it; a job running in another app process finishes unseen
+    job_scheduler.cancel(job_id)
+    return jsonify({'cancelled': True, 'message': 'Generation cancelled'})
+
+def negotiate_download_format():
+    """Pick the download format from ?format=, else from the Accept header among the written formats; WKT by default"""
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt
+    offered = ['wkt'] + [fmt for fmt in BINARY_OUTPUT_FORMATS if fmt in DOWNLOAD_MIMETYPES]
+    best = request.accept_mimetypes.best_match([DOWNLOAD_MIMETYPES[fmt] for fmt in offered], default='text/plain')
+    return next(fmt for fmt in offered if DOWNLOAD_MIMETYPES[fmt] == best)
+
 @app.route('/download/<job_id>')
 def download_file(job_id):
-    """Download generated WKT file"""
-    status = generation_status.get(job_id)
+    """
+    Download generated WKT file, or a binary variant (?format=wkb|columnar or by Accept header)
+
+    A precompressed copy is sent when the client accepts its encoding. The
+    ETag is the hash of the representation sent, so If-None-Match and
+    Range requests (for resuming) work on compressed downloads too.
+    """
+    status = job_store.get(job_id)
+    fmt = negotiate_download_format()
+    
+    if fmt not in DOWNLOAD_MIMETYPES:
+        flash(f'Unknown download format "{fmt}". Use one of: {", ".join(DOWNLOAD_MIMETYPES)}', 'error')
+        return redirect(url_for('index'))
     
     if not status:
         flash('Job not found', 'error')
@@ -163,12 +496,26 @@ def download_file(job_id):
             flash(f'File not found. Please regenerate the map for {status["location"]}', 'error')
             return redirect(url_for('index'))
     
+    if fmt != 'wkt':
+        file_path = binary_path_for(file_path, fmt)
+        if not os.path.exists(file_path):
+            flash(f'The {fmt} format was not generated for this map. Please regenerate it.', 'error')
+            return redirect(url_for('index'))
+    
     # Create a safe download filename
     output_name = status['output_name']
-    download_name = f"{output_name}.wkt"
+    download_name = f"{output_name}{EXTENSIONS.get(fmt, '.wkt')}"
     
     try:
-        return send_file(file_path, as_attachment=True, download_name=download_name)
+        etags = file_etags(file_path)
+        encodings = [enc for enc in ENCODINGS if enc in etags and os.path.exists(variant_path(file_path, enc))]
+        encoding = request.accept_encodings.best_match(encodings + ['identity'], default='identity')
+        response = send_file(variant_path(file_path, encoding), as_attachment=True, download_name=download_name,
+                             mimetype=DOWNLOAD_MIMETYPES[fmt], etag=etags[encoding], conditional=True)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.update(('Accept', 'Accept-Encoding'))
+        return response
     except Exception as e:
         flash(f'Error downloading file: {str(e)}', 'error')
         return redirect(url_for('index'))
@@ -183,20 +530,33 @@ def test_city():
         return jsonify({'available': False, 'message': 'Location name is required'})
     
     try:
-        available = test_city_availability(city_name)
-        # Fallback: try appending ', Bangladesh' if not found and no country specified
-        if not available and ',' not in city_name:
-            fallback_city = f"{city_name}, Bangladesh"
-            available = test_city_availability(fallback_city)
-            if available:
-                city_name = fallback_city
-        if available:
+        resolved = get_geocoding_service().resolve(city_name)
+        if resolved is not None:
+            city_name = resolved.query
             return jsonify({'available': True, 'message': f'✅ {city_name} found in OpenStreetMap'})
         else:
             return jsonify({'available': False, 'message': f'❌ {city_name} not found. Try adding country name.'})
     except Exception as e:
         return jsonify({'available': False, 'message': f'Error testing location: {str(e)}'})
 
+@app.route('/cache_stats')
+def cache_stats():
+    """Report the data source and its network cache counters"""
+    source = get_data_source()
+    cache = getattr(source, 'cache', None)
+    return jsonify({'data_source': source.name, 'network_cache': cache.stats() if cache else None})
+
+@app.route('/metrics')
+def metrics():
+    """Stage duration histograms, cache and job counters in the Prometheus text format"""
+    scheduler = job_scheduler.stats()
+    gauges = {
+        'mapgen_jobs_queued': scheduler['queued'],
+        'mapgen_jobs_running': scheduler['running'],
+        'mapgen_jobs_stored': len(job_store),
+    }
+    return Response(render_prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/examples')
 def examples():
     """Show example cities and usage"""
@@ -0,0 +1,305 @@
+# Batch generation of many WKT files from one manifest
+# Identical requests are generated once. All detail levels requested for the same
+# location and radius come from one download of the complete network, and
+# radii of one location run largest first, so the smaller ones are cut from the
+# cached download. Locations run on a bounded number of threads.
+#
+# Usage:
+#   python batch_generator.py manifest.json --workers 4 --report batch_report.json
+#
+# A manifest is a JSON list of items (or {"items": [...]}) such as:
+#   {"location": "Dhaka, Bangladesh", "detail_level": "major", "map_size": 5000,
+#    "output_name": "dhaka_major"}
+# detail_level defaults to 'detailed', map_size to 5000 and output_name to a
+# name built from the other fields. Optional simplify_tolerance (meters),
+# precision (decimals) and merge_chains reduce the output (see simplification).
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import groupby
+
+from geocoding import get_geocoding_service, normalize_location
+from job_store import make_build_dir, publish_output, remove_build_dir
+from map_generator import TILED_MIN_RADIUS_M, create_city_wkt_levels, create_detailed_city_wkt, get_road_filter
+from simplification import DEFAULT_GEOMETRY, GeometryOptions, parse_geometry_options
+from wkt_cache import WKTCache, make_cache_key
+
+# Most inclusive first: a download for an earlier level also covers the later ones
+DETAIL_LEVELS = ('complete', 'detailed', 'major')
+MIN_MAP_SIZE = 500
+MAX_MAP_SIZE = 50000
+DEFAULT_MAP_SIZE = 5000
+
+BatchItem = namedtuple('BatchItem', ['location', 'detail_level', 'map_size', 'output_name', 'simplify_tolerance',
+                                     'precision', 'merge_chains'], defaults=tuple(DEFAULT_GEOMETRY))
+
+def item_geometry(item):
+    """Return the GeometryOptions of a BatchItem"""
+    return GeometryOptions(item.simplify_tolerance, item.precision, item.merge_chains)
+
+def default_output_name(location, detail_level, map_size, geometry=None):
+    """Build a file-name-safe output name for a manifest item"""
+    slug = re.sub(r'[^a-z0-9]+', '_', location.lower()).strip('_')
+    name = f"{slug}_{detail_level}_{map_size}"
+    if geometry and geometry.tolerance_m:
+        name += '_s' + f"{geometry.tolerance_m:g}".replace('.', '_')
+    if geometry and geometry.precision != DEFAULT_GEOMETRY.precision:
+        name += f"_p{geometry.precision}"
+    if geometry and geometry.merge_chains:
+        name += '_merged'
+    return name
+
+def parse_manifest(manifest):
+    """
+    Validate a manifest and return its items
+
+    Args:
+        manifest: List of item dicts, or a dict with an 'items' list
+
+    Returns:
+        List of BatchItem
+
+    Raises:
+        ValueError: If the manifest or one of its items is invalid
+    """
+    if isinstance(manifest, dict):
+        manifest = manifest.get('items')
+    if not isinstance(manifest, list) or not manifest:
+        raise ValueError('Manifest must be a non-empty list of items (or {"items": [...]})')
+
+    items = []
+    for i, entry in enumerate(manifest):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Item {i}: expected an object")
+        location = str(entry.get('location') or '').strip()
+        if not location:
+            raise ValueError(f"Item {i}: location is required")
+        detail_level = entry.get('detail_level') or 'detailed'
+        if detail_level not in DETAIL_LEVELS:
+            raise ValueError(f"Item {i}: detail_level must be one of {', '.join(DETAIL_LEVELS)}")
+        try:
+            map_size = int(entry.get('map_size') or DEFAULT_MAP_SIZE)
+        except (TypeError, ValueError):
+            raise ValueError(f"Item {i}: invalid map_size")
+        if map_size < MIN_MAP_SIZE or map_size > MAX_MAP_SIZE:
+            raise ValueError(f"Item {i}: map_size must be between {MIN_MAP_SIZE} and {MAX_MAP_SIZE} meters")
+        try:
+            geometry = parse_geometry_options(entry.get('simplify_tolerance'), entry.get('precision'),
+                                              entry.get('merge_chains'))
+        except ValueError as e:
+            raise ValueError(f"Item {i}: {e}")
+        output_name = (str(entry.get('output_name') or '').strip()
+                       or default_output_name(location, detail_level, map_size, geometry))
+        items.append(BatchItem(location, detail_level, map_size, output_name, *geometry))
+    return items
+
+def plan_batch(items):
+    """
+    Dedupe items and group them by location
+
+    Returns:
+        List of groups, one per location; each group is a list of
+        (cache_key, item, indexes) ordered largest radius first, then by
+        geometry options and most detailed first, where indexes lists every
+        manifest position asking for that request
+    """
+    requests = OrderedDict()
+    for i, item in enumerate(items):
+        key = make_cache_key(item.location, item.detail_level, item.map_size, item_geometry(item))
+        requests.setdefault(key, (item, []))[1].append(i)
+
+    groups = OrderedDict()
+    for key, (item, indexes) in requests.items():
+        groups.setdefault(normalize_location(item.location), []).append((key, item, indexes))
+    for group in groups.values():
+        group.sort(key=lambda request: (-request[1].map_size, tuple(item_geometry(request[1])),
+                                        DETAIL_LEVELS.index(request[1].detail_level)))
+    return list(groups.values())
+
+def derived_cache_key(item):
+    """Cache key of the item's output when it is filtered from a complete download"""
+    return make_cache_key(item.location, item.detail_level, item.map_size, item_geometry(item), derived=True)
+
+def is_derived_level(detail_level, map_size):
+    """Whether create_city_wkt_levels filters this level from the complete network rather than downloading it"""
+    return get_road_filter(detail_level)[0] is not None and map_size < TILED_MIN_RADIUS_M
+
+def _run_area(requests, save_path, cache, cancel_event, binary_formats):
+    """
+    Run the requests for one location, radius and set of geometry options
+
+    Requests missing from the cache are generated together: one download of
+    the complete network serves every detail level (see create_city_wkt_levels).
+    Levels filtered from it are cached under their derived key, so /generate
+    never serves them; either entry answers a batch item.
+
+    Returns:
+        List of result dicts, in request order
+    """
+    started = time.perf_counter()
+    results = []
+    pending = []
+    for key, item, indexes in requests:
+        result = dict(item._asdict(), status='error', seconds=0.0, segments=0, counts={}, file_path=None,
+                      output_path=None, error=None, shared_download=False)
+        results.append(result)
+        if cancel_event is not None and cancel_event.is_set():
+            result['status'] = 'cancelled'
+            continue
+        cached = (cache.get(key) or cache.get(derived_cache_key(item))) if cache is not None else None
+        if cached:
+            result['file_path'], result['counts'] = cached
+            result.update(status='cached', segments=sum(result['counts'].values()),
+                          seconds=round(time.perf_counter() - started, 3))
+        else:
+            pending.append((key, item, result))
+
+    if not pending:
+        return results
+    location, map_size = pending[0][1].location, pending[0][1].map_size
+    geometry = item_geometry(pending[0][1])
+    # Built privately and published once cached: other areas or jobs may use the same output names
+    build_dir = make_build_dir(save_path)
+    try:
+        resolved = get_geocoding_service().resolve(location)
+        if resolved is None:
+            for _, _, result in pending:
+                result['error'] = f'Location "{location}" not found'
+        else:
+            if len(pending) == 1:
+                _, item, _ = pending[0]
+                generated = {item.detail_level: create_detailed_city_wkt(resolved.query, item.output_name,
+                                                                         item.detail_level, map_size,
+                                                                         save_path=build_dir,
+                                                                         binary_formats=binary_formats,
+                                                                         geometry=geometry,
+                                                                         cancel_event=cancel_event)}
+            else:
+                generated = create_city_wkt_levels(resolved.query,
+                                                   {item.detail_level: item.output_name for _, item, _ in pending},
+                                                   map_size, save_path=build_dir, binary_formats=binary_formats,
+                                                   geometry=geometry, cancel_event=cancel_event)
+            for key, item, result in pending:
+                success, counts, file_path = generated[item.detail_level]
+                if not success and cancel_event is not None and cancel_event.is_set():
+                    result['status'] = 'cancelled'
+                    continue
+                if not success:
+                    result['error'] = f'Failed to generate WKT file for {resolved.query}'
+                    continue
+                cached_path = None
+                if cache is not None:
+                    if len(pending) > 1 and is_derived_level(item.detail_level, map_size):
+                        key = derived_cache_key(item)
+                    cached_path = cache.put(key, file_path, counts, location=resolved.query,
+                                            detail_level=item.detail_level, map_size=map_size,
+                                            geometry=geometry._asdict())
+                output_path = os.path.abspath(publish_output(file_path, save_path))
+                result.update(status='completed', file_path=cached_path or output_path, output_path=output_path,
+                              counts=dict(counts), segments=sum(counts.values()))
+    except Exception as e:
+        for _, _, result in pending:
+            result['error'] = f'Error: {e}'
+    finally:
+        remove_build_dir(build_dir)
+    seconds = round(time.perf_counter() - started, 3)
+    for _, _, result in pending:
+        result.update(seconds=seconds, shared_download=len(pending) > 1)
+    return results
+
+def run_batch(items, max_workers=2, save_path='wkt_output', cache=None, cancel_event=None, on_result=None,
+              binary_formats=()):
+    """
+    Generate every item of a batch
+
+    Args:
+        items: List of BatchItem (see parse_manifest)
+        max_workers: Number of locations generated at the same time
+        save_path: Directory for generated files
+        cache: Optional WKTCache; hits skip generation and new files are added to it
+        cancel_event: Optional threading.Event; items not started when it is set are
+            cancelled, and running generations stop at their next stage or tile
+        on_result: Optional callable(result) called as each unique request finishes;
+            result['indexes'] lists the manifest items it answers
+        binary_formats: Binary formats to write next to each WKT file
+
+    Returns:
+        Report dict with one entry per manifest item, in manifest order, and a summary
+    """
+    started = time.time()
+    groups = plan_batch(items)
+    results = [None] * len(items)
+    lock = threading.Lock()
+
+    def run_group(group):
+        for _, same_size in groupby(group, key=lambda request: (request[1].map_size, item_geometry(request[1]))):
+            requests = list(same_size)
+            area_results = _run_area(requests, save_path, cache, cancel_event, binary_formats)
+            for (key, item, indexes), result in zip(requests, area_results):
+                result['indexes'] = indexes
+                print(f"[batch] {item.location} ({item.detail_level}, {item.map_size}m): {result['status']} "
+                      f"in {result['seconds']:.1f}s")
+                if on_result:
+                    on_result(result)
+                with lock:
+                    for n, i in enumerate(indexes):
+                        entry = {k: v for k, v in result.items() if k != 'indexes'}
+                        # Duplicates share the first item's file instead of writing their own
+                        entry.update(items[i]._asdict(), index=i, duplicate_of=indexes[0] if n else None)
+                        results[i] = entry
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for _ in executor.map(run_group, groups):
+            pass
+
+    statuses = [result['status'] for result in results]
+    return {
+        'started': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+        'elapsed_seconds': round(time.time() - started, 3),
+        'summary': {
+            'items': len(items),
+            'unique': sum(len(group) for group in groups),
+            'locations': len(groups),
+            'completed': statuses.count('completed'),
+            'cached': statuses.count('cached'),
+            'failed': statuses.count('error'),
+            'cancelled': statuses.count('cancelled'),
+        },
+        'items': results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate WKT files for every item of a JSON manifest')
+    parser.add_argument('manifest', help='JSON manifest file')
+    parser.add_argument('--workers', type=int, default=2, help='Number of locations generated at the same time')
+    parser.add_argument('--output-dir', default='wkt_output', help='Directory for generated files')
+    parser.add_argument('--report', default='batch_report.json', help='Where to write the JSON report')
+    parser.add_argument('--cache-dir', default='wkt_output/cache', help='WKT cache directory shared with the web app')
+    parser.add_argument('--no-cache', action='store_true', help='Regenerate every item, ignoring the WKT cache')
+    parser.add_argument('--formats', nargs='*', default=[], choices=['wkb', 'columnar'],
+                        help='Binary formats to write next to each WKT file')
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        items = parse_manifest(json.load(f))
+    cache = None if args.no_cache else WKTCache(args.cache_dir)
+    report = run_batch(items, args.workers, args.output_dir, cache, binary_formats=args.formats)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    summary = report['summary']
+    print(f"Batch finished in {report['elapsed_seconds']:.1f}s: {summary['completed']} generated, "
+          f"{summary['cached']} from cache, {summary['failed']} failed "
+          f"({summary['items']} items, {summary['unique']} unique, {summary['locations']} locations)")
+    print(f"Report: {args.report}")
+    return 1 if summary['failed'] else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+# Benchmark: file size and load time of text WKT vs the wkb and columnar binary formats
+#
+# Usage:
+#   python benchmarks/bench_binary_formats.py
+#   python benchmarks/bench_binary_formats.py --sizes 10000 100000
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_wkt_serialization import make_edges
+from binary_formats import binary_path_for, load_columnar, load_wkb
+from map_generator import write_edges_wkt
+
+def load_wkt_lines(path):
+    """Parse a WKT file line by line into coordinate arrays, the way downstream simulators do"""
+    lines = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            body = line[line.index('(') + 1:line.rindex(')')]
+            lines.append(np.array(body.replace(',', ' ').split(), dtype=np.float64).reshape(-1, 2))
+    return lines
+
+def load_wkt_shapely(path):
+    """Parse a WKT file into shapely geometries"""
+    with open(path) as f:
+        return shapely.from_wkt([line for line in f if not line.startswith('#')])
+
+def load_columnar_scan(path):
+    """Map a columnar file and touch every coordinate, so all pages are actually read"""
+    header, arrays = load_columnar(path)
+    arrays['coords'].sum()
+    return arrays
+
+def timed(fn, path, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(path)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare WKT with the binary output formats')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3, help='Best of this many loads is reported')
+    args = parser.parse_args()
+
+    print(f"{'edges':>10} {'format':>16} {'size (MB)':>10} {'load (s)':>10} {'vs wkt':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_edges in args.sizes:
+            wkt_file = os.path.join(tmp, f"bench_{n_edges}.wkt")
+            write_edges_wkt(make_edges(n_edges), wkt_file, 'Benchmark', 'detailed', 'EPSG:32646',
+                            binary_formats=('wkb', 'columnar'))
+            columnar_file = binary_path_for(wkt_file, 'columnar')
+            cases = [
+                ('wkt lines', wkt_file, load_wkt_lines),
+                ('wkt shapely', wkt_file, load_wkt_shapely),
+                ('wkb', binary_path_for(wkt_file, 'wkb'), load_wkb),
+                ('columnar mmap', columnar_file, load_columnar),
+                ('columnar scan', columnar_file, load_columnar_scan),
+            ]
+            baseline = None
+            for name, path, load in cases:
+                seconds = timed(load, path, args.repeat)
+                baseline = baseline or seconds
+                print(f"{n_edges:>10} {name:>16} {os.path.getsize(path) / 1e6:>10.2f} {seconds:>10.4f} "
+                      f"{baseline / seconds:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Benchmark: incremental refresh vs full regeneration after a local edit
+#
+# Builds two snapshots of the same synthetic area (the second with the nodes of
+# a small box moved), generates the first incrementally, refreshes it with the
+# second and checks the result is byte-identical to a fresh build of the
+# second snapshot. Runs offline: both snapshots are read as local extracts.
+#
+# Usage:
+#   python benchmarks/bench_incremental.py
+#   python benchmarks/bench_incremental.py --grid 160 --edit-size 500 --tile-size 1000
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_pipeline import FIXTURE_LOCATION, FixtureNetwork, StubGeocoder
+from fixtures import write_edited_snapshot, write_grid_osm_xml
+
+def generate(extract, out_dir, name, radius, index_dir=None, tile_size=None):
+    """Generate FIXTURE_LOCATION from an extract; incremental when index_dir is given. Returns (seconds, path)"""
+    import incremental
+    import map_generator
+    from data_sources import LocalExtractSource, set_data_source
+
+    source = LocalExtractSource(extract)
+    source.index.ensure_built()
+    set_data_source(source)
+    incremental.INCREMENTAL_DIR = index_dir or incremental.INCREMENTAL_DIR
+    incremental.INCREMENTAL_TILE_SIZE_M = tile_size or incremental.INCREMENTAL_TILE_SIZE_M
+    t0 = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        success, _, wkt_file = map_generator.create_detailed_city_wkt(
+            FIXTURE_LOCATION, name, 'complete', radius, save_path=out_dir, incremental=index_dir is not None)
+    if not success:
+        raise RuntimeError(f"Generation of {extract} failed")
+    return time.perf_counter() - t0, wkt_file
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental refresh benchmark')
+    parser.add_argument('--grid', type=int, default=120, help='Fixture grid size (nodes per side)')
+    parser.add_argument('--edit-size', type=float, default=300, help='Side of the edited box in meters')
+    parser.add_argument('--tile-size', type=int, default=2000, help='Incremental tile size in meters')
+    args = parser.parse_args()
+
+    from geocoding import GeocodingService, set_geocoding_service
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Short ways, like real streets, so an edit only touches the tiles around it
+        before = write_grid_osm_xml(os.path.join(tmp, 'before.osm'), args.grid, way_length=5)
+        network = FixtureNetwork(before)
+        lat, lon = network.bbox[1] + 0.001 * 5, network.bbox[0] + 0.001 * 5
+        half = args.edit_size / 2 / 111320
+        after = os.path.join(tmp, 'after.osm')
+        moved = write_edited_snapshot(before, after, (lat + half, lat - half, lon + half, lon - half))
+        set_geocoding_service(GeocodingService(StubGeocoder(*network.center, network.bbox), db_path=None))
+        out_dir = os.path.join(tmp, 'out')
+        print(f"Fixture: {len(network.graph)} nodes, radius {network.radius} m, {moved} nodes moved in the second snapshot")
+
+        index_dir = os.path.join(tmp, 'index')
+        rows = [
+            ('full (not incremental)', generate(after, out_dir, 'plain', network.radius)),
+            ('first incremental build', generate(before, out_dir, 'incremental', network.radius, index_dir,
+                                                 args.tile_size)),
+            ('incremental refresh', generate(after, out_dir, 'incremental', network.radius, index_dir,
+                                             args.tile_size)),
+            ('fresh incremental build', generate(after, out_dir, 'fresh', network.radius,
+                                                 os.path.join(tmp, 'fresh_index'), args.tile_size)),
+        ]
+        print(f"{'run':>26} {'time (s)':>9}")
+        for name, (seconds, _) in rows:
+            print(f"{name:>26} {seconds:>9.3f}")
+
+        with open(rows[2][1][1]) as refreshed, open(rows[3][1][1]) as fresh:
+            identical = refreshed.read() == fresh.read()
+        print(f"Refreshed output identical to a fresh build: {identical}")
+        print(f"Refresh speedup over a fresh incremental build: {rows[3][1][0] / rows[2][1][0]:.1f}x")
+        return 0 if identical else 1
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,365 @@
+# Benchmark: end-to-end create_detailed_city_wkt runs on offline fixtures
+#
+# Every fixture (synthetic street grids of several sizes, plus any recorded OSM
+# XML given with --osm) is generated at each detail level in a fresh process,
+# with a stub geocoder and the osmnx download functions replaced by lookups in
+# the fixture. With --source cached, downloads go through the network cache
+# instead, to a stand-in Overpass API answering from the fixture. Reports end-to-end and per-stage time, peak RSS and output bytes,
+# writes them as JSON and, given a baseline JSON, fails on regressions.
+#
+# Usage:
+#   python benchmarks/bench_pipeline.py --output bench_results.json
+#   python benchmarks/bench_pipeline.py --baseline bench_results.json --threshold 0.15
+#   python benchmarks/bench_pipeline.py --grids 40 --osm recorded/dhaka.osm --levels major
+#   python benchmarks/bench_pipeline.py --source cached --output bench_cached.json
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fixtures import write_grid_osm_xml
+
+DETAIL_LEVELS = ('complete', 'detailed', 'major')
+SOURCES = ('overpass', 'cached')
+DEFAULT_GRIDS = (30, 80, 160)
+FIXTURE_LOCATION = 'Benchmark City'
+
+StubLocation = namedtuple('StubLocation', ['latitude', 'longitude', 'raw'])
+
+class StubGeocoder:
+    """geopy-style geocoder answering every query with the fixture's center"""
+
+    def __init__(self, lat, lon, bbox):
+        self.location = StubLocation(lat, lon, {'boundingbox': [bbox[1], bbox[3], bbox[0], bbox[2]]})
+
+    def geocode(self, query):
+        return self.location
+
+class FixtureNetwork:
+    """
+    Stand-in for the osmnx download functions, answering from one OSM XML file
+
+    The file is loaded unsimplified once; each call keeps the edges matching
+    the request's filter inside its box and then simplifies, like osmnx does
+    with an Overpass response.
+    """
+
+    def __init__(self, path):
+        import osmnx as ox
+        self.graph = ox.graph_from_xml(path, simplify=False, retain_all=True)
+        lats = [data['y'] for _, data in self.graph.nodes(data=True)]
+        lons = [data['x'] for _, data in self.graph.nodes(data=True)]
+        self.bbox = (min(lons), min(lats), max(lons), max(lats))
+        self.center = ((self.bbox[1] + self.bbox[3]) / 2, (self.bbox[0] + self.bbox[2]) / 2)
+        # Radius whose download box covers the whole fixture
+        half_height = (self.bbox[3] - self.bbox[1]) / 2 * 111320
+        half_width = (self.bbox[2] - self.bbox[0]) / 2 * 111320 * math.cos(math.radians(self.center[0]))
+        self.radius = int(math.ceil(max(half_height, half_width, 500)))
+
+    def graph_from_bbox(self, north, south, east, west, network_type='all_private', simplify=True, retain_all=False,
+                        truncate_by_edge=False, clean_periphery=None, custom_filter=None):
+        import osmnx as ox
+        from data_sources import parse_overpass_filter, tags_match
+        from osmnx import _overpass
+
+        clauses = parse_overpass_filter(custom_filter or _overpass._get_osm_filter(network_type))
+        edges = [(u, v, k) for u, v, k, data in self.graph.edges(keys=True, data=True) if tags_match(data, clauses)]
+        G = self.graph.edge_subgraph(edges).copy()
+        G = ox.truncate.truncate_graph_bbox(G, north, south, east, west, truncate_by_edge=truncate_by_edge,
+                                            retain_all=True)
+        if not retain_all and len(G):
+            G = ox.utils_graph.get_largest_component(G)
+        return ox.simplify_graph(G) if simplify and len(G) else G
+
+    def graph_from_point(self, center_point, dist=1000, dist_type='bbox', network_type='all_private', **kwargs):
+        import osmnx as ox
+        north, south, east, west = ox.utils_geo.bbox_from_point(center_point, dist)
+        return self.graph_from_bbox(north, south, east, west, network_type, **kwargs)
+
+    def graph_from_place(self, query, network_type='all_private', which_result=None, buffer_dist=None, **kwargs):
+        west, south, east, north = self.bbox
+        return self.graph_from_bbox(north, south, east, west, network_type, **kwargs)
+
+class FixtureOverpass:
+    """
+    Stand-in for the Overpass API, answering queries from one OSM XML file
+
+    Replaces osmnx's Overpass download rather than its graph functions, so
+    osmnx (and the network cache) build graphs from the responses as they
+    would online. A query returns the highway ways matching its filter that
+    cross its polygon, with all of their nodes, like Overpass's
+    (way[...](poly:...);>;) query. The change checks of incremental
+    refreshes are answered from the elements' timestamp attributes.
+    """
+
+    def __init__(self, path):
+        self.requests = 0
+        self.checks = 0
+        self.load(path)
+
+    def load(self, path):
+        """Answer from another OSM XML file from now on, e.g. a later snapshot of the same area"""
+        import xml.etree.ElementTree as ET
+
+        import shapely
+
+        nodes, ways, edited = {}, [], {}
+        for _, elem in ET.iterparse(path):
+            if elem.tag == 'node':
+                nodes[int(elem.get('id'))] = (float(elem.get('lat')), float(elem.get('lon')))
+                edited['node', int(elem.get('id'))] = elem.get('timestamp', '')
+            elif elem.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+                if 'highway' in tags:
+                    ways.append((int(elem.get('id')), tags, [int(nd.get('ref')) for nd in elem.iter('nd')]))
+                    edited['way', int(elem.get('id'))] = elem.get('timestamp', '')
+        self.nodes, self.ways, self.edited = nodes, ways, edited
+        self.timestamp = max(edited.values(), default='') or '1970-01-01T00:00:00Z'
+        self.tree = shapely.STRtree([shapely.linestrings([nodes[ref][::-1] for ref in refs]) for _, _, refs in ways])
+
+    def _matching(self, polygon, osm_filter):
+        from data_sources import parse_overpass_filter, tags_match
+
+        clauses = parse_overpass_filter(osm_filter)
+        return [self.ways[i] for i in sorted(self.tree.query(polygon, predicate='intersects').tolist())
+                if tags_match(self.ways[i][1], clauses)]
+
+    def _response(self, elements):
+        return {'osm3s': {'timestamp_osm_base': self.timestamp}, 'elements': elements}
+
+    def _ways_response(self, polygon, osm_filter):
+        self.requests += 1
+        ways, refs = [], set()
+        for way_id, tags, way_refs in self._matching(polygon, osm_filter):
+            ways.append({'type': 'way', 'id': way_id, 'nodes': way_refs, 'tags': tags})
+            refs.update(way_refs)
+        nodes = [{'type': 'node', 'id': ref, 'lat': self.nodes[ref][0], 'lon': self.nodes[ref][1]}
+                 for ref in sorted(refs)]
+        return self._response(nodes + ways)
+
+    def download(self, polygon, network_type, custom_filter):
+        """Yield the response of one query, in place of osmnx's _overpass._download_overpass_network"""
+        from osmnx import _overpass
+
+        yield self._ways_response(polygon, custom_filter or _overpass._get_osm_filter(network_type))
+
+    def request(self, query):
+        """Answer one query of network_cache (a download or a change check), in place of its overpass_request"""
+        import re
+
+        import shapely
+
+        osm_filter, coords = re.search(r"way(.*?)\(poly:'([^']*)'\)", query).groups()
+        values = [float(value) for value in coords.split()]
+        polygon = shapely.Polygon(list(zip(values[1::2], values[0::2])))
+        if 'out ids' not in query:
+            return self._ways_response(polygon, osm_filter)
+
+        self.checks += 1
+        ways = self._matching(polygon, osm_filter)
+        elements = [{'type': 'way', 'id': way_id} for way_id, _, _ in ways]
+        since = re.search(r'newer:"([^"]+)"', query)
+        if since:
+            touched = {('way', way_id) for way_id, _, _ in ways}
+            touched.update(('node', ref) for _, _, refs in ways for ref in refs)
+            edited = sum(1 for element in touched if self.edited[element] > since.group(1))
+            elements.append({'type': 'count', 'id': 0, 'tags': {'total': str(edited)}})
+        return self._response(elements)
+
+def install_fixture_overpass(path):
+    """Route this process's Overpass requests (osmnx's and network_cache's) to a fixture; returns the FixtureOverpass"""
+    import network_cache
+    from osmnx import _overpass
+
+    overpass = FixtureOverpass(path)
+    _overpass._download_overpass_network = overpass.download
+    network_cache.overpass_request = overpass.request
+    return overpass
+
+def install_offline(path):
+    """Route geocoding and osmnx downloads of this process to a fixture; returns the FixtureNetwork"""
+    import osmnx as ox
+    from data_sources import OverpassSource, set_data_source
+    from geocoding import GeocodingService, set_geocoding_service
+
+    network = FixtureNetwork(path)
+    ox.graph_from_bbox = network.graph_from_bbox
+    ox.graph_from_point = network.graph_from_point
+    ox.graph_from_place = network.graph_from_place
+    # Plain Overpass source: the network cache would answer repeats without running the download stage
+    set_data_source(OverpassSource())
+    set_geocoding_service(GeocodingService(StubGeocoder(*network.center, network.bbox), db_path=None))
+    return network
+
+def output_bytes(wkt_file, binary_formats):
+    """Total size of a generated WKT file and its binary siblings"""
+    from binary_formats import binary_path_for
+    paths = [wkt_file] + [binary_path_for(wkt_file, fmt) for fmt in binary_formats]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+def run_case(fixture_path, detail_level, repeat, binary_formats, source='overpass'):
+    """
+    Generate one fixture at one detail level, repeat + 1 times (the first run is a warm-up)
+
+    Runs in its own process so peak memory is not inherited from other cases.
+    With source 'cached' the runs go through a CachingOverpassSource with an
+    empty cache, so the warm-up run downloads and the timed runs reuse it.
+
+    Returns:
+        Result dict with medians over the timed runs
+    """
+    import map_generator
+    from data_sources import set_data_source
+    from metrics import job_metrics
+    from network_cache import CachingOverpassSource, NetworkCache
+
+    network = install_offline(fixture_path)
+    runs = []
+    # The generator's progress prints would bury the results table
+    with tempfile.TemporaryDirectory() as out_dir, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        if source == 'cached':
+            overpass = install_fixture_overpass(fixture_path)
+            set_data_source(CachingOverpassSource(NetworkCache(os.path.join(out_dir, 'network_cache'))))
+        for i in range(repeat + 1):
+            with job_metrics() as profile:
+                t0 = time.perf_counter()
+                success, counts, wkt_file = map_generator.create_detailed_city_wkt(
+                    FIXTURE_LOCATION, 'bench', detail_level, network.radius, save_path=out_dir,
+                    binary_formats=binary_formats)
+                wall = time.perf_counter() - t0
+            if not success:
+                raise RuntimeError(f"Generation failed for {fixture_path} ({detail_level})")
+            stages = Counter()
+            for record in profile.stages:
+                stages[record['stage']] += record['wall_s']
+            if i:
+                runs.append({'wall_s': wall, 'stages': stages, 'segments': sum(counts.values()),
+                             'peak_rss_mb': profile.as_dict()['peak_rss_mb'],
+                             'output_bytes': output_bytes(wkt_file, binary_formats)})
+
+    stage_names = sorted({name for run in runs for name in run['stages']})
+    return {
+        'wall_s': round(statistics.median(run['wall_s'] for run in runs), 4),
+        'wall_runs_s': [round(run['wall_s'], 4) for run in runs],
+        'stages_s': {name: round(statistics.median(run['stages'][name] for run in runs), 4) for name in stage_names},
+        'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+        'output_bytes': runs[-1]['output_bytes'],
+        'segments': runs[-1]['segments'],
+        'nodes': len(network.graph),
+        'overpass_requests': overpass.requests if source == 'cached' else None,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, baseline, threshold, min_delta=0.0):
+    """
+    Compare end-to-end times with a baseline run
+
+    A case regresses when it is more than threshold (relative) and
+    min_delta seconds slower, so noise on tiny fixtures is not flagged.
+
+    Returns:
+        List of (case, baseline seconds, seconds, relative change, regressed) for cases in both runs
+    """
+    rows = []
+    for case, result in results['cases'].items():
+        before = baseline['cases'].get(case)
+        if before is None:
+            continue
+        change = result['wall_s'] / before['wall_s'] - 1 if before['wall_s'] else 0.0
+        regressed = change > threshold and result['wall_s'] - before['wall_s'] > min_delta
+        rows.append((case, before['wall_s'], result['wall_s'], change, regressed))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark of create_detailed_city_wkt')
+    parser.add_argument('--grids', type=int, nargs='*', default=list(DEFAULT_GRIDS),
+                        help='Synthetic grid fixture sizes (nodes per side)')
+    parser.add_argument('--osm', nargs='*', default=[], help='Recorded OSM XML files to use as extra fixtures')
+    parser.add_argument('--levels', nargs='+', default=list(DETAIL_LEVELS), choices=DETAIL_LEVELS)
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case, after one warm-up run')
+    parser.add_argument('--formats', nargs='*', default=[], choices=['wkb', 'columnar'],
+                        help='Binary formats written next to each WKT file')
+    parser.add_argument('--source', default='overpass', choices=SOURCES,
+                        help="Data source: plain Overpass, or through the network cache ('cached')")
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the JSON results')
+    parser.add_argument('--baseline', help='Results JSON of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative slowdown of a case counted as a regression (0.10 = 10%%)')
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help='Smallest slowdown in seconds counted as a regression')
+    args = parser.parse_args()
+
+    # Fixed hash seed so the generated files, and their sizes, are identical between runs
+    os.environ['PYTHONHASHSEED'] = '0'
+    results = {
+        'meta': {
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'formats': args.formats,
+            'source': args.source,
+        },
+        'cases': {},
+    }
+
+    print(f"{'case':>28} {'nodes':>7} {'segments':>9} {'time (s)':>9} {'peak MB':>8} {'output MB':>10}  slowest stages")
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = [(f"grid{size}", write_grid_osm_xml(os.path.join(tmp, f"grid_{size}.osm"), size))
+                    for size in args.grids]
+        fixtures += [(os.path.splitext(os.path.basename(path))[0], os.path.abspath(path)) for path in args.osm]
+        for name, path in fixtures:
+            for level in args.levels:
+                case = f"{name}/{level}" + ('' if args.source == 'overpass' else f"/{args.source}")
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    result = executor.submit(run_case, path, level, args.repeat, args.formats,
+                                             args.source).result()
+                results['cases'][case] = result
+                slowest = sorted(result['stages_s'].items(), key=lambda item: -item[1])[:3]
+                print(f"{case:>28} {result['nodes']:>7} {result['segments']:>9} {result['wall_s']:>9.3f} "
+                      f"{result['peak_rss_mb']:>8.1f} {result['output_bytes'] / 1e6:>10.2f}  "
+                      + ", ".join(f"{stage} {seconds:.3f}" for stage, seconds in slowest))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results: {args.output}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(results, baseline, args.threshold, args.min_delta)
+    print(f"\nCompared with {args.baseline} (revision {baseline['meta'].get('revision')}), "
+          f"threshold {args.threshold:.0%}")
+    print(f"{'case':>28} {'baseline (s)':>12} {'now (s)':>9} {'change':>8}")
+    for case, before, now, change, regressed in rows:
+        print(f"{case:>28} {before:>12.3f} {now:>9.3f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    regressions = sum(1 for row in rows if row[4])
+    print(f"{regressions} of {len(rows)} cases regressed")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,74 @@
+# Benchmark: generation throughput with the CPU-heavy stages in a process pool
+#
+# Runs a batch of offline OSM XML fixtures through create_detailed_city_wkt with
+# thread-only execution and with process pools of increasing size.
+#
+# Usage:
+#   python benchmarks/bench_process_pool.py --jobs 8 --grid 80
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import map_generator
+from fixtures import write_grid_osm_xml
+
+def load_fixture(city_name, custom_filter=None):
+    """Stand-in for download_graph_from_place: the 'city name' is a fixture path"""
+    import osmnx as ox
+    return ox.graph_from_xml(city_name, retain_all=True)
+
+def offline_worker_init():
+    map_generator.warm_up_worker()
+    map_generator.download_graph_from_place = load_fixture
+
+def run_batch(fixtures, out_dir, threads):
+    """Generate every fixture with `threads` concurrent jobs; returns elapsed seconds"""
+    def job(i):
+        ok, counts, path = map_generator.create_detailed_city_wkt(
+            fixtures[i], f"bench_{i}", 'complete', save_path=out_dir)
+        if not ok:
+            raise RuntimeError(f"Generation failed for {fixtures[i]}")
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(job, range(len(fixtures))))
+    return time.perf_counter() - t0
+
+def main():
+    parser = argparse.ArgumentParser(description='Process pool throughput benchmark')
+    parser.add_argument('--jobs', type=int, default=8, help='Number of fixtures in the batch')
+    parser.add_argument('--grid', type=int, default=80, help='Fixture grid size (nodes per side)')
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help='Process pool sizes to try (default: 1, 2, 4 ... up to the CPU count)')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    workers = args.workers or sorted({2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus} | {cpus})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = [write_grid_osm_xml(os.path.join(tmp, f"grid_{i}.osm"), args.grid, seed=i)
+                    for i in range(args.jobs)]
+        out_dir = os.path.join(tmp, 'out')
+
+        map_generator.download_graph_from_place = load_fixture
+        map_generator.set_process_pool(None)
+        baseline = run_batch(fixtures, out_dir, threads=max(workers))
+        print(f"{'mode':>16} {'time (s)':>10} {'jobs/s':>8} {'speedup':>8}")
+        print(f"{'threads only':>16} {baseline:>10.2f} {args.jobs / baseline:>8.2f} {1.0:>7.1f}x")
+
+        for n in workers:
+            pool = map_generator.make_process_pool(n, initializer=offline_worker_init)
+            map_generator.set_process_pool(pool)
+            try:
+                elapsed = run_batch(fixtures, out_dir, threads=n)
+            finally:
+                map_generator.set_process_pool(None)
+                pool.shutdown()
+            print(f"{f'{n} processes':>16} {elapsed:>10.2f} {args.jobs / elapsed:>8.2f} {baseline / elapsed:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Benchmark: output size and vertex count with geometry simplification options
+#
+# Generates the 'complete' and 'major' levels of a synthetic street grid (with
+# extra shape nodes along every block) from one download, with several
+# tolerance / precision / chain merging settings, and reports segments,
+# vertices, WKT size and time per level against the full-density output.
+#
+# Usage:
+#   python benchmarks/bench_simplification.py
+#   python benchmarks/bench_simplification.py --grid 120 --shape-points 6 --tolerances 0 1 5 --precisions 2 1
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_pipeline import FIXTURE_LOCATION, install_offline
+from fixtures import write_grid_osm_xml
+
+LEVELS = ('complete', 'major')
+
+def wkt_stats(path):
+    """Return (segments, vertices, bytes) of a WKT file"""
+    segments = vertices = 0
+    with open(path) as f:
+        for line in f:
+            if line.startswith('LINESTRING'):
+                segments += 1
+                vertices += line.count(',') + 1
+    return segments, vertices, os.path.getsize(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Output size with geometry simplification options')
+    parser.add_argument('--grid', type=int, default=80, help='Fixture grid size (nodes per side)')
+    parser.add_argument('--shape-points', type=int, default=4, help='Extra nodes along every block')
+    parser.add_argument('--tolerances', type=float, nargs='+', default=[0, 1, 3, 10],
+                        help='Douglas-Peucker tolerances in meters')
+    parser.add_argument('--precisions', type=int, nargs='+', default=[2, 1, 0], help='Coordinate decimals')
+    args = parser.parse_args()
+
+    import map_generator
+    from simplification import GeometryOptions
+
+    with tempfile.TemporaryDirectory() as tmp:
+        network = install_offline(write_grid_osm_xml(os.path.join(tmp, 'grid.osm'), args.grid, way_length=3,
+                                                     shape_points=args.shape_points))
+        cases = [GeometryOptions(tolerance, args.precisions[0], False) for tolerance in args.tolerances]
+        cases += [GeometryOptions(args.tolerances[0], precision, False) for precision in args.precisions[1:]]
+        cases += [GeometryOptions(args.tolerances[0], args.precisions[0], True),
+                  GeometryOptions(max(args.tolerances), min(args.precisions), True)]
+
+        print(f"Fixture: {len(network.graph)} nodes, radius {network.radius} m")
+        print(f"{'tolerance':>9} {'decimals':>8} {'merge':>5} {'level':>8} {'segments':>9} {'vertices':>9} "
+              f"{'WKT MB':>7} {'size':>6} {'time (s)':>9}")
+        baseline = {}
+        for options in cases:
+            out_dir = os.path.join(tmp, 'out')
+            names = {level: f"{level}_{len(baseline)}" for level in LEVELS}
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                t0 = time.perf_counter()
+                results = map_generator.create_city_wkt_levels(FIXTURE_LOCATION, names, network.radius,
+                                                               save_path=out_dir, geometry=options)
+                seconds = time.perf_counter() - t0
+            for level in LEVELS:
+                success, _, wkt_file = results[level]
+                if not success:
+                    raise RuntimeError(f"Generation failed for {options} ({level})")
+                segments, vertices, size = wkt_stats(wkt_file)
+                baseline.setdefault(level, size)
+                print(f"{options.tolerance_m:>9g} {options.precision:>8} {'yes' if options.merge_chains else 'no':>5} "
+                      f"{level:>8} {segments:>9} {vertices:>9} {size / 1e6:>7.2f} {size / baseline[level]:>6.0%} "
+                      f"{seconds:>9.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# Benchmark: app import time and first-job latency, with and without warm-up
+#
+# Import times are measured in fresh interpreters, next to the app imported
+# after the geo libraries, as it was before they were deferred. First-job latency runs a
+# fixture through create_detailed_city_wkt in a fresh process, where the
+# download returns a pickled graph so the geo libraries are first imported by
+# the job itself (cold) or by map_generator.warm_up beforehand (warm).
+#
+# Usage:
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --repeat 10 --grid 80
+#   python benchmarks/bench_startup.py --check   # exit 1 if importing the app loads a deferred library
+
+import argparse
+import os
+import pickle
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fixtures import write_grid_osm_xml
+
+GEO_MODULES = ('osmnx', 'geopandas', 'pyproj', 'pandas', 'networkx', 'shapely', 'numpy')
+# Libraries importing the app must not load; numpy and shapely are imported eagerly on purpose
+DEFERRED_MODULES = ('osmnx', 'geopandas', 'pyproj', 'pandas', 'networkx')
+# Label and modules of each import timed
+IMPORTS = [
+    ('app', 'app'),
+    ('map_generator', 'map_generator'),
+    ('osmnx, geopandas', 'osmnx, geopandas'),
+    ('app, eager geo imports', 'osmnx, geopandas, pyproj, app'),
+]
+
+IMPORT_SCRIPT = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+print(time.perf_counter() - t0)
+print(",".join(m for m in {modules!r} if m in sys.modules))
+"""
+
+def time_import(module, cwd):
+    """Import module in a fresh interpreter; returns (seconds, geo modules it loaded)"""
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module, modules=GEO_MODULES)],
+                            cwd=cwd, env=dict(os.environ, PYTHONPATH=ROOT), capture_output=True, text=True,
+                            check=True).stdout.split("\n")
+    return float(output[0]), output[1] or '-'
+
+def first_jobs(graph_file, center, radius, warm):
+    """
+    Run two jobs in this (fresh) process
+
+    Returns:
+        Dict of 'warm_up_s' (None when cold), 'first_s' and 'second_s'
+    """
+    import contextlib
+    import map_generator
+    from bench_pipeline import StubGeocoder
+    from geocoding import GeocodingService, set_geocoding_service
+
+    def load_graph(point, dist, custom_filter=None):
+        with open(graph_file, 'rb') as f:
+            return pickle.load(f)
+
+    map_generator.download_graph_from_point = load_graph
+    set_geocoding_service(GeocodingService(StubGeocoder(*center, (0, 0, 0, 0)), db_path=None))
+    result = {'warm_up_s': None}
+    with tempfile.TemporaryDirectory() as out_dir, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        if warm:
+            t0 = time.perf_counter()
+            map_generator.warm_up([map_generator.get_utm_zone(*center)])
+            result['warm_up_s'] = time.perf_counter() - t0
+        for run in ('first_s', 'second_s'):
+            t0 = time.perf_counter()
+            success, _, _ = map_generator.create_detailed_city_wkt('Benchmark City', 'bench', 'complete', radius,
+                                                                   save_path=out_dir)
+            result[run] = time.perf_counter() - t0
+            if not success:
+                raise RuntimeError('Generation failed')
+    return result
+
+def median(values):
+    return statistics.median(values) if values else float('nan')
+
+def main():
+    parser = argparse.ArgumentParser(description='App import time and first-job latency')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh processes per measurement; medians are reported')
+    parser.add_argument('--grid', type=int, default=60, help='Fixture grid size (nodes per side)')
+    parser.add_argument('--check', action='store_true',
+                        help='Only time the imports; exit 1 if importing the app loads a deferred library')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'import':>28} {'time (s)':>9}  geo modules loaded")
+        times, loaded = {}, {}
+        for label, modules in IMPORTS:
+            runs = [time_import(modules, tmp) for _ in range(args.repeat)]
+            times[label], loaded[label] = median([seconds for seconds, _ in runs]), runs[-1][1]
+            print(f"{label:>28} {times[label]:>9.3f}  {loaded[label]}")
+        print(f"\nDeferred imports make the app import {times['app, eager geo imports'] / times['app']:.1f}x faster")
+        if args.check:
+            eager = [module for module in loaded['app'].split(',') if module in DEFERRED_MODULES]
+            if eager:
+                print(f"Importing the app loaded {', '.join(eager)}")
+                return 1
+            return 0
+
+        from bench_pipeline import FixtureNetwork
+        network = FixtureNetwork(write_grid_osm_xml(os.path.join(tmp, 'grid.osm'), args.grid))
+        graph_file = os.path.join(tmp, 'graph.pickle')
+        with open(graph_file, 'wb') as f:
+            pickle.dump(network.graph_from_point(network.center, network.radius, network_type='drive'), f)
+
+        print(f"\n{'first job':>28} {'warm-up (s)':>11} {'first (s)':>10} {'second (s)':>11}")
+        for warm in (False, True):
+            runs = []
+            for _ in range(args.repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    runs.append(executor.submit(first_jobs, graph_file, network.center, network.radius,
+                                                warm).result())
+            warm_up = f"{median([run['warm_up_s'] for run in runs]):>11.3f}" if warm else f"{'-':>11}"
+            print(f"{'warm' if warm else 'cold':>28} {warm_up} {median([run['first_s'] for run in runs]):>10.3f} "
+                  f"{median([run['second_s'] for run in runs]):>11.3f}")
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,58 @@
+# Benchmark: peak memory of writing WKT from a list vs the streaming writer
+#
+# Each measurement runs in a fresh process. It reports the growth of peak RSS
+# over the RSS after the synthetic edges were built, plus the tracemalloc peak
+# for the write itself.
+#
+# Usage:
+#   python benchmarks/bench_wkt_memory.py --sizes 10000 100000 1000000
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from map_generator import format_linestrings_wkt, write_linestrings_wkt
+from bench_wkt_serialization import make_edges
+
+def write_from_list(f, geometries):
+    """The previous approach: format every line, then write them all"""
+    linestrings = format_linestrings_wkt(geometries)
+    for linestring in linestrings:
+        f.write(f"{linestring}\n")
+
+def measure(mode, n_edges, path):
+    edges = make_edges(n_edges)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    with open(path, 'w') as f:
+        if mode == 'list':
+            write_from_list(f, edges.geometry)
+        else:
+            write_linestrings_wkt(f, edges.geometry)
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux
+    return (rss_after - rss_before) / 1024, traced_peak / 1024 / 1024, os.path.getsize(path) / 1024 / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description='WKT writer memory benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'edges':>10} {'mode':>7} {'RSS growth (MB)':>16} {'traced peak (MB)':>17} {'file (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_edges in args.sizes:
+            for mode in ('list', 'stream'):
+                with ctx.Pool(1) as pool:
+                    rss, traced, size = pool.apply(measure, (mode, n_edges, os.path.join(tmp, 'out.wkt')))
+                print(f"{n_edges:>10} {mode:>7} {rss:>16.1f} {traced:>17.1f} {size:>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Benchmark: batched WKT serialization vs the original iterrows + regex loop
+#
+# Usage:
+#   python benchmarks/bench_wkt_serialization.py
+#   python benchmarks/bench_wkt_serialization.py --sizes 10000 100000
+
+import argparse
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from map_generator import format_linestrings_wkt, count_highway_types
+
+HIGHWAY_TYPES = ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'residential', 'unclassified', 'service']
+
+def make_edges(n_edges, seed=42):
+    """Build a synthetic projected edges GeoDataFrame shaped like osmnx output"""
+    rng = np.random.default_rng(seed)
+    n_coords = rng.integers(2, 9, size=n_edges)
+    index = np.repeat(np.arange(n_edges), n_coords)
+    start = rng.uniform([200000, 2500000], [800000, 2700000], size=(n_edges, 2))
+    steps = rng.normal(0, 25, size=(len(index), 2))
+    coords = start[index] + steps
+    geoms = shapely.linestrings(coords, indices=index)
+    highway = rng.choice(HIGHWAY_TYPES, size=n_edges).astype(object)
+    # osmnx leaves a list when a simplified edge merges several highway tags
+    highway[::50] = [['residential', 'service']] * len(highway[::50])
+    return gpd.GeoDataFrame({'highway': highway}, geometry=geoms, crs='EPSG:32646')
+
+def legacy_serialize(edges_utm):
+    """The original per-row loop from create_detailed_city_wkt"""
+    highway_counts = Counter()
+    linestrings = []
+    for idx, row in edges_utm.iterrows():
+        highway_type = row.get('highway', 'unknown')
+        if isinstance(highway_type, list):
+            highway_type = highway_type[0] if highway_type else 'unknown'
+        highway_counts[highway_type] += 1
+        geom_wkt = row.geometry.wkt
+
+        def round_coords(match):
+            x, y = match.groups()
+            return f"{float(x):.2f} {float(y):.2f}"
+
+        geom_wkt = re.sub(r'(\d+\.\d+)\s+(\d+\.\d+)', round_coords, geom_wkt)
+        linestrings.append(geom_wkt)
+    return linestrings, highway_counts
+
+def batched_serialize(edges_utm):
+    return format_linestrings_wkt(edges_utm.geometry), count_highway_types(edges_utm)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare WKT serialization strategies')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--skip-legacy-above', type=int, default=1000000,
+                        help='Only time the legacy loop up to this many edges (it is very slow)')
+    args = parser.parse_args()
+
+    print(f"{'edges':>10} {'legacy (s)':>12} {'batched (s)':>12} {'speedup':>9}")
+    for n_edges in args.sizes:
+        edges = make_edges(n_edges)
+
+        t0 = time.perf_counter()
+        new_lines, new_counts = batched_serialize(edges)
+        batched_time = time.perf_counter() - t0
+
+        if n_edges <= args.skip_legacy_above:
+            t0 = time.perf_counter()
+            old_lines, old_counts = legacy_serialize(edges)
+            legacy_time = time.perf_counter() - t0
+            if old_lines != new_lines or old_counts != new_counts:
+                raise SystemExit(f"Output mismatch at {n_edges} edges")
+            print(f"{n_edges:>10} {legacy_time:>12.2f} {batched_time:>12.2f} {legacy_time / batched_time:>8.1f}x")
+        else:
+            print(f"{n_edges:>10} {'skipped':>12} {batched_time:>12.2f} {'-':>9}")
+
+if __name__ == '__main__':
+    main()
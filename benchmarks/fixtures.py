@@ -0,0 +1,107 @@
+# Offline OSM XML fixtures for the benchmarks
+# Builds synthetic street grids that osmnx can load with graph_from_xml.
+
+import os
+import random
+
+HIGHWAY_TYPES = ['primary', 'secondary', 'tertiary', 'residential', 'residential', 'service', 'unclassified']
+
+def write_grid_osm_xml(path, size, lat=23.8103, lon=90.4125, spacing=0.001, seed=0, version=1, way_length=None,
+                       shape_points=0, timestamp='2024-01-01T00:00:00Z'):
+    """
+    Write a size x size street grid centered on (lat, lon) as OSM XML
+
+    Every row and column of nodes becomes one way with a highway tag (or,
+    with way_length, consecutive ways of that many edges), and node
+    positions are jittered so edges are not perfectly straight.
+
+    With shape_points, every block gets that many extra nodes bending the
+    street slightly, and ways split by way_length end on the first of them
+    past the junction, so the street continues through a degree-2 node
+    where the way id changes (as often happens in OSM). Every element is
+    stamped with the same edit timestamp.
+
+    Returns:
+        The path written
+    """
+    rng = random.Random(seed)
+    lat0 = lat - spacing * size / 2
+    lon0 = lon - spacing * size / 2
+    node_ids = {}
+    coords = {}
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6" generator="mapgen-fixtures">']
+    for i in range(size):
+        for j in range(size):
+            node_id = len(node_ids) + 1
+            node_ids[i, j] = node_id
+            node_lat = lat0 + i * spacing + rng.uniform(-0.2, 0.2) * spacing
+            node_lon = lon0 + j * spacing + rng.uniform(-0.2, 0.2) * spacing
+            coords[node_id] = (node_lat, node_lon)
+            lines.append(f'<node id="{node_id}" version="1" timestamp="{timestamp}" lat="{node_lat:.7f}" '
+                         f'lon="{node_lon:.7f}"/>')
+
+    # Separate generator, so the grid itself is the same with or without shape points
+    shape_rng = random.Random(seed + 1)
+    streets = []
+    for axis in range(2):
+        for i in range(size):
+            junctions = [node_ids[(i, j) if axis == 0 else (j, i)] for j in range(size)]
+            refs = [junctions[0]]
+            for a, b in zip(junctions[:-1], junctions[1:]):
+                (lat_a, lon_a), (lat_b, lon_b) = coords[a], coords[b]
+                for k in range(1, shape_points + 1):
+                    t = k / (shape_points + 1)
+                    bend = shape_rng.uniform(-0.05, 0.05) * spacing
+                    node_id = len(coords) + 1
+                    coords[node_id] = (lat_a + t * (lat_b - lat_a) + bend, lon_a + t * (lon_b - lon_a) - bend)
+                    lines.append(f'<node id="{node_id}" version="1" timestamp="{timestamp}" '
+                                 f'lat="{coords[node_id][0]:.7f}" lon="{coords[node_id][1]:.7f}"/>')
+                    refs.append(node_id)
+                refs.append(b)
+            streets.append((HIGHWAY_TYPES[(i + axis) % len(HIGHWAY_TYPES)], refs))
+
+    way_id = 1
+    step = (way_length or size) * (shape_points + 1)
+    offset = 1 if shape_points else 0
+    for highway, refs in streets:
+        splits = [0] + [end + offset for end in range(step, len(refs) - 1 - offset, step)] + [len(refs) - 1]
+        for start, end in zip(splits[:-1], splits[1:]):
+            nds = "".join(f'<nd ref="{ref}"/>' for ref in refs[start:end + 1])
+            lines.append(f'<way id="{way_id}" version="{version}" timestamp="{timestamp}">{nds}'
+                         f'<tag k="highway" v="{highway}"/></way>')
+            way_id += 1
+    lines.append('</osm>')
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+def write_edited_snapshot(path, out_path, bbox, shift=0.0001, timestamp='2024-02-01T00:00:00Z'):
+    """
+    Write a later snapshot of an OSM XML file in which every node inside bbox has moved
+
+    Moved nodes get a new version and timestamp, like an edit in OSM; ways keep theirs.
+
+    Args:
+        bbox: (north, south, east, west) box of the edited area
+        shift: Degrees each edited node moves north-east
+        timestamp: Edit timestamp of the moved nodes
+
+    Returns:
+        Number of nodes moved
+    """
+    import xml.etree.ElementTree as ET
+    north, south, east, west = bbox
+    tree = ET.parse(path)
+    moved = 0
+    for node in tree.getroot().iter('node'):
+        lat, lon = float(node.get('lat')), float(node.get('lon'))
+        if south <= lat <= north and west <= lon <= east:
+            node.set('lat', f"{lat + shift:.7f}")
+            node.set('lon', f"{lon + shift:.7f}")
+            node.set('version', str(int(node.get('version', 1)) + 1))
+            node.set('timestamp', timestamp)
+            moved += 1
+    tree.write(out_path, encoding='UTF-8', xml_declaration=True)
+    return moved
@@ -0,0 +1,185 @@
+# Compact binary road network formats written alongside the WKT output
+# 'wkb': length-prefixed WKB records; 'columnar': flat coordinate, offset and
+# highway-type arrays that NumPy can memory-map without copying.
+#
+# Both files start with an 8-byte magic, a little-endian uint64 header length
+# and a JSON header (city, road_desc, utm_epsg, custom_size, counts,
+# highway_types...). Coordinates are rounded like the WKT text (2 decimals by default).
+#
+# wkb body: one record per road segment, <uint32 length><uint16 highway code><WKB>
+# columnar body: starts at the next 64-byte boundary after the header; the
+# header's 'arrays' entry gives each array's dtype, shape and offset in the body:
+#   coords   (n_points, 2) float64, or float32 relative to header['origin']
+#   offsets  (n_lines + 1,) int64; line i is coords[offsets[i]:offsets[i + 1]]
+#   highway  (n_lines,) uint16 index into header['highway_types']
+
+import json
+import os
+import shutil
+import struct
+import threading
+
+import numpy as np
+import shapely
+
+MAGIC = {'wkb': b'MAPGWKB1', 'columnar': b'MAPGCOL1'}
+EXTENSIONS = {'wkb': '.wkb', 'columnar': '.roads'}
+MIMETYPES = {'wkb': 'application/vnd.mapgen.wkb', 'columnar': 'application/vnd.mapgen.columnar'}
+BINARY_FORMATS = tuple(EXTENSIONS)
+ALIGN = 64
+
+def binary_path_for(wkt_file, fmt):
+    """Return the path of the fmt file written next to a WKT file"""
+    return os.path.splitext(wkt_file)[0] + EXTENSIONS[fmt]
+
+def _aligned(n):
+    return -(-n // ALIGN) * ALIGN
+
+class BinaryRoadWriter:
+    """
+    Stream road segments to a wkb or columnar file
+
+    Segments are appended to a temporary body file as they are produced
+    (whole networks or tile by tile); close() writes the header, which needs
+    the final counts, and renames the result into place.
+
+    Args:
+        path: Output file
+        fmt: 'wkb' or 'columnar'
+        coord_dtype: 'float64', or 'float32' to halve columnar coordinates
+            (stored relative to an origin near the first point; centimetre
+            precision within about 100 km of it)
+        precision: Decimal places coordinates are rounded to
+    """
+
+    def __init__(self, path, fmt, coord_dtype='float64', precision=2):
+        if fmt not in BINARY_FORMATS:
+            raise ValueError(f"Unknown binary format '{fmt}', expected one of {BINARY_FORMATS}")
+        self.path = path
+        self.fmt = fmt
+        self.coord_dtype = np.dtype(coord_dtype)
+        self.precision = precision
+        self.origin = None
+        self.highway_types = {}
+        self._body_path = f"{path}.{os.getpid()}.{threading.get_ident()}.body"
+        self._body = open(self._body_path, 'wb')
+        self._offsets = [np.zeros(1, dtype=np.int64)]
+        self._codes = []
+        self._n_points = 0
+
+    def _encode_highways(self, highways):
+        return np.fromiter((self.highway_types.setdefault(h, len(self.highway_types)) for h in highways),
+                           dtype=np.uint16, count=len(highways))
+
+    def append(self, geometries, highways):
+        """Append road segments and their highway labels"""
+        codes = self._encode_highways(highways)
+        geoms = np.asarray(geometries, dtype=object)
+        if self.fmt == 'wkb':
+            rounded = shapely.transform(geoms, lambda coords: np.round(coords, self.precision))
+            for code, data in zip(codes.tolist(), shapely.to_wkb(rounded).tolist()):
+                self._body.write(struct.pack('<IH', len(data), code))
+                self._body.write(data)
+        else:
+            coords, index = shapely.get_coordinates(geoms, return_index=True)
+            coords = np.round(coords, self.precision)
+            if self.coord_dtype == np.float32:
+                if self.origin is None and len(coords):
+                    self.origin = (np.floor(coords[0] / 1000) * 1000).tolist()
+                coords = coords - (self.origin or 0)
+            self._body.write(np.ascontiguousarray(coords, dtype=self.coord_dtype).tobytes())
+            lengths = np.bincount(index, minlength=len(codes))
+            self._offsets.append(self._n_points + np.cumsum(lengths, dtype=np.int64))
+            self._n_points += len(coords)
+        self._codes.append(codes)
+
+    def close(self, **meta):
+        """Write the header (meta plus format details) and move the file into place"""
+        self._body.close()
+        codes = np.concatenate(self._codes) if self._codes else np.zeros(0, dtype=np.uint16)
+        header = dict(meta, format=self.fmt, version=1, n_lines=len(codes),
+                      highway_types=sorted(self.highway_types, key=self.highway_types.get))
+        arrays = []
+        if self.fmt == 'columnar':
+            offsets = np.concatenate(self._offsets)
+            coords_bytes = self._n_points * 2 * self.coord_dtype.itemsize
+            header['origin'] = self.origin
+            header['arrays'] = {
+                'coords': {'dtype': self.coord_dtype.str, 'shape': [self._n_points, 2], 'offset': 0},
+                'offsets': {'dtype': offsets.dtype.str, 'shape': [len(offsets)], 'offset': _aligned(coords_bytes)},
+                'highway': {'dtype': codes.dtype.str, 'shape': [len(codes)],
+                            'offset': _aligned(coords_bytes) + _aligned(offsets.nbytes)},
+            }
+            arrays = [offsets, codes]
+        header_bytes = json.dumps(header).encode('utf-8')
+
+        tmp_path = f"{self._body_path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f, open(self._body_path, 'rb') as body:
+                f.write(MAGIC[self.fmt])
+                f.write(struct.pack('<Q', len(header_bytes)))
+                f.write(header_bytes)
+                if self.fmt == 'columnar':
+                    f.write(b'\0' * (_aligned(f.tell()) - f.tell()))
+                shutil.copyfileobj(body, f)
+                for array in arrays:
+                    f.write(b'\0' * (_aligned(f.tell()) - f.tell()))
+                    f.write(array.tobytes())
+            os.replace(tmp_path, self.path)
+        finally:
+            for path in (tmp_path, self._body_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def discard(self):
+        """Drop the partial output"""
+        self._body.close()
+        if os.path.exists(self._body_path):
+            os.remove(self._body_path)
+
+def _read_header(f, fmt):
+    magic = f.read(8)
+    if magic != MAGIC[fmt]:
+        raise ValueError(f"Not a {fmt} road file (magic {magic!r})")
+    (length,) = struct.unpack('<Q', f.read(8))
+    return json.loads(f.read(length)), 16 + length
+
+def load_columnar(path):
+    """
+    Memory-map a columnar road file
+
+    Returns:
+        Tuple of (header, arrays); arrays maps 'coords', 'offsets' and
+        'highway' to read-only views of one shared memory map
+    """
+    with open(path, 'rb') as f:
+        header, header_end = _read_header(f, 'columnar')
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    start = _aligned(header_end)
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape']))
+        begin = start + spec['offset']
+        arrays[name] = data[begin:begin + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+    return header, arrays
+
+def load_wkb(path):
+    """
+    Read a wkb road file
+
+    Returns:
+        Tuple of (header, highway codes array, array of shapely LineStrings)
+    """
+    with open(path, 'rb') as f:
+        header, _ = _read_header(f, 'wkb')
+        body = f.read()
+    codes = np.empty(header['n_lines'], dtype=np.uint16)
+    records = []
+    pos = 0
+    for i in range(header['n_lines']):
+        length, codes[i] = struct.unpack_from('<IH', body, pos)
+        pos += 6
+        records.append(body[pos:pos + length])
+        pos += length
+    return header, codes, shapely.from_wkb(records)
@@ -0,0 +1,112 @@
+# Precompressed download variants
+# Files that will be served get .zst / .gz copies when they are generated, and a
+# small .etag sidecar with the content hash of every representation, so downloads
+# never compress or hash anything per request.
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+# Content-Encoding name -> file suffix, in order of preference
+ENCODINGS = {'zstd': '.zst', 'gzip': '.gz'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+HASH_CHUNK = 1024 * 1024
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+def available_encodings(encodings=None):
+    """Return the requested encodings (default: all) that can be written here; zstd needs the zstandard package"""
+    encodings = ENCODINGS if encodings is None else encodings
+    return [enc for enc in encodings if enc in ENCODINGS and (enc != 'zstd' or _zstandard() is not None)]
+
+def variant_path(path, encoding):
+    """Return the path of a file's compressed variant ('identity' is the file itself)"""
+    return path if encoding == 'identity' else path + ENCODINGS[encoding]
+
+def _etag_path(path):
+    return f"{path}.etag"
+
+def hash_file(path):
+    """Return the sha256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def compress_file(path, encoding):
+    """Write the compressed variant of a file atomically and return its path"""
+    target = variant_path(path, encoding)
+    tmp_path = f"{target}.tmp"
+    try:
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            if encoding == 'gzip':
+                # mtime=0 keeps the output, and so its ETag, identical for identical input
+                with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as gz:
+                    shutil.copyfileobj(src, gz, HASH_CHUNK)
+            else:
+                _zstandard().ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, dst)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target
+
+def _write_etags(path, etags):
+    stat = os.stat(path)
+    tmp_path = f"{_etag_path(path)}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'size': stat.st_size, 'mtime': stat.st_mtime, 'etags': etags}, f)
+    os.replace(tmp_path, _etag_path(path))
+
+def write_compressed_variants(path, encodings=None):
+    """
+    Compress a file with each encoding and record every representation's hash
+
+    Returns:
+        Dict of encoding ('identity', 'gzip', 'zstd') to sha256 hex digest
+    """
+    etags = {'identity': hash_file(path)}
+    for encoding in available_encodings(encodings):
+        etags[encoding] = hash_file(compress_file(path, encoding))
+    _write_etags(path, etags)
+    return etags
+
+def file_etags(path):
+    """
+    Return the hashes of a file and its compressed variants
+
+    Read from the .etag sidecar while it matches the file's size and mtime;
+    otherwise recomputed (ignoring variants older than the file) and saved.
+    """
+    stat = os.stat(path)
+    try:
+        with open(_etag_path(path)) as f:
+            recorded = json.load(f)
+        if recorded['size'] == stat.st_size and recorded['mtime'] == stat.st_mtime:
+            return recorded['etags']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    etags = {'identity': hash_file(path)}
+    for encoding in ENCODINGS:
+        variant = variant_path(path, encoding)
+        if os.path.exists(variant) and os.path.getmtime(variant) >= stat.st_mtime:
+            etags[encoding] = hash_file(variant)
+    try:
+        _write_etags(path, etags)
+    except OSError:
+        pass
+    return etags
+
+def variant_files(path):
+    """Return the compressed variants and sidecar that may exist next to path"""
+    return [variant_path(path, encoding) for encoding in ENCODINGS] + [_etag_path(path)]
@@ -0,0 +1,408 @@
+# Road network data sources
+# Overpass (the public API, via osmnx) is the default. LocalExtractSource reads a
+# local .osm / .osm.pbf extract through a SQLite R*Tree index over highway ways, so
+# a query only touches the ways whose bounding boxes intersect the requested area.
+
+import json
+import math
+from abc import ABC, abstractmethod
+import os
+import re
+import sqlite3
+import threading
+import urllib.request
+
+# osmnx buffers the requested area by this much before simplifying, then truncates
+SIMPLIFY_BUFFER_M = 500
+
+class OverpassSource:
+    """Download road networks from the Overpass API with osmnx"""
+
+    name = 'overpass'
+
+    def graph_from_point(self, point, dist, custom_filter=None):
+        import osmnx as ox
+        if custom_filter:
+            return ox.graph_from_point(point, dist=dist, custom_filter=custom_filter)
+        return ox.graph_from_point(point, dist=dist, network_type='drive')
+
+    def graph_from_place(self, place, custom_filter=None):
+        import osmnx as ox
+        if custom_filter:
+            return ox.graph_from_place(place, custom_filter=custom_filter)
+        return ox.graph_from_place(place, network_type='drive')
+
+    def graph_from_bbox(self, bbox, custom_filter=None, retain_all=False, truncate_by_edge=False):
+        import osmnx as ox
+        north, south, east, west = bbox
+        if custom_filter:
+            return ox.graph_from_bbox(north, south, east, west, custom_filter=custom_filter,
+                                      retain_all=retain_all, truncate_by_edge=truncate_by_edge)
+        return ox.graph_from_bbox(north, south, east, west, network_type='drive',
+                                  retain_all=retain_all, truncate_by_edge=truncate_by_edge)
+
+    def fetch_ways(self, bbox, custom_filter=None):
+        """
+        Download the current raw ways a graph of bbox is built from (see graph_from_ways)
+
+        Returns:
+            Tuple of (ways, nodes) like WayIndex.query, covering bbox plus SIMPLIFY_BUFFER_M
+        """
+        from network_cache import download_overpass_network
+        osm_filter = network_filter(custom_filter)
+        return ways_from_overpass(download_overpass_network(buffer_bbox(bbox, SIMPLIFY_BUFFER_M), osm_filter,
+                                                            fresh=True),
+                                  parse_overpass_filter(osm_filter))
+
+    def check_ways(self, bbox, custom_filter=None, since=None):
+        """
+        Check the ways fetch_ways would return without downloading them
+
+        Returns:
+            Tuple of (data timestamp, set of way ids, number of ways and nodes
+            edited after since), see network_cache.check_overpass_ways
+        """
+        from network_cache import check_overpass_ways
+        return check_overpass_ways(buffer_bbox(bbox, SIMPLIFY_BUFFER_M), network_filter(custom_filter), since)
+
+def ways_from_overpass(responses, clauses):
+    """Return (ways, nodes) like WayIndex.query from raw Overpass responses, keeping ways matching clauses"""
+    ways, nodes = [], {}
+    for response_json in responses:
+        for element in response_json.get('elements', []):
+            if element['type'] == 'node':
+                nodes[element['id']] = (element['lat'], element['lon'])
+            elif element['type'] == 'way' and tags_match(element.get('tags', {}), clauses):
+                ways.append((element['id'], element.get('tags', {}), element['nodes']))
+    return ways, nodes
+
+def parse_overpass_filter(osm_filter):
+    """
+    Parse an Overpass tag filter such as '["highway"~"primary|secondary"]["area"!~"yes"]'
+
+    Returns:
+        List of (key, op, value) with op one of None (key exists), '=', '!=', '~', '!~'
+    """
+    clauses = re.findall(r'\["([^"]+)"(?:(!?[~=])"([^"]*)")?\]', osm_filter)
+    return [(key, op or None, value) for key, op, value in clauses]
+
+def tags_match(tags, clauses):
+    """Apply parsed Overpass filter clauses to a way's tags"""
+    for key, op, value in clauses:
+        tag = tags.get(key)
+        if op is None:
+            ok = tag is not None
+        elif op == '=':
+            ok = tag == value
+        elif op == '!=':
+            ok = tag != value
+        elif op == '~':
+            ok = tag is not None and re.search(value, tag) is not None
+        else:  # '!~'
+            ok = tag is None or re.search(value, tag) is None
+        if not ok:
+            return False
+    return True
+
+def network_filter(custom_filter=None):
+    """Return the Overpass filter osmnx would use: custom_filter, or the drive network filter"""
+    if custom_filter:
+        return custom_filter
+    from osmnx import _overpass
+    return _overpass._get_osm_filter('drive')
+
+def buffer_bbox(bbox, meters):
+    """Grow a (north, south, east, west) box by roughly meters on each side"""
+    north, south, east, west = bbox
+    dlat = meters / 111320
+    dlon = meters / (111320 * max(math.cos(math.radians((north + south) / 2)), 0.01))
+    return north + dlat, south - dlat, east + dlon, west - dlon
+
+class _IndexWriter:
+    """Batch node and highway-way rows into an index database being built"""
+
+    BATCH = 50000
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.nodes = []
+        self.ways = []
+        self.way_nodes = []
+
+    def add_node(self, node_id, lat, lon):
+        self.nodes.append((node_id, lat, lon))
+        if len(self.nodes) >= self.BATCH:
+            self.flush()
+
+    def add_way(self, way_id, tags, refs):
+        self.ways.append((way_id, tags.get('highway'), json.dumps(tags)))
+        self.way_nodes.extend((way_id, seq, ref) for seq, ref in enumerate(refs))
+        if len(self.way_nodes) >= self.BATCH:
+            self.flush()
+
+    def flush(self):
+        self.conn.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)", self.nodes)
+        self.conn.executemany("INSERT OR REPLACE INTO ways VALUES (?, ?, ?)", self.ways)
+        self.conn.executemany("INSERT INTO way_nodes VALUES (?, ?, ?)", self.way_nodes)
+        self.nodes, self.ways, self.way_nodes = [], [], []
+
+def _read_osm_xml(path, writer):
+    import xml.etree.ElementTree as ET
+    context = ET.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event != 'end':
+            continue
+        if elem.tag == 'node':
+            writer.add_node(int(elem.get('id')), float(elem.get('lat')), float(elem.get('lon')))
+        elif elem.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+            if 'highway' in tags:
+                writer.add_way(int(elem.get('id')), tags, [int(nd.get('ref')) for nd in elem.iter('nd')])
+        elif elem.tag != 'relation':
+            continue
+        # Relations are not used, but are cleared like the rest so they do not pile up in memory
+        root.clear()
+
+def _read_osm_pbf(path, writer):
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Reading .osm.pbf extracts requires pyosmium: pip install osmium")
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            writer.add_node(n.id, n.location.lat, n.location.lon)
+
+        def way(self, w):
+            tags = {t.k: t.v for t in w.tags}
+            if 'highway' in tags:
+                writer.add_way(w.id, tags, [nd.ref for nd in w.nodes])
+
+    Handler().apply_file(path)
+
+INDEX_SCHEMA = """
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE nodes (id INTEGER PRIMARY KEY, lat REAL, lon REAL);
+    CREATE TABLE ways (id INTEGER PRIMARY KEY, highway TEXT, tags TEXT);
+    CREATE TABLE way_nodes (way_id INTEGER, seq INTEGER, node_id INTEGER);
+    CREATE VIRTUAL TABLE way_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+"""
+
+INDEX_FINALIZE = """
+    CREATE INDEX way_nodes_way ON way_nodes (way_id, seq);
+    INSERT INTO way_rtree
+        SELECT wn.way_id, MIN(n.lat), MAX(n.lat), MIN(n.lon), MAX(n.lon)
+        FROM way_nodes wn JOIN nodes n ON n.id = wn.node_id GROUP BY wn.way_id;
+    DELETE FROM nodes WHERE id NOT IN (SELECT node_id FROM way_nodes);
+"""
+
+class WayIndex:
+    """
+    SQLite file holding highway ways, their nodes and an R*Tree over way bounding boxes
+
+    Queries only read the ways whose boxes intersect the requested area.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+
+    def _connect(self):
+        # Read-only: a missing file raises instead of being created as an empty database
+        uri = f"file:{urllib.request.pathname2url(os.path.abspath(self.index_path))}?mode=ro"
+        return sqlite3.connect(uri, uri=True, timeout=30)
+
+    def build(self, fill, signature):
+        """Rebuild the index atomically; fill(writer) adds nodes and ways to an _IndexWriter"""
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(INDEX_SCHEMA)
+            writer = _IndexWriter(conn)
+            fill(writer)
+            writer.flush()
+            conn.executescript(INDEX_FINALIZE)
+            conn.execute("INSERT INTO meta VALUES ('signature', ?)", (signature,))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, self.index_path)
+
+    def signature(self):
+        """Return the signature stored at build time, or None if the index is missing or unreadable"""
+        try:
+            conn = self._connect()
+        except sqlite3.OperationalError:
+            return None
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def query(self, bbox, clauses):
+        """
+        Return the ways intersecting a (north, south, east, west) box that match the filter
+
+        Returns:
+            Tuple of (ways, nodes): ways is a list of (way_id, tags, node_ids),
+            nodes maps node_id to (lat, lon)
+        """
+        north, south, east, west = bbox
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT w.id, w.tags FROM way_rtree r JOIN ways w ON w.id = r.id"
+                " WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?",
+                (south, north, west, east)
+            ).fetchall()
+            ways = []
+            for way_id, tags in rows:
+                tags = json.loads(tags)
+                if tags_match(tags, clauses):
+                    ways.append((way_id, tags, []))
+            if not ways:
+                return [], {}
+
+            conn.execute("CREATE TEMP TABLE wanted (id INTEGER PRIMARY KEY)")
+            conn.executemany("INSERT INTO wanted VALUES (?)", [(way[0],) for way in ways])
+            refs = {way[0]: way[2] for way in ways}
+            nodes = {}
+            for way_id, node_id, lat, lon in conn.execute(
+                "SELECT wn.way_id, n.id, n.lat, n.lon FROM wanted"
+                " JOIN way_nodes wn ON wn.way_id = wanted.id JOIN nodes n ON n.id = wn.node_id"
+                " ORDER BY wn.way_id, wn.seq"
+            ):
+                refs[way_id].append(node_id)
+                nodes[node_id] = (lat, lon)
+        finally:
+            conn.close()
+        return ways, nodes
+
+class OSMExtractIndex(WayIndex):
+    """
+    WayIndex over a local OSM extract
+
+    The extract is parsed once into <extract>.index.sqlite and re-indexed
+    whenever the extract file changes.
+    """
+
+    def __init__(self, extract_path, index_path=None):
+        super().__init__(index_path or f"{extract_path}.index.sqlite")
+        self.extract_path = extract_path
+        self._lock = threading.Lock()
+
+    def _extract_signature(self):
+        stat = os.stat(self.extract_path)
+        return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+    def ensure_built(self):
+        with self._lock:
+            signature = self._extract_signature()
+            if self.signature() != signature:
+                print(f"Indexing OSM extract {self.extract_path}...")
+                reader = _read_osm_pbf if self.extract_path.endswith('.pbf') else _read_osm_xml
+                self.build(lambda writer: reader(self.extract_path, writer), signature)
+
+    def query(self, bbox, clauses):
+        self.ensure_built()
+        return super().query(bbox, clauses)
+
+def graph_from_ways(ways, nodes, bbox, retain_all=False, truncate_by_edge=False):
+    """
+    Build a road graph from raw ways the way osmnx does for a download
+
+    The ways should cover bbox plus SIMPLIFY_BUFFER_M; the graph is simplified
+    on that buffered area and then truncated to bbox.
+    """
+    import osmnx as ox
+    elements = [{'type': 'node', 'id': node_id, 'lat': lat, 'lon': lon} for node_id, (lat, lon) in nodes.items()]
+    elements.extend({'type': 'way', 'id': way_id, 'nodes': refs, 'tags': tags} for way_id, tags, refs in ways)
+    G = ox.graph._create_graph([{'elements': elements}], retain_all=True, bidirectional=False)
+    G = ox.simplification.simplify_graph(G)
+    north, south, east, west = bbox
+    return ox.truncate.truncate_graph_bbox(G, north, south, east, west,
+                                           truncate_by_edge=truncate_by_edge, retain_all=retain_all)
+
+class IndexedSource(ABC):
+    """Base for sources that answer every query from raw ways around a bounding box"""
+
+    @abstractmethod
+    def graph_from_bbox(self, bbox, custom_filter=None, retain_all=False, truncate_by_edge=False):
+        """Return the road graph of bbox (north, south, east, west), as osmnx.graph_from_bbox"""
+
+    @abstractmethod
+    def fetch_ways(self, bbox, custom_filter=None):
+        """Return the current (ways, nodes) of bbox plus SIMPLIFY_BUFFER_M, like OverpassSource.fetch_ways"""
+
+    def graph_from_point(self, point, dist, custom_filter=None):
+        import osmnx as ox
+        return self.graph_from_bbox(ox.utils_geo.bbox_from_point(point, dist), custom_filter)
+
+    def graph_from_place(self, place, custom_filter=None):
+        import osmnx as ox
+        polygon = ox.geocode_to_gdf(place).unary_union
+        west, south, east, north = polygon.bounds
+        G = self.graph_from_bbox((north, south, east, west), custom_filter, retain_all=True)
+        return ox.truncate.truncate_graph_polygon(G, polygon)
+
+class LocalExtractSource(IndexedSource):
+    """
+    Build road networks from a local OSM extract instead of Overpass
+
+    The Overpass filter for the detail level is applied while reading the
+    index, and graphs are built, simplified and truncated the same way
+    osmnx does for downloads.
+    """
+
+    name = 'extract'
+
+    def __init__(self, extract_path, index_path=None):
+        self.index = OSMExtractIndex(extract_path, index_path)
+
+    def fetch_ways(self, bbox, custom_filter=None):
+        clauses = parse_overpass_filter(network_filter(custom_filter))
+        return self.index.query(buffer_bbox(bbox, SIMPLIFY_BUFFER_M), clauses)
+
+    def graph_from_bbox(self, bbox, custom_filter=None, retain_all=False, truncate_by_edge=False):
+        ways, nodes = self.fetch_ways(bbox, custom_filter)
+        if not ways:
+            from osmnx._errors import InsufficientResponseError
+            raise InsufficientResponseError(f"No matching ways in {self.index.extract_path} for {bbox}")
+        return graph_from_ways(ways, nodes, bbox, retain_all, truncate_by_edge)
+
+_source = None
+_source_lock = threading.Lock()
+
+def get_data_source():
+    """
+    Return the process-wide data source, creating it on first use
+
+    Set MAPGEN_OSM_EXTRACT to a .osm or .osm.pbf file to read from a local
+    extract; otherwise Overpass is used, through a network cache of
+    MAPGEN_NETWORK_CACHE_MB megabytes (0 disables it) whose downloads are
+    reused for MAPGEN_NETWORK_CACHE_MAX_AGE_HOURS.
+    """
+    global _source
+    with _source_lock:
+        if _source is None:
+            extract = os.environ.get('MAPGEN_OSM_EXTRACT')
+            cache_mb = int(os.environ.get('MAPGEN_NETWORK_CACHE_MB', 2048))
+            if extract:
+                _source = LocalExtractSource(extract)
+            elif cache_mb > 0:
+                from network_cache import CachingOverpassSource, NetworkCache
+                _source = CachingOverpassSource(NetworkCache(max_bytes=cache_mb * 1024 * 1024))
+            else:
+                _source = OverpassSource()
+        return _source
+
+def set_data_source(source):
+    """Replace the process-wide data source"""
+    global _source
+    with _source_lock:
+        _source = source
@@ -0,0 +1,184 @@
+# Geocoding service shared by the app and map generator
+# Wraps one Nominatim client with an in-memory LRU backed by a SQLite store,
+# remembers misses for a while, and applies the location fallback chain in one place.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from metrics import increment
+
+GEOCODE_DB_PATH = os.path.join('cache', 'geocode.sqlite')
+
+# bbox is (west, south, east, north) in degrees, or None if the geocoder gave none
+GeocodeResult = namedtuple('GeocodeResult', ['query', 'lat', 'lon', 'bbox'])
+
+def normalize_location(location):
+    """Normalize a location name so trivially different spellings share a cache entry"""
+    return " ".join(location.lower().replace(",", ", ").split())
+
+def fallback_queries(query):
+    """Return the queries to try, in order, when geocoding a user-supplied location"""
+    queries = [query]
+    if query.lower() == 'london':
+        queries.append('London, England, UK')
+    if query.lower() == 'london, uk':
+        queries.append('London, United Kingdom')
+    # Bare city names are most often Bangladeshi cities
+    if ',' not in query:
+        queries.append(f"{query}, Bangladesh")
+    return queries
+
+def _await_if_needed(value):
+    """Resolve results from async geopy adapters; give up on un-awaitable coroutines"""
+    if value is not None and hasattr(value, '__await__'):
+        import asyncio
+        value = asyncio.run(value)
+    import types
+    if isinstance(value, types.CoroutineType):
+        return None
+    return value
+
+class GeocodingService:
+    """
+    Cached geocoder
+
+    Args:
+        geocoder: geopy-style geocoder with a geocode() method (default: Nominatim)
+        db_path: SQLite file for the persistent store, or None for memory only
+        max_entries: Size of the in-memory LRU
+        ttl: Seconds a successful lookup stays valid
+        negative_ttl: Seconds a failed lookup is remembered
+    """
+
+    def __init__(self, geocoder=None, db_path=GEOCODE_DB_PATH, max_entries=1024,
+                 ttl=30 * 24 * 3600, negative_ttl=3600):
+        if geocoder is None:
+            from geopy.geocoders import Nominatim
+            geocoder = Nominatim(user_agent="map_app")
+        self.geocoder = geocoder
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS geocode ("
+                    " query TEXT PRIMARY KEY, found INTEGER, name TEXT,"
+                    " lat REAL, lon REAL, bbox TEXT, created REAL)"
+                )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _expired(self, found, created):
+        return time.time() - created > (self.ttl if found else self.negative_ttl)
+
+    def _remember(self, key, result, created):
+        self._memory[key] = (result, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT found, name, lat, lon, bbox, created FROM geocode WHERE query = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        found, name, lat, lon, bbox, created = row
+        if self._expired(found, created):
+            return None
+        result = GeocodeResult(name, lat, lon, tuple(json.loads(bbox)) if bbox else None) if found else None
+        return result, created
+
+    def _store(self, key, result, created):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, int(result is not None),
+                 result.query if result else None,
+                 result.lat if result else None,
+                 result.lon if result else None,
+                 json.dumps(result.bbox) if result and result.bbox else None,
+                 created)
+            )
+
+    def _geocode_uncached(self, query):
+        location = _await_if_needed(self.geocoder.geocode(query))
+        if location is None or not hasattr(location, 'latitude') or not hasattr(location, 'longitude'):
+            return None
+        bbox = None
+        raw = getattr(location, 'raw', None) or {}
+        if raw.get('boundingbox'):
+            south, north, west, east = (float(v) for v in raw['boundingbox'])
+            bbox = (west, south, east, north)
+        return GeocodeResult(query, location.latitude, location.longitude, bbox)
+
+    def lookup(self, query):
+        """Geocode a single query through the cache; returns a GeocodeResult or None"""
+        key = normalize_location(query)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0] is not None, entry[1]):
+                self._memory.move_to_end(key)
+                increment('mapgen_geocode_cache_requests_total', result='memory')
+                return entry[0]
+            if self.db_path:
+                entry = self._load(key)
+                if entry is not None:
+                    self._remember(key, *entry)
+                    increment('mapgen_geocode_cache_requests_total', result='db')
+                    return entry[0]
+        increment('mapgen_geocode_cache_requests_total', result='miss')
+
+        print(f"[DEBUG] Geocoding '{query}' with {type(self.geocoder).__name__}")
+        result = self._geocode_uncached(query)
+        created = time.time()
+        with self._lock:
+            self._remember(key, result, created)
+            if self.db_path:
+                self._store(key, result, created)
+        return result
+
+    def resolve(self, query):
+        """Geocode a location, trying each fallback query until one is found"""
+        for candidate in fallback_queries(query):
+            result = self.lookup(candidate)
+            if result is not None:
+                return result
+        return None
+
+    def suggest(self, query, limit=5):
+        """Return up to limit candidate addresses for a query that could not be resolved"""
+        candidates = _await_if_needed(
+            self.geocoder.geocode(query, exactly_one=False, addressdetails=True, limit=limit)
+        )
+        return [cand.address for cand in candidates or [] if hasattr(cand, 'address')]
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_geocoding_service():
+    """Return the process-wide geocoding service, creating it on first use"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = GeocodingService()
+        return _service
+
+def set_geocoding_service(service):
+    """Replace the process-wide geocoding service, e.g. with one wrapping a stub geocoder"""
+    global _service
+    with _service_lock:
+        _service = service
@@ -0,0 +1,352 @@
+# Incremental regeneration of previously generated areas
+# An area (center, radius and road filter) is split into a grid of small tiles.
+# A SQLite index per area keeps, for every tile, a hash of each way it was built
+# from (tags and node positions) and the tile's formatted road segments. A refresh
+# first asks the data source which tiles changed since their last check (for
+# Overpass: the tile's way ids and a count of ways and nodes edited since), fetches
+# the current ways of those tiles only, rebuilds the tiles whose hashes changed and
+# writes the WKT output from the index, so unchanged tiles are never downloaded,
+# simplified, projected or formatted again.
+#
+# Usage:
+#   python incremental.py "Dhaka, Bangladesh" --map-size 20000 --detail-level complete
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+import osmnx as ox
+
+from data_sources import get_data_source, graph_from_ways, network_filter
+from map_generator import (check_cancelled, create_detailed_city_wkt, format_linestrings_wkt, get_utm_zone,
+                           highway_labels, open_binary_writers, reduce_edges, report_progress, temp_path_for)
+from metrics import stage
+from simplification import DEFAULT_GEOMETRY, parse_geometry_options
+from tiled_generator import (TILE_WORKERS, SegmentSpool, grow_to_whole_edges, map_in_order, project_edges,
+                             starts_in_tile, tile_grid)
+
+INCREMENTAL_DIR = os.path.join('cache', 'incremental')
+# Side length of one tile; smaller tiles rebuild less around each edit
+INCREMENTAL_TILE_SIZE_M = int(os.environ.get('MAPGEN_INCREMENTAL_TILE_SIZE_M', 2000))
+
+# Last build of a tile: its fingerprint, the data timestamp it was last checked at, its way ids
+# and the (north, south, east, west) box they were fetched for
+TileState = namedtuple('TileState', ['fingerprint', 'checked', 'way_ids', 'bbox'])
+
+INDEX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tiles (tile INTEGER PRIMARY KEY, fingerprint TEXT, checked TEXT, bbox TEXT);
+    CREATE TABLE IF NOT EXISTS ways (tile INTEGER, way_id INTEGER, hash TEXT, PRIMARY KEY (tile, way_id));
+    CREATE TABLE IF NOT EXISTS edges (tile INTEGER, seq INTEGER, u INTEGER, v INTEGER, key INTEGER,
+                                      highway TEXT, wkt TEXT, PRIMARY KEY (tile, seq));
+    CREATE TABLE IF NOT EXISTS vertices (tile INTEGER, seq INTEGER, before INTEGER, PRIMARY KEY (tile, seq));
+"""
+
+def way_hash(tags, coords):
+    """
+    Hash a way's tags and node positions
+
+    Stands in for the OSM version: it changes with every edit that can
+    change the generated roads, including moved nodes, which do not bump
+    the way's own version.
+    """
+    # repr of plain tuples is stable and several times cheaper than JSON here
+    payload = repr((sorted(tags.items()), [(lat, lon) for lat, lon in coords]))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def tile_fingerprint(way_hashes):
+    """Combine the way hashes of a tile into one digest"""
+    digest = hashlib.sha1()
+    for way_id in sorted(way_hashes):
+        digest.update(f"{way_id}:{way_hashes[way_id]}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def area_key(point, custom_size, custom_filter, tile_size, geometry=None):
+    """Build the index key of an area; the tile grid and stored segments only depend on these"""
+    fields = {
+        'point': [round(point[0], 6), round(point[1], 6)],
+        'map_size': int(custom_size),
+        'filter': network_filter(custom_filter),
+        'tile_size': tile_size,
+    }
+    if geometry and geometry != DEFAULT_GEOMETRY:
+        fields['geometry'] = geometry._asdict()
+    payload = json.dumps(fields, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class AreaIndex:
+    """
+    Ways and road segments of one area's last generation, per tile
+
+    Args:
+        path: SQLite file, created if missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(INDEX_SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(tiles)")]
+            if 'checked' not in columns:
+                # Indexes from before change checks: their tiles are downloaded on the next refresh
+                conn.execute("ALTER TABLE tiles ADD COLUMN checked TEXT")
+            if 'bbox' not in columns:
+                # Indexes from before edge ownership: their tiles are rebuilt on the next refresh
+                conn.execute("ALTER TABLE tiles ADD COLUMN bbox TEXT")
+                conn.execute("UPDATE tiles SET fingerprint = NULL, checked = NULL")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def fingerprints(self):
+        """Return {tile: fingerprint} of every indexed tile"""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT tile, fingerprint FROM tiles"))
+
+    def tile_way_hashes(self, tile):
+        """Return {way_id: hash} of the ways a tile was last built from"""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT way_id, hash FROM ways WHERE tile = ?", (tile,)))
+
+    def tile_state(self, tile):
+        """Return the TileState of an indexed tile, or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT fingerprint, checked, bbox FROM tiles WHERE tile = ?", (tile,)).fetchone()
+            if row is None:
+                return None
+            way_ids = {way_id for way_id, in conn.execute("SELECT way_id FROM ways WHERE tile = ?", (tile,))}
+        return TileState(row[0], row[1], way_ids, tuple(json.loads(row[2])) if row[2] else None)
+
+    def mark_checked(self, tile, checked):
+        """Record that a tile was found unchanged as of the data timestamp checked"""
+        with self._connect() as conn:
+            conn.execute("UPDATE tiles SET checked = ? WHERE tile = ?", (checked, tile))
+
+    def replace_tile(self, tile, fingerprint, way_hashes, rows, vertices=None, checked=None, bbox=None):
+        """
+        Store a rebuilt tile
+
+        Args:
+            rows: (u, v, key, highway, wkt) in output order
+            vertices: Optional vertex count of each row before simplification
+            checked: Data timestamp of the change check the tile was rebuilt after, if any
+            bbox: Box the ways were fetched for (the tile, or grown past it)
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM ways WHERE tile = ?", (tile,))
+            conn.execute("DELETE FROM edges WHERE tile = ?", (tile,))
+            conn.execute("DELETE FROM vertices WHERE tile = ?", (tile,))
+            conn.executemany("INSERT INTO ways VALUES (?, ?, ?)",
+                             ((tile, way_id, digest) for way_id, digest in way_hashes.items()))
+            conn.executemany("INSERT INTO edges VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             ((tile, seq, *row) for seq, row in enumerate(rows)))
+            if vertices is not None:
+                conn.executemany("INSERT INTO vertices VALUES (?, ?, ?)",
+                                 ((tile, seq, count) for seq, count in enumerate(vertices)))
+            conn.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                         (tile, fingerprint, checked, json.dumps([float(x) for x in bbox]) if bbox else None))
+
+    def tile_edges(self):
+        """Yield (tile, rows) in grid order; rows are (u, v, key, highway, wkt, vertices before simplification)"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute("SELECT e.tile, e.u, e.v, e.key, e.highway, e.wkt, x.before FROM edges e "
+                                  "LEFT JOIN vertices x ON x.tile = e.tile AND x.seq = e.seq ORDER BY e.tile, e.seq")
+            for tile, rows in groupby(cursor, key=lambda row: row[0]):
+                yield tile, [row[1:] for row in rows]
+        finally:
+            conn.close()
+
+def _refresh_tile(source, tile, outer_bbox, custom_filter, utm_epsg, previous=None, geometry=None):
+    """
+    Fetch one tile's ways and rebuild its road segments if they changed
+
+    Sources that can check an area without downloading it (check_ways) are
+    asked first; a tile whose ways are the same as at its last check, none
+    of them or their nodes edited since, is not downloaded at all.
+
+    Like download_tile_edges, a tile keeps the edges starting in it, and the
+    box its ways are fetched for is grown until those edges are whole, so the
+    segments match a single download of the outer box. Checks and later
+    fetches start from the box the tile was last built from.
+
+    Args:
+        previous: TileState of the tile's last build, or None
+
+    Returns:
+        Tuple of (checked, fingerprint, way hashes, rows, vertices, bbox);
+        checked is the data timestamp of the check (None if the source cannot
+        check), way hashes is None when the tile was not downloaded, rows is
+        None when the tile is unchanged, vertices is None with the default
+        geometry options and bbox is the box the ways were fetched for
+    """
+    bbox = previous.bbox if previous is not None and previous.bbox else tile
+    checked = None
+    check_ways = getattr(source, 'check_ways', None)
+    if check_ways is not None:
+        with stage('check'):
+            checked, way_ids, edited = check_ways(bbox, custom_filter, previous.checked if previous else None)
+        if previous is not None and previous.checked and edited == 0 and way_ids == previous.way_ids:
+            return checked, previous.fingerprint, None, None, None, bbox
+
+    geometry = geometry or DEFAULT_GEOMETRY
+    edges = None
+    while True:
+        with stage('download'):
+            ways, nodes = source.fetch_ways(bbox, custom_filter)
+        hashes = {way_id: way_hash(tags, [nodes[ref] for ref in refs if ref in nodes])
+                  for way_id, tags, refs in ways}
+        fingerprint = tile_fingerprint(hashes)
+        if previous is not None and fingerprint == previous.fingerprint and bbox == previous.bbox:
+            return checked, fingerprint, hashes, None, None, bbox
+        if not ways:
+            break
+        try:
+            with stage('build_graph'):
+                G = graph_from_ways(ways, nodes, bbox, retain_all=True, truncate_by_edge=True)
+        except (ox._errors.InsufficientResponseError, ValueError):
+            break
+        if len(G.edges) == 0:
+            break
+        with stage('graph_to_gdfs'):
+            graph_nodes, edges = ox.graph_to_gdfs(G)
+        del G
+        edges = edges[starts_in_tile(graph_nodes, edges, tile, outer_bbox)]
+        grown = grow_to_whole_edges(bbox, edges, outer_bbox)
+        if grown == bbox:
+            break
+        bbox = tuple(float(x) for x in grown)
+
+    rows = []
+    vertices = None if geometry == DEFAULT_GEOMETRY else []
+    if edges is not None and len(edges) > 0:
+        edges = project_edges(graph_nodes, edges, outer_bbox, utm_epsg)
+    if edges is not None and len(edges) > 0:
+        edges, before = reduce_edges(edges, geometry)
+        lines = format_linestrings_wkt(edges.geometry, geometry.precision)
+        rows = [(int(u), int(v), int(k), label, line)
+                for (u, v, k), label, line in zip(edges.index.tolist(), highway_labels(edges), lines)]
+        if before is not None:
+            vertices = before.tolist()
+    return checked, fingerprint, hashes, rows, vertices, bbox
+
+def write_index_wkt(index, wkt_file, city_name, road_desc, utm_epsg, custom_size=None, binary_formats=(),
+                    geometry=None):
+    """
+    Write the road segments stored in an area index as a WKT file
+
+    Every edge is stored by the one tile it starts in; only the largest
+    connected component is written, like generate_tiled_wkt does.
+
+    Returns:
+        Counter of road segments per highway type, or None if the index has none
+    """
+    geometry = geometry or DEFAULT_GEOMETRY
+    spool = SegmentSpool(temp_path_for(wkt_file, 'body'))
+    writers = open_binary_writers(wkt_file, binary_formats, geometry.precision)
+    try:
+        for _, rows in index.tile_edges():
+            lines = [row[4] for row in rows]
+            vertices = None
+            if geometry != DEFAULT_GEOMETRY:
+                vertices = ([row[5] or 0 for row in rows], [line.count(',') + 1 for line in lines])
+            spool.add([row[:3] for row in rows], [row[3] for row in rows], lines, vertices)
+        return spool.write(wkt_file, city_name, road_desc, utm_epsg, custom_size, writers, geometry)
+    finally:
+        for writer in writers:
+            writer.discard()
+        spool.close()
+
+def generate_incremental_wkt(city_name, point, custom_size, custom_filter, road_desc, wkt_file,
+                             index_dir=None, tile_size=None, max_workers=None, progress_callback=None,
+                             binary_formats=(), geometry=None, cancel_event=None):
+    """
+    Generate a WKT file for an area, rebuilding only the tiles whose ways changed since its last run
+
+    The first run builds every tile. The output only depends on the current
+    data, not on which tiles were rebuilt; like generate_tiled_wkt, only the
+    largest connected component is written.
+
+    Args:
+        index_dir: Directory of the area indexes (default: INCREMENTAL_DIR)
+        tile_size: Tile side length in meters (default: INCREMENTAL_TILE_SIZE_M)
+        geometry: Optional GeometryOptions; each set of options has its own
+            index. Chain merging is not supported: segments are stored and
+            deduplicated per edge.
+        cancel_event: Optional threading.Event; once set, the refresh stops at the
+            next tile. Tiles already rebuilt stay in the index.
+
+    Returns:
+        Counter of road segments per highway type, or None if no tile had roads
+
+    Raises:
+        ValueError: If geometry asks for chain merging
+    """
+    geometry = geometry or DEFAULT_GEOMETRY
+    if geometry.merge_chains:
+        raise ValueError('Chain merging is not supported by incremental generation')
+    tile_size = tile_size or INCREMENTAL_TILE_SIZE_M
+    outer_bbox = ox.utils_geo.bbox_from_point(point, custom_size)
+    tiles = tile_grid(outer_bbox, custom_size, tile_size)
+    utm_epsg = get_utm_zone(*point)
+    index = AreaIndex(os.path.join(index_dir or INCREMENTAL_DIR,
+                                   f"{area_key(point, custom_size, custom_filter, tile_size, geometry)}.sqlite"))
+    indexed = len(index.fingerprints())
+    print(f"   Checking {len(tiles)} tiles for changes ({indexed} indexed), using coordinate system: {utm_epsg}")
+
+    source = get_data_source()
+    changes = Counter(downloaded=0, tiles=0, added=0, removed=0, modified=0)
+    max_workers = max_workers or TILE_WORKERS
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        calls = ((source, tile, outer_bbox, custom_filter, utm_epsg, index.tile_state(i), geometry)
+                 for i, tile in enumerate(tiles))
+        results = map_in_order(executor, _refresh_tile, calls, max_workers)
+        for i, (checked, fingerprint, hashes, rows, vertices, bbox) in enumerate(results):
+            check_cancelled(cancel_event)
+            if hashes is not None:
+                changes['downloaded'] += 1
+            if rows is not None:
+                old = index.tile_way_hashes(i)
+                changes['tiles'] += 1
+                changes['added'] += len(hashes.keys() - old.keys())
+                changes['removed'] += len(old.keys() - hashes.keys())
+                changes['modified'] += sum(1 for way_id in hashes.keys() & old.keys() if hashes[way_id] != old[way_id])
+                index.replace_tile(i, fingerprint, hashes, rows, vertices, checked, bbox)
+            elif checked is not None:
+                index.mark_checked(i, checked)
+            report_progress(progress_callback, f"Checked tile {i + 1} of {len(tiles)} ({changes['tiles']} rebuilt)",
+                            stage='downloading', tiles_done=i + 1, tiles_total=len(tiles))
+
+    print(f"   Downloaded {changes['downloaded']} and rebuilt {changes['tiles']} of {len(tiles)} tiles: "
+          f"{changes['added']} ways added, {changes['removed']} removed, {changes['modified']} modified")
+    with stage('serialize'):
+        return write_index_wkt(index, wkt_file, city_name, road_desc, utm_epsg, custom_size, binary_formats, geometry)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate or refresh a WKT file, rebuilding only changed areas')
+    parser.add_argument('location', help='Location name, e.g. "Dhaka, Bangladesh"')
+    parser.add_argument('--map-size', type=int, default=5000, help='Distance in meters from the center')
+    parser.add_argument('--detail-level', default='detailed', choices=['major', 'detailed', 'complete'])
+    parser.add_argument('--output', help='Output name (default: built from the other arguments)')
+    parser.add_argument('--output-dir', default='wkt_output', help='Directory for the generated file')
+    parser.add_argument('--formats', nargs='*', default=[], choices=['wkb', 'columnar'],
+                        help='Binary formats to write next to the WKT file')
+    parser.add_argument('--simplify', type=float, default=0, help='Douglas-Peucker tolerance in meters (0 disables)')
+    parser.add_argument('--precision', type=int, default=2, help='Decimal places per coordinate')
+    args = parser.parse_args()
+
+    from batch_generator import default_output_name
+    geometry = parse_geometry_options(args.simplify, args.precision)
+    output = args.output or default_output_name(args.location, args.detail_level, args.map_size, geometry)
+    success, _, _ = create_detailed_city_wkt(args.location, output, args.detail_level, args.map_size,
+                                             save_path=args.output_dir, binary_formats=args.formats,
+                                             incremental=True, geometry=geometry)
+    return 0 if success else 1
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+# Bounded job scheduler for background WKT generation
+# A fixed pool of worker threads drains a bounded FIFO queue. Requests with the
+# same key are coalesced onto one task, and each requester can cancel independently.
+
+import threading
+from collections import deque
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+class Task:
+    """One unit of work, shared by every job that asked for the same key"""
+
+    def __init__(self, task_id, key, fn, args):
+        self.task_id = task_id
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.subscribers = [task_id]
+        self.cancel_event = threading.Event()
+        self.state = 'queued'
+
+class JobScheduler:
+    """
+    Run jobs on a fixed number of worker threads with a bounded FIFO queue
+
+    fn is called as fn(task_id, cancel_event, *args). The cancel event is set
+    once every subscribed job has been cancelled; long-running functions
+    should check it between stages.
+
+    Args:
+        max_workers: Number of jobs that may run at once
+        max_queue: Number of jobs that may wait for a worker
+    """
+
+    def __init__(self, max_workers=2, max_queue=20):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._tasks_by_id = {}
+        self._tasks_by_key = {}
+        self._tasks_by_job = {}
+        self._cond = threading.Condition()
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._worker, name=f"wkt-worker-{i}", daemon=True)
+            worker.start()
+
+    def submit(self, job_id, key, fn, *args):
+        """
+        Queue a job, or attach it to a queued/running task with the same key
+
+        Returns:
+            The task id the job is attached to (job_id itself unless coalesced)
+        """
+        with self._cond:
+            task = self._tasks_by_key.get(key)
+            if task is not None and not task.cancel_event.is_set():
+                task.subscribers.append(job_id)
+                self._tasks_by_job[job_id] = task
+                return task.task_id
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(f"Job queue is full ({self.max_queue} waiting)")
+            task = Task(job_id, key, fn, args)
+            self._queue.append(task)
+            self._tasks_by_id[job_id] = task
+            self._tasks_by_key[key] = task
+            self._tasks_by_job[job_id] = task
+            self._cond.notify()
+            return job_id
+
+    def subscribers(self, task_id):
+        """Return the job ids still waiting on a task"""
+        with self._cond:
+            task = self._tasks_by_id.get(task_id)
+            return list(task.subscribers) if task is not None else []
+
+    def queue_position(self, job_id):
+        """Return the 1-based queue position of a waiting job, 0 if running, or None if unknown"""
+        with self._cond:
+            task = self._tasks_by_job.get(job_id)
+            if task is None:
+                return None
+            if task.state == 'running':
+                return 0
+            try:
+                return self._queue.index(task) + 1
+            except ValueError:
+                return None
+
+    def stats(self):
+        """Return the number of queued and running tasks"""
+        with self._cond:
+            running = sum(1 for task in self._tasks_by_id.values() if task.state == 'running')
+            return {'queued': len(self._queue), 'running': running}
+
+    def cancel(self, job_id):
+        """
+        Cancel a job; the underlying task stops once no other job is attached to it
+
+        Returns:
+            True if the job was queued or running, False if it was unknown or finished
+        """
+        with self._cond:
+            task = self._tasks_by_job.pop(job_id, None)
+            if task is None or job_id not in task.subscribers:
+                return False
+            task.subscribers.remove(job_id)
+            if not task.subscribers:
+                task.cancel_event.set()
+                self._tasks_by_key.pop(task.key, None)
+                if task.state == 'queued':
+                    self._queue.remove(task)
+                    self._tasks_by_id.pop(task.task_id, None)
+                    task.state = 'cancelled'
+            return True
+
+    def _finish(self, task):
+        with self._cond:
+            task.state = 'done'
+            self._tasks_by_id.pop(task.task_id, None)
+            if self._tasks_by_key.get(task.key) is task:
+                del self._tasks_by_key[task.key]
+            for job_id in task.subscribers:
+                if self._tasks_by_job.get(job_id) is task:
+                    del self._tasks_by_job[job_id]
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                task = self._queue.popleft()
+                task.state = 'running'
+            try:
+                task.fn(task.task_id, task.cancel_event, *task.args)
+            except Exception as e:
+                print(f"[DEBUG] Unhandled error in job {task.task_id}: {e}")
+            finally:
+                self._finish(task)
@@ -0,0 +1,346 @@
+# Job status store for the web app
+# Holds the status of generation jobs with TTL expiry and a cap on finished jobs,
+# either in memory or in SQLite so several app processes can share job state.
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+JOB_DB_PATH = os.path.join('cache', 'jobs.sqlite')
+ACTIVE_STATES = ('queued', 'testing', 'downloading', 'processing', 'generating')
+TERMINAL_STATES = ('completed', 'error', 'cancelled')
+# Status fields holding files on disk that belong to a job
+PATH_FIELDS = ('file_path', 'output_path')
+# Subdirectory of the output directory where jobs build their files before publishing them
+JOB_BUILD_DIR = 'jobs'
+
+def _job_paths(status):
+    return {os.path.abspath(status[field]) for field in PATH_FIELDS if status.get(field)}
+
+class MemoryJobStore:
+    """
+    In-process job store
+
+    Every update bumps the job's 'version' and wakes anyone waiting on it.
+    Jobs not updated for ttl seconds are dropped by prune(); when more than
+    max_jobs jobs have finished, the oldest finished ones are dropped on
+    create(). Unfinished jobs are never dropped for the cap.
+
+    Args:
+        ttl: Seconds a job is kept after its last update
+        max_jobs: Number of finished jobs kept
+    """
+
+    def __init__(self, ttl=24 * 3600, max_jobs=1000):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._outputs = set()
+        self._cond = threading.Condition()
+
+    def create(self, job_id, **fields):
+        """Add a job at version 0"""
+        with self._cond:
+            self._jobs[job_id] = dict(fields, job_id=job_id, version=0, updated=time.time())
+            self._drop_excess_finished()
+            self._cond.notify_all()
+
+    def get(self, job_id):
+        """Return a copy of a job's status, or None if unknown"""
+        with self._cond:
+            status = self._jobs.get(job_id)
+            return dict(status) if status is not None else None
+
+    def update(self, job_id, only_from=None, **fields):
+        """
+        Atomically update a job's fields
+
+        Args:
+            job_id: Job to update
+            only_from: If given, the update only applies while the job's status is one of these
+            **fields: Fields to set
+
+        Returns:
+            The updated status, or None if the job is unknown or in another state
+        """
+        with self._cond:
+            status = self._jobs.get(job_id)
+            if status is None or (only_from is not None and status['status'] not in only_from):
+                return None
+            status.update(fields)
+            status['version'] += 1
+            status['updated'] = time.time()
+            self._cond.notify_all()
+            return dict(status)
+
+    def wait_for_change(self, job_id, since, timeout):
+        """Block until a job's version differs from since (or timeout) and return its status"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]['version'] != since,
+                timeout=timeout
+            )
+        return self.get(job_id)
+
+    def prune(self):
+        """Drop jobs not updated within the TTL; returns how many were dropped"""
+        cutoff = time.time() - self.ttl
+        with self._cond:
+            expired = [job_id for job_id, status in self._jobs.items() if status['updated'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+            if expired:
+                self._cond.notify_all()
+        return len(expired)
+
+    def referenced_paths(self):
+        """Return the absolute paths of files recorded by known jobs"""
+        with self._cond:
+            return set().union(*(_job_paths(status) for status in self._jobs.values()))
+
+    def add_outputs(self, paths):
+        """Record files the app created, which cleanup may delete once no job refers to them"""
+        with self._cond:
+            self._outputs.update(os.path.abspath(path) for path in paths)
+
+    def outputs(self):
+        """Return the absolute paths recorded with add_outputs"""
+        with self._cond:
+            return set(self._outputs)
+
+    def forget_outputs(self, paths):
+        """Stop tracking files that were deleted"""
+        with self._cond:
+            self._outputs.difference_update(paths)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._jobs)
+
+    def _drop_excess_finished(self):
+        finished = sorted((status['updated'], job_id) for job_id, status in self._jobs.items()
+                          if status['status'] in TERMINAL_STATES)
+        for _, job_id in finished[:max(0, len(finished) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+class SQLiteJobStore:
+    """
+    Job store in a SQLite file, shared by every process using the same path
+
+    Same interface and expiry rules as MemoryJobStore. Updates run in an
+    immediate transaction so concurrent writers cannot interleave. Waiters
+    are woken at once by changes made in this process and notice changes
+    from other processes within poll_interval seconds.
+
+    Args:
+        db_path: SQLite file holding the jobs table
+        ttl: Seconds a job is kept after its last update
+        max_jobs: Number of finished jobs kept
+        poll_interval: Seconds between checks while waiting for a change
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, ttl=24 * 3600, max_jobs=1000, poll_interval=0.5):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, status TEXT, version INTEGER, updated REAL, data TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated)")
+            conn.execute("CREATE TABLE IF NOT EXISTS outputs (path TEXT PRIMARY KEY)")
+
+    @contextmanager
+    def _connect(self):
+        """Autocommit connection, closed (rolling back an unfinished transaction) when the block exits"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _write(self, conn, status):
+        conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)",
+                     (status['job_id'], status['status'], status['version'], status['updated'], json.dumps(status)))
+
+    def create(self, job_id, **fields):
+        """Add a job at version 0"""
+        status = dict(fields, job_id=job_id, version=0, updated=time.time())
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._write(conn, status)
+            conn.execute(
+                "DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM jobs WHERE status IN (?, ?, ?)"
+                " ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                (*TERMINAL_STATES, self.max_jobs)
+            )
+            conn.execute("COMMIT")
+        with self._cond:
+            self._cond.notify_all()
+
+    def get(self, job_id):
+        """Return a copy of a job's status, or None if unknown"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, only_from=None, **fields):
+        """
+        Atomically update a job's fields
+
+        Args:
+            job_id: Job to update
+            only_from: If given, the update only applies while the job's status is one of these
+            **fields: Fields to set
+
+        Returns:
+            The updated status, or None if the job is unknown or in another state
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            status = json.loads(row[0]) if row else None
+            if status is None or (only_from is not None and status['status'] not in only_from):
+                conn.execute("ROLLBACK")
+                return None
+            status.update(fields)
+            status['version'] += 1
+            status['updated'] = time.time()
+            self._write(conn, status)
+            conn.execute("COMMIT")
+        with self._cond:
+            self._cond.notify_all()
+        return status
+
+    def wait_for_change(self, job_id, since, timeout):
+        """Block until a job's version differs from since (or timeout) and return its status"""
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if status is None or status['version'] != since or remaining <= 0:
+                return status
+            with self._cond:
+                self._cond.wait(min(self.poll_interval, remaining))
+
+    def prune(self):
+        """Drop jobs not updated within the TTL; returns how many were dropped"""
+        with self._connect() as conn:
+            dropped = conn.execute("DELETE FROM jobs WHERE updated < ?", (time.time() - self.ttl,)).rowcount
+        if dropped:
+            with self._cond:
+                self._cond.notify_all()
+        return dropped
+
+    def referenced_paths(self):
+        """Return the absolute paths of files recorded by known jobs"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT data FROM jobs").fetchall()
+        return set().union(*(_job_paths(json.loads(data)) for data, in rows))
+
+    def add_outputs(self, paths):
+        """Record files the app created, which cleanup may delete once no job refers to them"""
+        with self._connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO outputs VALUES (?)", [(os.path.abspath(path),) for path in paths])
+
+    def outputs(self):
+        """Return the absolute paths recorded with add_outputs"""
+        with self._connect() as conn:
+            return {path for path, in conn.execute("SELECT path FROM outputs")}
+
+    def forget_outputs(self, paths):
+        """Stop tracking files that were deleted"""
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM outputs WHERE path = ?", [(path,) for path in paths])
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+def remove_stale_outputs(paths, keep, max_age):
+    """
+    Delete the given app-created files older than max_age seconds, except those in keep
+
+    Only files the app recorded (see add_outputs) are passed in, so other
+    files in the output directory are never touched.
+
+    Returns:
+        List of the paths that no longer exist: deleted now or already gone
+    """
+    cutoff = time.time() - max_age
+    gone = []
+    for path in paths:
+        if path in keep:
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                gone.append(path)
+        except FileNotFoundError:
+            gone.append(path)
+    return gone
+
+def remove_stale_build_dirs(output_dir, max_age):
+    """
+    Delete job build directories older than max_age seconds
+
+    Jobs remove their own build directory when they finish, so these were
+    left by jobs interrupted by a restart.
+
+    Returns:
+        Number of directories removed
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(os.path.join(output_dir, JOB_BUILD_DIR)))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def make_build_dir(output_dir, job_id=None):
+    """Create and return a directory private to one job (or a random one) for it to build its files in"""
+    path = os.path.join(output_dir, JOB_BUILD_DIR, job_id or uuid.uuid4().hex)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def publish_output(built_file, output_dir):
+    """
+    Move a file from a job's build directory, with its binary variants, into output_dir
+
+    Each file replaces any older one atomically, so readers never see a file
+    another job is still writing.
+
+    Returns:
+        Published path of built_file
+    """
+    build_dir, name = os.path.split(built_file)
+    stem = os.path.splitext(name)[0]
+    # The built file itself last, so its appearance means the variants are in place
+    for entry in sorted(os.listdir(build_dir), key=lambda entry: entry == name):
+        if os.path.splitext(entry)[0] == stem:
+            os.replace(os.path.join(build_dir, entry), os.path.join(output_dir, entry))
+    return os.path.join(output_dir, name)
+
+def remove_build_dir(build_dir):
+    """Delete a job's build directory and anything it did not publish"""
+    shutil.rmtree(build_dir, ignore_errors=True)
@@ -1,30 +1,31 @@
-def test_city_availability(city_name):
-    """Test if a city can be found by geocoding using Nominatim (OpenStreetMap). Returns True if found, False otherwise."""
-    try:
-        from geopy.geocoders import Nominatim
-        print(f"[DEBUG] Searching for city: {city_name} using Nominatim")
-        geolocator = Nominatim(user_agent="map_app")
-        location = geolocator.geocode(city_name)
-        print(f"[DEBUG] Geocoder result for '{city_name}': {location}")
-        if not location and city_name.lower() == 'london':
-            location = geolocator.geocode('London, England, UK')
-            print(f"[DEBUG] Fallback to 'London, England, UK': {location}")
-        if not location and city_name.lower() == 'london, uk':
-            location = geolocator.geocode('London, United Kingdom')
-            print(f"[DEBUG] Fallback to 'London, United Kingdom': {location}")
-        return location is not None
-    except Exception as e:
-        print(f"[DEBUG] Exception in test_city_availability: {e}")
-        return False
-
 # Map Generator Module for Flask App
 # Extracted from Map.py for web-based usage
+# osmnx, geopandas and pyproj are imported by the functions that need them, so
+# importing this module (and the app) stays fast; see warm_up. numpy and shapely
+# stay eager on purpose: they are a small part of the app's import time (see
+# benchmarks/bench_startup.py) and the formatting code uses them throughout.
 
-import osmnx as ox
 import os
 from collections import Counter
-from pyproj import Transformer
+from functools import lru_cache
 import re
+import threading
+import numpy as np
+import shapely
+from geocoding import get_geocoding_service
+from data_sources import get_data_source, parse_overpass_filter, tags_match
+from binary_formats import BinaryRoadWriter, binary_path_for
+from simplification import DEFAULT_GEOMETRY, apply_geometry_options, describe_geometry_options, vertex_counts
+from metrics import call_with_stages, record_stages, stage
+
+# Number of coordinate pairs formatted per batch by format_linestrings_wkt
+WKT_FORMAT_CHUNK = 262144
+# Number of edges formatted and written at a time by write_linestrings_wkt
+WKT_WRITE_CHUNK = 50000
+# Radius from which map downloads are split into tiles (see tiled_generator)
+TILED_MIN_RADIUS_M = int(os.environ.get('MAPGEN_TILED_MIN_RADIUS_M', 15000))
+# UTM zones (EPSG codes) whose projection is prepared by warm_up, e.g. 'EPSG:32646'
+WARM_UP_ZONES = [zone for zone in os.environ.get('MAPGEN_WARM_UP_ZONES', '').split(',') if zone]
 
 def get_utm_zone(lat, lon):
     """Get appropriate UTM zone for given coordinates"""
@@ -36,259 +37,711 @@ def get_utm_zone(lat, lon):
         epsg_code = f"327{utm_zone:02d}"  # Southern hemisphere
     return f"EPSG:{epsg_code}"
 
-def create_detailed_city_wkt(city_name, output_filename, detail_level='detailed', custom_size=None, save_path='wkt_output'):
+@lru_cache(maxsize=None)
+def utm_crs(utm_epsg):
+    """Return the pyproj CRS of a UTM zone from get_utm_zone, parsed once per process"""
+    from pyproj import CRS
+    return CRS.from_user_input(utm_epsg)
+
+def _round_coords(match, precision=2):
+    x, y = match.groups()
+    return f"{float(x):.{precision}f} {float(y):.{precision}f}"
+
+def _linestring_wkt_slow(geom, precision=2):
+    """Format a single geometry the original way: full-precision WKT, then regex rounding"""
+    return re.sub(r'(\d+\.\d+)\s+(\d+\.\d+)', lambda match: _round_coords(match, precision), geom.wkt)
+
+def _format_coords_batch(coords, first, last, precision=2):
+    """Format a block of coordinates into newline-separated LINESTRING text with one % call"""
+    pair = f"%.{precision}f %.{precision}f"
+    templates = np.full(len(coords), pair + ", ", dtype=object)
+    templates[last] = pair + ")\n"
+    templates[first] = "LINESTRING (" + templates[first]
+    return "".join(templates.tolist()) % tuple(coords.ravel().tolist())
+
+def format_linestrings_wkt(geometries, precision=2):
+    """
+    Format LINESTRING geometries as WKT with coordinates rounded to precision decimal places
+
+    Coordinates are pulled out of all geometries in one pass and formatted in
+    large batches, producing exactly the same text as rounding each
+    geometry's full-precision WKT with a regex. Geometries that the regex
+    would treat specially (non-LineStrings, empty lines, integral
+    coordinates) fall back to the per-geometry path.
+
+    Args:
+        geometries: GeoSeries or array-like of shapely geometries
+        precision: Decimal places per coordinate (default 2)
+
+    Returns:
+        List of WKT strings, one per geometry, in input order
+    """
+    geoms = np.asarray(geometries, dtype=object)
+    if len(geoms) == 0:
+        return []
+
+    coords, index = shapely.get_coordinates(geoms, return_index=True)
+    fast = shapely.get_type_id(geoms) == 1  # LineString
+    fast &= np.bincount(index, minlength=len(geoms)) > 0
+    # Integral values print without a decimal point and are left unrounded by the regex
+    integral = (coords == np.floor(coords)).any(axis=1)
+    fast[np.unique(index[integral])] = False
+
+    result = [None] * len(geoms)
+    for i in np.flatnonzero(~fast):
+        result[i] = _linestring_wkt_slow(geoms[i], precision)
+
+    fast_idx = np.flatnonzero(fast)
+    if len(fast_idx) == 0:
+        return result
+    keep = fast[index]
+    coords = coords[keep]
+    index = index[keep]
+    first = np.ones(len(index), dtype=bool)
+    first[1:] = index[1:] != index[:-1]
+    last = np.ones(len(index), dtype=bool)
+    last[:-1] = index[1:] != index[:-1]
+
+    # Cut batches on geometry boundaries so every block ends with a complete line
+    starts = np.flatnonzero(first)
+    step = max(1, WKT_FORMAT_CHUNK * len(starts) // len(coords))
+    bounds = starts[::step].tolist() + [len(coords)]
+    lines = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        lines.extend(_format_coords_batch(coords[lo:hi], first[lo:hi], last[lo:hi], precision).split("\n")[:-1])
+
+    for i, line in zip(fast_idx.tolist(), lines):
+        result[i] = line
+    return result
+
+def highway_labels(edges):
+    """Return each edge's highway type, using the first tag when OSM gives a list"""
+    if 'highway' not in edges.columns:
+        return ['unknown'] * len(edges)
+    labels = []
+    for highway_type in edges['highway'].tolist():
+        if isinstance(highway_type, list):
+            highway_type = highway_type[0] if highway_type else 'unknown'
+        labels.append(highway_type)
+    return labels
+
+def count_highway_types(edges):
+    """Count edges per highway type, using the first tag when OSM gives a list"""
+    return Counter(highway_labels(edges))
+
+# Overpass highway filters per detail level; 'complete' uses the drive network
+ROAD_FILTERS = {
+    'major': '["highway"~"motorway|motorway_link|trunk|trunk_link|primary|primary_link|secondary|secondary_link"]',
+    'detailed': '["highway"~"motorway|motorway_link|trunk|trunk_link|primary|primary_link|secondary|secondary_link|tertiary|tertiary_link|residential|unclassified"]',
+}
+
+def get_road_filter(detail_level):
+    """Return (custom_filter, road_desc) for a detail level; custom_filter is None for the full drive network"""
+    if detail_level in ROAD_FILTERS:
+        return ROAD_FILTERS[detail_level], detail_level
+    return None, "complete"
+
+def detail_level_mask(edges, detail_level):
+    """
+    Return a boolean mask of the edges of a complete network that belong to a detail level
+
+    An edge is kept if any of its highway tags passes the level's filter, so
+    a simplified edge along which a road changes type is not dropped.
+    """
+    custom_filter, _ = get_road_filter(detail_level)
+    if custom_filter is None or 'highway' not in edges.columns:
+        return np.ones(len(edges), dtype=bool)
+    clauses = parse_overpass_filter(custom_filter)
+    matches = {}
+
+    def keep(highway_type):
+        tags = highway_type if isinstance(highway_type, list) else [highway_type]
+        for tag in tags:
+            if tag not in matches:
+                matches[tag] = tags_match({'highway': tag}, clauses)
+            if matches[tag]:
+                return True
+        return False
+
+    return np.fromiter((keep(value) for value in edges['highway'].tolist()), dtype=bool, count=len(edges))
+
+def test_city_availability(city_name):
+    """Test if a city can be found by geocoding using Nominatim (OpenStreetMap). Returns True if found, False otherwise."""
+    try:
+        result = get_geocoding_service().resolve(city_name)
+        print(f"[DEBUG] Geocoder result for '{city_name}': {result}")
+        return result is not None
+    except Exception as e:
+        print(f"[DEBUG] Exception in test_city_availability: {e}")
+        return False
+
+def geocode_point(city_name):
+    """Geocode a location name to a (lat, lon) point, raising ValueError with suggestions if not found"""
+    service = get_geocoding_service()
+    result = service.resolve(city_name)
+    if result is None:
+        suggestions = service.suggest(city_name)
+        if suggestions:
+            raise ValueError(f"Location '{city_name}' not found. Did you mean: {suggestions}?")
+        else:
+            raise ValueError(f"Location '{city_name}' not found. Try a more specific name, e.g. 'London, England, UK'.")
+    return (result.lat, result.lon)
+
+def download_graph_from_point(point, dist, custom_filter=None):
+    """Download the road network within dist meters of a (lat, lon) point"""
+    return get_data_source().graph_from_point(point, dist, custom_filter)
+
+def download_graph_from_place(city_name, custom_filter=None):
+    """Download the road network inside a named place's boundary"""
+    return get_data_source().graph_from_place(city_name, custom_filter)
+
+def report_progress(progress_callback, message, **fields):
+    """Send a progress update if the caller asked for them"""
+    if progress_callback:
+        progress_callback(message, **fields)
+
+class GenerationCancelled(Exception):
+    """Raised between the stages of a generation once its cancel_event is set"""
+
+def check_cancelled(cancel_event):
+    """Raise GenerationCancelled if cancel_event (a threading.Event, or None) is set"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelled()
+
+def write_linestrings_wkt(f, geometries, chunk_size=None, progress_callback=None, precision=2, cancel_event=None):
+    """Format and write geometries one slice at a time, so only a slice of WKT text is held in memory"""
+    chunk_size = chunk_size or WKT_WRITE_CHUNK
+    geoms = np.asarray(geometries, dtype=object)
+    for start in range(0, len(geoms), chunk_size):
+        check_cancelled(cancel_event)
+        lines = format_linestrings_wkt(geoms[start:start + chunk_size], precision)
+        f.write("\n".join(lines))
+        f.write("\n")
+        done = min(start + chunk_size, len(geoms))
+        report_progress(progress_callback, f'Serialized {done} of {len(geoms)} road segments',
+                        stage='serializing', progress=round(100 * done / len(geoms)))
+
+def temp_path_for(path, suffix='tmp'):
+    """Return a per-process, per-thread temporary path next to path"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.{suffix}"
+
+def write_wkt_header(f, city_name, road_desc, utm_epsg, highway_counts, custom_size=None, geometry=None,
+                     vertices=None):
+    """
+    Write the comment header describing a WKT file
+
+    Args:
+        geometry: GeometryOptions the file was written with; non-default
+            options are listed, followed by the vertex counts
+        vertices: Tuple of (vertices before, vertices after) the options were applied
+    """
+    # Header matching your format
+    f.write(f"# {road_desc.title()} roads WKT data for {city_name}\n")
+    f.write(f"# Road types: {road_desc}\n")
+    f.write(f"# Coordinate system: {utm_epsg}\n")
+    if custom_size:
+        f.write(f"# Map size: {custom_size}m radius from center\n")
+    f.write(f"# Generated {sum(highway_counts.values())} road segments\n")
+    f.write("# Road type breakdown:\n")
+
+    # Sort highway types for consistent output
+    for highway_type in sorted(highway_counts.keys()):
+        count = highway_counts[highway_type]
+        f.write(f"#   {highway_type}: {count} segments\n")
+
+    if geometry and geometry != DEFAULT_GEOMETRY:
+        for line in describe_geometry_options(geometry):
+            f.write(f"# {line}\n")
+        if vertices:
+            before, after = vertices
+            reduction = 100 * (1 - after / before) if before else 0.0
+            f.write(f"# Vertices: {before} before simplification, {after} after ({reduction:.1f}% fewer)\n")
+
+    f.write("# Format: One LINESTRING per line\n")
+
+def open_binary_writers(wkt_file, binary_formats, precision=2):
+    """Start a BinaryRoadWriter next to wkt_file for each requested binary format"""
+    return [BinaryRoadWriter(binary_path_for(wkt_file, fmt), fmt, precision=precision) for fmt in binary_formats]
+
+def close_binary_writers(writers, city_name, road_desc, utm_epsg, highway_counts, custom_size=None, geometry=None,
+                         vertices=None):
+    """Finish binary outputs with the same metadata as the WKT header"""
+    meta = {}
+    if geometry and geometry != DEFAULT_GEOMETRY:
+        meta['geometry'] = geometry._asdict()
+        if vertices:
+            meta['vertices'] = {'before': vertices[0], 'after': vertices[1]}
+    for writer in writers:
+        writer.close(city=city_name, road_desc=road_desc, utm_epsg=utm_epsg,
+                     custom_size=custom_size, counts=dict(highway_counts), **meta)
+
+def reduce_edges(edges_utm, geometry):
+    """
+    Apply geometry options (see simplification) to projected edges
+
+    Returns:
+        Tuple of (edges, vertices of the original edges in each returned row),
+        the vertices being None when the options are the defaults
+    """
+    if not geometry or geometry == DEFAULT_GEOMETRY:
+        return edges_utm, None
+    with stage('simplify'):
+        return apply_geometry_options(edges_utm, geometry)
+
+def write_edges_wkt(edges_utm, wkt_file, city_name, road_desc, utm_epsg, custom_size=None, progress_callback=None,
+                    binary_formats=(), geometry=None, cancel_event=None):
+    """
+    Stream projected edges to a WKT file, plus any requested binary formats
+
+    The header is computed in a cheap pre-pass over the highway column, then
+    the body is written in slices to a temporary file that is atomically
+    renamed into place, so readers never see a partial file. Binary files
+    (see binary_formats) are finished before the WKT file appears.
+
+    Args:
+        geometry: Optional GeometryOptions; chains are merged and lines
+            simplified before writing, and the header reports the vertex counts
+        cancel_event: Optional threading.Event checked between slices; when it
+            is set, GenerationCancelled is raised and nothing is left behind
+
+    Returns:
+        Counter of road segments per highway type
+    """
+    geometry = geometry or DEFAULT_GEOMETRY
+    edges_utm, before = reduce_edges(edges_utm, geometry)
+    check_cancelled(cancel_event)
+    vertices = None
+    if before is not None:
+        vertices = (int(before.sum()), int(vertex_counts(edges_utm.geometry).sum()))
+    labels = highway_labels(edges_utm)
+    highway_counts = Counter(labels)
+
+    tmp_file = temp_path_for(wkt_file)
+    writers = open_binary_writers(wkt_file, binary_formats, geometry.precision)
+    try:
+        if writers:
+            with stage('binary'):
+                for writer in writers:
+                    writer.append(edges_utm.geometry, labels)
+                close_binary_writers(writers, city_name, road_desc, utm_epsg, highway_counts, custom_size, geometry,
+                                     vertices)
+        with stage('serialize'), open(tmp_file, 'w') as f:
+            write_wkt_header(f, city_name, road_desc, utm_epsg, highway_counts, custom_size, geometry, vertices)
+            write_linestrings_wkt(f, edges_utm.geometry, progress_callback=progress_callback,
+                                  precision=geometry.precision, cancel_event=cancel_event)
+        os.replace(tmp_file, wkt_file)
+    finally:
+        for writer in writers:
+            writer.discard()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    return highway_counts
+
+def write_levels_wkt(edges_utm, wkt_files, city_name, utm_epsg, custom_size=None, progress_callback=None,
+                     binary_formats=(), geometry=None, cancel_event=None):
+    """
+    Write several detail levels of one projected complete network
+
+    Each edge's WKT is formatted once per slice and written to every level
+    file that includes it, so the result for a level is the same as
+    write_edges_wkt on that level's edges. Levels without edges are skipped.
+    Lines are simplified once for every level. With chain merging, each level
+    is written on its own: junctions with roads of lower levels become
+    pass-through nodes once those roads are filtered out.
+
+    Args:
+        edges_utm: Projected edges of the complete network
+        wkt_files: Dict of detail level to output path
+        geometry: Optional GeometryOptions, as for write_edges_wkt
+        cancel_event: Optional threading.Event, as for write_edges_wkt
+
+    Returns:
+        Dict of detail level to Counter of road segments per highway type (None if the level is empty)
+    """
+    geometry = geometry or DEFAULT_GEOMETRY
+    if geometry.merge_chains:
+        results = {level: None for level in wkt_files}
+        for level, wkt_file in wkt_files.items():
+            mask = detail_level_mask(edges_utm, level)
+            if mask.any():
+                results[level] = write_edges_wkt(edges_utm[mask], wkt_file, city_name, get_road_filter(level)[1],
+                                                 utm_epsg, custom_size, progress_callback, binary_formats, geometry,
+                                                 cancel_event)
+        return results
+
+    edges_utm, before = reduce_edges(edges_utm, geometry)
+    check_cancelled(cancel_event)
+    labels = highway_labels(edges_utm)
+    masks = {level: detail_level_mask(edges_utm, level) for level in wkt_files}
+    masks = {level: mask for level, mask in masks.items() if mask.any()}
+    results = {level: None for level in wkt_files}
+    geoms = np.asarray(edges_utm.geometry, dtype=object)
+    after = vertex_counts(geoms) if before is not None else None
+
+    tmp_files = {level: temp_path_for(wkt_files[level]) for level in masks}
+    files = {}
+    writers = {}
+    try:
+        for level, mask in masks.items():
+            level_labels = [label for label, keep in zip(labels, mask) if keep]
+            results[level] = Counter(level_labels)
+            road_desc = get_road_filter(level)[1]
+            vertices = None
+            if before is not None:
+                vertices = (int(before[mask].sum()), int(after[mask].sum()))
+            writers[level] = open_binary_writers(wkt_files[level], binary_formats, geometry.precision)
+            if writers[level]:
+                with stage('binary'):
+                    for writer in writers[level]:
+                        writer.append(geoms[mask], level_labels)
+                    close_binary_writers(writers[level], city_name, road_desc, utm_epsg, results[level], custom_size,
+                                         geometry, vertices)
+            files[level] = open(tmp_files[level], 'w')
+            write_wkt_header(files[level], city_name, road_desc, utm_epsg, results[level], custom_size, geometry,
+                             vertices)
+
+        with stage('serialize'):
+            for start in range(0, len(geoms), WKT_WRITE_CHUNK):
+                check_cancelled(cancel_event)
+                chunk = slice(start, start + WKT_WRITE_CHUNK)
+                lines = format_linestrings_wkt(geoms[chunk], geometry.precision)
+                for level, f in files.items():
+                    selected = [line for line, keep in zip(lines, masks[level][chunk]) if keep]
+                    if selected:
+                        f.write("\n".join(selected))
+                        f.write("\n")
+                done = min(start + WKT_WRITE_CHUNK, len(geoms))
+                report_progress(progress_callback, f'Serialized {done} of {len(geoms)} road segments',
+                                stage='serializing', progress=round(100 * done / len(geoms)))
+
+        for level, f in files.items():
+            f.close()
+            os.replace(tmp_files[level], wkt_files[level])
+    finally:
+        for f in files.values():
+            f.close()
+        for level_writers in writers.values():
+            for writer in level_writers:
+                writer.discard()
+        for tmp_file in tmp_files.values():
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    return results
+
+def project_graph_edges(G, progress_callback=None, cancel_event=None):
+    """
+    Return a road graph's edges projected to their UTM zone
+
+    Returns:
+        Tuple of (edges GeoDataFrame, utm_epsg)
+    """
+    import osmnx as ox
+    with stage('graph_to_gdfs'):
+        edges_gdf = ox.graph_to_gdfs(G, nodes=False)
+    check_cancelled(cancel_event)
+    bounds = edges_gdf.total_bounds
+    center_lon = (bounds[0] + bounds[2]) / 2
+    center_lat = (bounds[1] + bounds[3]) / 2
+    utm_epsg = get_utm_zone(center_lat, center_lon)
+    print(f"   Using coordinate system: {utm_epsg}")
+    with stage('to_crs'):
+        edges_utm = edges_gdf.to_crs(utm_crs(utm_epsg))
+    del edges_gdf
+    report_progress(progress_callback, f'Reprojected {len(edges_utm)} road segments to {utm_epsg}', stage='reprojected')
+    return edges_utm, utm_epsg
+
+def write_graph_wkt(G, city_name, wkt_file, road_desc, custom_size=None, progress_callback=None, binary_formats=(),
+                    geometry=None, cancel_event=None):
+    """
+    Project a road graph to UTM and write it as a WKT file
+
+    Returns:
+        Counter of road segments per highway type
+    """
+    edges_utm, utm_epsg = project_graph_edges(G, progress_callback, cancel_event)
+    return write_edges_wkt(edges_utm, wkt_file, city_name, road_desc, utm_epsg, custom_size, progress_callback,
+                           binary_formats, geometry, cancel_event)
+
+def _generate_graph_wkt(city_name, point, custom_size, custom_filter, road_desc, wkt_file, progress_callback=None,
+                        binary_formats=(), geometry=None, cancel_event=None):
+    """
+    Download, project and serialize one road network
+
+    This is the CPU-heavy part of a job. It only takes and returns small,
+    picklable values so it can run in a process pool worker (without a
+    progress_callback or cancel_event, which cannot cross processes).
+
+    Returns:
+        Counter of road segments per highway type, or None if the network is empty
+    """
+    with stage('download'):
+        if point is not None:
+            G = download_graph_from_point(point, custom_size, custom_filter)
+        else:
+            G = download_graph_from_place(city_name, custom_filter)
+
+    if G is None or len(G.nodes) == 0:
+        return None
+    check_cancelled(cancel_event)
+
+    print(f"   Found {len(G.nodes)} nodes and {len(G.edges)} edges in the network.")
+    report_progress(progress_callback, f'Downloaded {len(G.edges)} road segments', stage='downloaded', edges=len(G.edges))
+    return write_graph_wkt(G, city_name, wkt_file, road_desc, custom_size, progress_callback, binary_formats,
+                           geometry, cancel_event)
+
+def _generate_graph_levels_wkt(city_name, point, custom_size, wkt_files, progress_callback=None, binary_formats=(),
+                               geometry=None, cancel_event=None):
+    """
+    Download and project the complete network once, then write one WKT file per detail level
+
+    Returns:
+        Dict of detail level to Counter (None if the level is empty), or None if the network is empty
+    """
+    with stage('download'):
+        if point is not None:
+            G = download_graph_from_point(point, custom_size)
+        else:
+            G = download_graph_from_place(city_name)
+
+    if G is None or len(G.nodes) == 0:
+        return None
+    check_cancelled(cancel_event)
+
+    print(f"   Found {len(G.nodes)} nodes and {len(G.edges)} edges in the network.")
+    report_progress(progress_callback, f'Downloaded {len(G.edges)} road segments', stage='downloaded', edges=len(G.edges))
+    edges_utm, utm_epsg = project_graph_edges(G, progress_callback, cancel_event)
+    del G
+    return write_levels_wkt(edges_utm, wkt_files, city_name, utm_epsg, custom_size, progress_callback, binary_formats,
+                            geometry, cancel_event)
+
+def warm_up(utm_zones=()):
+    """
+    Import the geo libraries and prepare the projection to each UTM zone
+
+    Projecting a point goes through the same path as project_graph_edges, so
+    the PROJ database is loaded and geopandas' transformer cache holds each
+    zone before the first job needs it.
+
+    Args:
+        utm_zones: EPSG codes as returned by get_utm_zone (default: one zone,
+            which still pays the import and database cost)
+    """
+    import osmnx  # noqa: F401
+    import geopandas
+    from shapely.geometry import Point
+    for utm_epsg in utm_zones or (get_utm_zone(0, 0),):
+        geopandas.GeoSeries([Point(0, 0)], crs="EPSG:4326").to_crs(utm_crs(utm_epsg))
+
+def warm_up_worker():
+    """Process pool initializer: warm up for the zones in MAPGEN_WARM_UP_ZONES"""
+    warm_up(WARM_UP_ZONES)
+
+def make_process_pool(max_workers, initializer=warm_up_worker, initargs=()):
+    """Create a spawn-based process pool whose workers are warmed up on start"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=initializer, initargs=initargs)
+    # Start every worker now instead of on the first jobs
+    for future in [pool.submit(os.getpid) for _ in range(max_workers)]:
+        future.result()
+    return pool
+
+_process_pool = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+def configure_process_pool(max_workers):
+    """Opt in to running the CPU-heavy stages in max_workers processes (0 disables)"""
+    global _process_pool_workers
+    _process_pool_workers = max_workers
+
+def set_process_pool(pool):
+    """Use an existing executor for the CPU-heavy stages, or None to run them in-process"""
+    global _process_pool
+    with _process_pool_lock:
+        _process_pool = pool
+
+def get_process_pool():
+    """Return the process pool, creating it on first use if one was configured"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None and _process_pool_workers > 0:
+            _process_pool = make_process_pool(_process_pool_workers)
+        return _process_pool
+
+def create_detailed_city_wkt(city_name, output_filename, detail_level='detailed', custom_size=None, save_path='wkt_output',
+                             progress_callback=None, binary_formats=(), incremental=False, geometry=None,
+                             cancel_event=None):
     """
     Create detailed WKT files for cities with customizable map size
 
+    With custom_size the network is downloaded once around the geocoded
+    center; without it the whole place boundary is downloaded. Radii of
+    TILED_MIN_RADIUS_M or more are downloaded as a grid of tiles. Geometry
+    options are applied to the edges after they are projected to UTM.
+
     Args:
         city_name: Name of the city/location
         output_filename: Base filename for output
         detail_level: 'major', 'detailed', 'complete'
         custom_size: Distance in meters from center (default: auto-detected)
         save_path: Directory to save the WKT file (default: 'wkt_output')
+        progress_callback: Optional callable(message, **fields) for progress updates
+        binary_formats: Binary formats ('wkb', 'columnar') to also write next to the WKT file
+        incremental: Rebuild only the parts of the area that changed since it was last
+            generated this way (see incremental.py); needs custom_size
+        geometry: Optional GeometryOptions (see simplification): Douglas-Peucker
+            tolerance in meters, coordinate precision and degree-2 chain merging
+        cancel_event: Optional threading.Event; once set, generation stops at the
+            next stage, tile or slice and returns a failure. Work handed to the
+            process pool runs to the end and is only checked afterwards.
+
+    Returns:
+        Tuple of (success, highway_counts, wkt_file)
     """
     try:
-        print(f"📍 Downloading detailed map for: {city_name}")
-
-        if detail_level == 'major':
-            custom_filter = '["highway"~"motorway|motorway_link|trunk|trunk_link|primary|primary_link|secondary|secondary_link"]'
-            road_desc = "major"
-        elif detail_level == 'detailed':
-            custom_filter = '["highway"~"motorway|motorway_link|trunk|trunk_link|primary|primary_link|secondary|secondary_link|tertiary|tertiary_link|residential|unclassified"]'
-            road_desc = "detailed"
-        else:  # complete
-            custom_filter = None
-            road_desc = "complete"
-
-        if custom_size:
-            from geopy.geocoders import Nominatim
-            geolocator = Nominatim(user_agent="map_app")
-            def resolve_location(name):
-                loc = geolocator.geocode(name)
-                if loc is not None and hasattr(loc, '__await__'):
-                    import asyncio
-                    loc = asyncio.run(loc)
-                import types
-                if isinstance(loc, types.CoroutineType):
-                    return None
-                return loc
-
-            location = resolve_location(city_name)
-            if not location and city_name.lower() == 'london':
-                location = resolve_location('London, England, UK')
-            if not location and city_name.lower() == 'london, uk':
-                location = resolve_location('London, United Kingdom')
-            if not location:
-                candidates = geolocator.geocode(city_name, exactly_one=False, addressdetails=True, limit=5)
-                if candidates and hasattr(candidates, '__await__'):
-                    import asyncio
-                    candidates = asyncio.run(candidates)
-                import types
-                if isinstance(candidates, types.CoroutineType):
-                    candidates = None
-                suggestions = []
-                if candidates:
-                    for cand in candidates:
-                        if hasattr(cand, 'address'):
-                            suggestions.append(cand.address)
-                if suggestions:
-                    raise ValueError(f"Location '{city_name}' not found. Did you mean: {suggestions}?")
-                else:
-                    raise ValueError(f"Location '{city_name}' not found. Try a more specific name, e.g. 'London, England, UK'.")
-            if hasattr(location, 'latitude') and hasattr(location, 'longitude'):
-                point = (location.latitude, location.longitude)
-            else:
-                raise ValueError(f"Location object missing latitude/longitude for '{city_name}'")
-            if custom_filter:
-                G = ox.graph_from_point(point, dist=custom_size, custom_filter=custom_filter)
-            else:
-                G = ox.graph_from_point(point, dist=custom_size, network_type='drive')
-        else:
-            if custom_filter:
-                G = ox.graph_from_place(city_name, custom_filter=custom_filter)
-            else:
-                G = ox.graph_from_place(city_name, network_type='drive')
+        print(f"Downloading detailed map for: {city_name}")
+        custom_filter, road_desc = get_road_filter(detail_level)
 
-        nodes_gdf, edges_gdf = ox.graph_to_gdfs(G)
-        print(f"   📊 Found {len(edges_gdf)} road segments")
-        bounds = edges_gdf.total_bounds
-        center_lon = (bounds[0] + bounds[2]) / 2
-        center_lat = (bounds[1] + bounds[3]) / 2
-        utm_epsg = get_utm_zone(center_lat, center_lon)
-        print(f"   🗺️  Using coordinate system: {utm_epsg}")
-        edges_utm = edges_gdf.to_crs(utm_epsg)
-        highway_counts = Counter()
-        total_segments = 0
+        with stage('geocode'):
+            point = geocode_point(city_name) if custom_size else None
+        if point is not None:
+            report_progress(progress_callback, f'Geocoded {city_name} to {point[0]:.5f}, {point[1]:.5f}', stage='geocoded')
+        check_cancelled(cancel_event)
 
         # Create output directory
         os.makedirs(save_path, exist_ok=True)
-
-        # Prepare WKT file
         wkt_file = os.path.join(save_path, f"{output_filename}.wkt")
 
-        # Count road types and prepare data
-        linestrings = []
-        for idx, row in edges_utm.iterrows():
-            highway_type = row.get('highway', 'unknown')
-            if isinstance(highway_type, list):
-                highway_type = highway_type[0] if highway_type else 'unknown'
-
-            highway_counts[highway_type] += 1
-            total_segments += 1
-
-            # Get the geometry as WKT and format coordinates
-            geom_wkt = row.geometry.wkt
-
-            # Round coordinates to 2 decimal places
-            def round_coords(match):
-                x, y = match.groups()
-                return f"{float(x):.2f} {float(y):.2f}"
-
-            # Replace coordinate pairs in WKT string
-            geom_wkt = re.sub(r'(\d+\.\d+)\s+(\d+\.\d+)', round_coords, geom_wkt)
-            try:
-                print(f"Downloading detailed map for: {city_name}")
-
-                if detail_level == 'major':
-                    custom_filter = '["highway"~"motorway|motorway_link|trunk|trunk_link|primary|primary_link|secondary|secondary_link"]'
-                    road_desc = "major"
-                elif detail_level == 'detailed':
-                    custom_filter = '["highway"~"motorway|motorway_link|trunk|trunk_link|primary|primary_link|secondary|secondary_link|tertiary|tertiary_link|residential|unclassified"]'
-                    road_desc = "detailed"
-                else:  # complete
-                    custom_filter = None
-                    road_desc = "complete"
-
-                # Use OSMnx's place search directly for standard city names
-                if custom_filter:
-                    G = ox.graph_from_place(city_name, custom_filter=custom_filter)
-                else:
-                    G = ox.graph_from_place(city_name, network_type='drive')
-
-                if G is None or len(G.nodes) == 0:
-                    print(f"Error: No road network found for '{city_name}'. Try a more specific or different name.")
-                    return False, {}, None
-
-                print(f"   Found {len(G.nodes)} nodes and {len(G.edges)} edges in the network.")
-
-                nodes_gdf, edges_gdf = ox.graph_to_gdfs(G)
-                bounds = edges_gdf.total_bounds
-                center_lon = (bounds[0] + bounds[2]) / 2
-                center_lat = (bounds[1] + bounds[3]) / 2
-                utm_epsg = get_utm_zone(center_lat, center_lon)
-                print(f"   Using coordinate system: {utm_epsg}")
-                edges_utm = edges_gdf.to_crs(utm_epsg)
-                highway_counts = Counter()
-                total_segments = 0
-
-                # Create output directory
-                os.makedirs(save_path, exist_ok=True)
-
-                # Prepare WKT file
-                wkt_file = os.path.join(save_path, f"{output_filename}.wkt")
-
-                # Count road types and prepare data
-                linestrings = []
-                for idx, row in edges_utm.iterrows():
-                    highway_type = row.get('highway', 'unknown')
-                    if isinstance(highway_type, list):
-                        highway_type = highway_type[0] if highway_type else 'unknown'
-
-                    highway_counts[highway_type] += 1
-                    total_segments += 1
-
-                    # Get the geometry as WKT and format coordinates
-                    geom_wkt = row.geometry.wkt
-
-                    # Round coordinates to 2 decimal places
-                    def round_coords(match):
-                        x, y = match.groups()
-                        return f"{float(x):.2f} {float(y):.2f}"
-
-                    # Replace coordinate pairs in WKT string
-                    geom_wkt = re.sub(r'(\d+\.\d+)\s+(\d+\.\d+)', round_coords, geom_wkt)
-                    linestrings.append(geom_wkt)
-
-                # Write the file with exact format
-                with open(wkt_file, 'w') as f:
-                    # Header matching your format
-                    f.write(f"# {road_desc.title()} roads WKT data for {city_name}\n")
-                    f.write(f"# Road types: {road_desc}\n")
-                    f.write(f"# Coordinate system: {utm_epsg}\n")
-                    if custom_size:
-                        f.write(f"# Map size: {custom_size}m radius from center\n")
-                    f.write(f"# Generated {total_segments} road segments\n")
-                    f.write("# Road type breakdown:\n")
-
-                    # Sort highway types for consistent output
-                    for highway_type in sorted(highway_counts.keys()):
-                        count = highway_counts[highway_type]
-                        f.write(f"#   {highway_type}: {count} segments\n")
-
-                    f.write("# Format: One LINESTRING per line\n")
-
-                    # Write all linestrings
-                    for linestring in linestrings:
-                        f.write(f"{linestring}\n")
-
-                print(f"Success: {city_name} ({detail_level}): {total_segments} road segments")
-                print(f"   File: {wkt_file}")
-                print(f"   Road types found: {len(highway_counts)} different types")
-
-                return True, highway_counts, wkt_file
-
-            except Exception as e:
-                print(f"Failed to process {city_name}: {e}")
-                return False, {}, None
-        G = ox.graph_from_point(point, dist=1000, network_type='drive')  # Small area test
-        print(f"✅ {city_name} found! {len(G.nodes)} nodes in test area")
-        return True
+        stage_args = (city_name, point, custom_size, custom_filter, road_desc, wkt_file)
+        pool = get_process_pool()
+        if incremental and point is not None:
+            from incremental import generate_incremental_wkt
+            with stage('incremental_generate'):
+                highway_counts = generate_incremental_wkt(*stage_args, progress_callback=progress_callback,
+                                                          binary_formats=binary_formats, geometry=geometry,
+                                                          cancel_event=cancel_event)
+        elif custom_size and custom_size >= TILED_MIN_RADIUS_M:
+            from tiled_generator import generate_tiled_wkt
+            with stage('tiled_generate'):
+                highway_counts = generate_tiled_wkt(*stage_args, progress_callback=progress_callback,
+                                                    binary_formats=binary_formats, geometry=geometry,
+                                                    cancel_event=cancel_event)
+        elif pool is not None:
+            # Stages run in the worker process come back with the result
+            highway_counts, stages = pool.submit(call_with_stages, _generate_graph_wkt, *stage_args,
+                                                 binary_formats=binary_formats, geometry=geometry).result()
+            record_stages(stages)
+            check_cancelled(cancel_event)
+        else:
+            highway_counts = _generate_graph_wkt(*stage_args, progress_callback=progress_callback,
+                                                 binary_formats=binary_formats, geometry=geometry,
+                                                 cancel_event=cancel_event)
+
+        if highway_counts is None:
+            print(f"Error: No road network found for '{city_name}'. Try a more specific or different name.")
+            return False, {}, None
+
+        print(f"Success: {city_name} ({detail_level}): {sum(highway_counts.values())} road segments")
+        print(f"   File: {wkt_file}")
+        print(f"   Road types found: {len(highway_counts)} different types")
+
+        return True, highway_counts, wkt_file
+
+    except GenerationCancelled:
+        print(f"Cancelled: {city_name} ({detail_level})")
+        return False, {}, None
     except Exception as e:
-        print(f"❌ {city_name} not found: {str(e)[:100]}...")
-        return False
+        print(f"Failed to process {city_name}: {e}")
+        return False, {}, None
+
+def create_city_wkt_levels(city_name, output_filenames, custom_size=None, save_path='wkt_output',
+                           progress_callback=None, binary_formats=(), geometry=None, cancel_event=None):
+    """
+    Create WKT files for several detail levels of one area from a single download
+
+    The complete network is downloaded and projected once; 'major' and
+    'detailed' are filtered from it on the highway tag. Compared with a
+    separate download with the level's filter, roads are split into more
+    segments (at every junction of the complete network) and follow the
+    complete network's access rules (e.g. private roads are left out).
+    Radii of TILED_MIN_RADIUS_M or more are generated level by
+    level, most inclusive first, relying on the network cache to reuse the
+    tiles.
+
+    Args:
+        city_name: Name of the city/location
+        output_filenames: Dict of detail level ('major', 'detailed', 'complete') to base filename
+        custom_size: Distance in meters from center (default: auto-detected)
+        save_path: Directory to save the WKT files (default: 'wkt_output')
+        progress_callback: Optional callable(message, **fields) for progress updates
+        binary_formats: Binary formats ('wkb', 'columnar') to also write next to each WKT file
+        geometry: Optional GeometryOptions applied to every level (see write_levels_wkt)
+        cancel_event: Optional threading.Event, as for create_detailed_city_wkt
+
+    Returns:
+        Dict of detail level to (success, highway_counts, wkt_file), as from create_detailed_city_wkt
+    """
+    if custom_size and custom_size >= TILED_MIN_RADIUS_M:
+        order = sorted(output_filenames, key=lambda level: get_road_filter(level)[0] is not None)
+        return {level: create_detailed_city_wkt(city_name, output_filenames[level], level, custom_size, save_path,
+                                                progress_callback, binary_formats, geometry=geometry,
+                                                cancel_event=cancel_event)
+                for level in order}
+
+    failed = {level: (False, {}, None) for level in output_filenames}
+    try:
+        print(f"Downloading complete map for {', '.join(output_filenames)}: {city_name}")
+        with stage('geocode'):
+            point = geocode_point(city_name) if custom_size else None
+        if point is not None:
+            report_progress(progress_callback, f'Geocoded {city_name} to {point[0]:.5f}, {point[1]:.5f}', stage='geocoded')
+        check_cancelled(cancel_event)
+
+        os.makedirs(save_path, exist_ok=True)
+        wkt_files = {level: os.path.join(save_path, f"{name}.wkt") for level, name in output_filenames.items()}
+
+        pool = get_process_pool()
+        if pool is not None:
+            level_counts, stages = pool.submit(call_with_stages, _generate_graph_levels_wkt, city_name, point,
+                                               custom_size, wkt_files, binary_formats=binary_formats,
+                                               geometry=geometry).result()
+            record_stages(stages)
+            check_cancelled(cancel_event)
+        else:
+            level_counts = _generate_graph_levels_wkt(city_name, point, custom_size, wkt_files, progress_callback,
+                                                      binary_formats, geometry, cancel_event)
+
+        if level_counts is None:
+            print(f"Error: No road network found for '{city_name}'. Try a more specific or different name.")
+            return failed
+
+        results = {}
+        for level, counts in level_counts.items():
+            if counts is None:
+                print(f"Error: No {level} roads found for '{city_name}'.")
+                results[level] = (False, {}, None)
+            else:
+                print(f"Success: {city_name} ({level}): {sum(counts.values())} road segments")
+                results[level] = (True, counts, wkt_files[level])
+        return results
+
+    except GenerationCancelled:
+        print(f"Cancelled: {city_name} ({', '.join(output_filenames)})")
+        return failed
+    except Exception as e:
+        print(f"Failed to process {city_name}: {e}")
+        return failed
 
 def get_map_bounds(city_name):
     """Get the geographical bounds of a city"""
     try:
         # Get a small sample to find bounds
-        from geopy.geocoders import Nominatim
-        geolocator = Nominatim(user_agent="map_app")
-        def resolve_location(name):
-            loc = geolocator.geocode(name)
-            if loc is not None and hasattr(loc, '__await__'):
-                import asyncio
-                loc = asyncio.run(loc)
-            import types
-            if isinstance(loc, types.CoroutineType):
-                return None
-            return loc
-
-        location = resolve_location(city_name)
-        if not location and city_name.lower() == 'london':
-            location = resolve_location('London, England, UK')
-        if not location and city_name.lower() == 'london, uk':
-            location = resolve_location('London, United Kingdom')
-        if not location:
-            candidates = geolocator.geocode(city_name, exactly_one=False, addressdetails=True, limit=5)
-            if candidates and hasattr(candidates, '__await__'):
-                import asyncio
-                candidates = asyncio.run(candidates)
-            import types
-            if isinstance(candidates, types.CoroutineType):
-                candidates = None
-            suggestions = []
-            if candidates:
-                for cand in candidates:
-                    if hasattr(cand, 'address'):
-                        suggestions.append(cand.address)
-            if suggestions:
-                raise ValueError(f"Location '{city_name}' not found. Did you mean: {suggestions}?")
-            else:
-                raise ValueError(f"Location '{city_name}' not found. Try a more specific name, e.g. 'London, England, UK'.")
-        if hasattr(location, 'latitude') and hasattr(location, 'longitude'):
-            point = (location.latitude, location.longitude)
-        else:
-            raise ValueError(f"Location object missing latitude/longitude for '{city_name}'")
+        import osmnx as ox
+        point = geocode_point(city_name)
         G = ox.graph_from_point(point, dist=2000, network_type='drive')
         nodes_gdf, edges_gdf = ox.graph_to_gdfs(G)
         bounds = edges_gdf.total_bounds
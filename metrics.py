@@ -0,0 +1,240 @@
+# Stage timings and Prometheus metrics for the generation pipeline
+# Code wraps each pipeline step in `with stage('name'):`. Every stage feeds the
+# process-wide histograms served at /metrics and, when the thread is running a
+# job (see job_metrics), that job's list of stage records.
+
+import cProfile
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the stage duration histogram buckets
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Seconds between memory samples while a stage is running
+RSS_SAMPLE_INTERVAL = 0.05
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+def current_rss():
+    """Return this process's resident memory in bytes (peak so far where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class _MemorySampler:
+    """Background thread tracking the highest RSS seen while stages are running"""
+
+    def __init__(self):
+        self._active = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+
+    def start(self, record):
+        with self._lock:
+            self._active.append(record)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def stop(self, record):
+        with self._lock:
+            self._active.remove(record)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._wake.wait()
+            rss = current_rss()
+            # Under the lock: a record stopped meanwhile is no longer active and may be finalized
+            with self._lock:
+                for record in self._active:
+                    record['peak_rss'] = max(record['peak_rss'], rss)
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+class _Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = defaultdict(lambda: [0] * len(STAGE_BUCKETS))
+        self.seconds = Counter()
+        self.cpu_seconds = Counter()
+        self.counts = Counter()
+        self.counters = defaultdict(Counter)
+
+_metrics = _Metrics()
+_sampler = _MemorySampler()
+_current = threading.local()
+# Held by the job being profiled under cProfile, see job_metrics
+_profiler_lock = threading.Lock()
+
+def observe_stage(record):
+    """Add a finished stage record to the histograms and to the current job, if any"""
+    name, wall = record['stage'], record['wall_s']
+    with _metrics.lock:
+        for i, bound in enumerate(STAGE_BUCKETS):
+            if wall <= bound:
+                _metrics.buckets[name][i] += 1
+        _metrics.seconds[name] += wall
+        _metrics.cpu_seconds[name] += record['cpu_s']
+        _metrics.counts[name] += 1
+    profile = getattr(_current, 'profile', None)
+    if profile is not None:
+        profile.stages.append(record)
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage
+
+    Records wall time, CPU time of the calling thread (work handed to other
+    threads is not included) and the process's peak RSS while it ran. Stages
+    may nest; 'depth' is the number of stages of this thread enclosing it.
+    """
+    rss = current_rss()
+    depth = getattr(_current, 'depth', 0)
+    record = {'stage': name, 'depth': depth, 'wall_s': 0.0, 'cpu_s': 0.0, 'rss_start_mb': round(rss / 2**20, 1),
+              'peak_rss': rss}
+    _sampler.start(record)
+    _current.depth = depth + 1
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall_start, 4)
+        record['cpu_s'] = round(time.thread_time() - cpu_start, 4)
+        _current.depth = depth
+        _sampler.stop(record)
+        record['peak_rss_mb'] = round(max(record.pop('peak_rss'), current_rss()) / 2**20, 1)
+        observe_stage(record)
+
+def increment(metric, amount=1, **labels):
+    """Add to a labelled counter exported at /metrics"""
+    with _metrics.lock:
+        _metrics.counters[metric][tuple(sorted(labels.items()))] += amount
+
+class JobProfile:
+    """Stage records of one job, and the path of its cProfile dump if profiling was on"""
+
+    def __init__(self, profile_path=None):
+        self.stages = []
+        self.profile_path = profile_path
+
+    def as_dict(self):
+        """Return the stages and their totals for the job status payload"""
+        # Nested stages are part of the stage enclosing them, so only top-level ones are summed
+        top_level = [record for record in self.stages if not record.get('depth')]
+        return {
+            'stages': list(self.stages),
+            'total_wall_s': round(sum(record['wall_s'] for record in top_level), 4),
+            'total_cpu_s': round(sum(record['cpu_s'] for record in top_level), 4),
+            'peak_rss_mb': max((record['peak_rss_mb'] for record in self.stages), default=None),
+            'profile_path': self.profile_path,
+        }
+
+def current_profile():
+    """Return the JobProfile collecting this thread's stages, or None outside job_metrics"""
+    return getattr(_current, 'profile', None)
+
+@contextmanager
+def job_metrics(profile_dir=None, name='job'):
+    """
+    Collect the stages run by this thread into a JobProfile
+
+    Args:
+        profile_dir: If set, the block also runs under cProfile and the
+            stats are dumped to <profile_dir>/<name>.prof
+        name: Job name used for the profile file
+    """
+    profile = JobProfile(os.path.join(profile_dir, f"{name}.prof") if profile_dir else None)
+    previous = getattr(_current, 'profile', None)
+    _current.profile = profile
+    profiler = None
+    try:
+        # Only one cProfile may be active per process on Python 3.12+, so a job
+        # started while another is being profiled runs unprofiled
+        if profile_dir and _profiler_lock.acquire(blocking=False):
+            try:
+                os.makedirs(profile_dir, exist_ok=True)
+                profiler = cProfile.Profile()
+                profiler.enable()
+            except (OSError, ValueError):
+                profiler = None
+                _profiler_lock.release()
+        if profiler is None:
+            profile.profile_path = None
+        yield profile
+    finally:
+        if profiler is not None:
+            try:
+                profiler.disable()
+                profiler.dump_stats(profile.profile_path)
+            finally:
+                _profiler_lock.release()
+        _current.profile = previous
+
+def call_with_stages(fn, *args, **kwargs):
+    """
+    Run fn and return (result, stage records)
+
+    Used for work submitted to a process pool: the records travel back with
+    the result and are added to the caller's job with record_stages.
+    """
+    with job_metrics() as profile:
+        result = fn(*args, **kwargs)
+    return result, profile.stages
+
+def record_stages(records):
+    """Add stage records produced in another process, nested under the caller's open stages"""
+    depth = getattr(_current, 'depth', 0)
+    for record in records:
+        observe_stage(dict(record, depth=record.get('depth', 0) + depth))
+
+def _labels(pairs):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}" if pairs else ""
+
+def render_prometheus(gauges=None):
+    """
+    Render all metrics in the Prometheus text exposition format
+
+    Args:
+        gauges: Optional dict of metric name to value, or to a dict of
+            label tuple to value, for point-in-time values computed by the caller
+    """
+    lines = [
+        "# HELP mapgen_stage_seconds Wall time of generation pipeline stages",
+        "# TYPE mapgen_stage_seconds histogram",
+    ]
+    with _metrics.lock:
+        for name in sorted(_metrics.counts):
+            for bound, count in zip(STAGE_BUCKETS, _metrics.buckets[name]):
+                lines.append(f'mapgen_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'mapgen_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {_metrics.counts[name]}')
+            lines.append(f'mapgen_stage_seconds_sum{{stage="{name}"}} {_metrics.seconds[name]:.6f}')
+            lines.append(f'mapgen_stage_seconds_count{{stage="{name}"}} {_metrics.counts[name]}')
+        lines.append("# HELP mapgen_stage_cpu_seconds_total CPU time of generation pipeline stages")
+        lines.append("# TYPE mapgen_stage_cpu_seconds_total counter")
+        for name in sorted(_metrics.cpu_seconds):
+            lines.append(f'mapgen_stage_cpu_seconds_total{{stage="{name}"}} {_metrics.cpu_seconds[name]:.6f}')
+        for metric in sorted(_metrics.counters):
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in sorted(_metrics.counters[metric].items()):
+                lines.append(f"{metric}{_labels(labels)} {value}")
+
+    for metric, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {metric} gauge")
+        if isinstance(value, dict):
+            for labels, labelled_value in sorted(value.items()):
+                lines.append(f"{metric}{_labels(labels)} {labelled_value}")
+        else:
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,389 @@
+# Cache of raw road network downloads with bounding-box containment reuse
+# Every Overpass download is stored as a WayIndex together with its box and
+# highway filter. A later request whose box and filter fall inside a cached
+# entry is answered by clipping and filtering that entry locally. osmnx is
+# imported only once a graph is built (see data_sources.graph_from_ways).
+
+try:
+    import fcntl
+except ImportError:  # Windows: entries are only protected from eviction within one process
+    fcntl = None
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from data_sources import (SIMPLIFY_BUFFER_M, IndexedSource, WayIndex, buffer_bbox, graph_from_ways,
+                          network_filter, parse_overpass_filter, tags_match)
+from metrics import increment
+
+NETWORK_CACHE_DIR = os.path.join('cache', 'network')
+NETWORK_CACHE_MAX_AGE_HOURS = float(os.environ.get('MAPGEN_NETWORK_CACHE_MAX_AGE_HOURS', 24 * 7))
+
+def format_overpass_filter(clauses):
+    """Inverse of parse_overpass_filter"""
+    return "".join(f'["{key}"]' if op is None else f'["{key}"{op}"{value}"]' for key, op, value in clauses)
+
+def fetch_clauses(clauses):
+    """
+    Return the clauses used to download a network for the given filter
+
+    Only the highway clauses are sent to Overpass; the rest (access, area,
+    service...) are applied locally, so one download can serve several
+    detail levels.
+    """
+    return [clause for clause in clauses if clause[0] == 'highway']
+
+def filter_covers(cached, requested):
+    """
+    Return True if every way matching the requested clauses also matches the cached ones
+
+    A cached clause is implied if the request has the same clause, or if
+    the request lists explicit alternatives for the key (["k"~"a|b"]) and
+    every alternative satisfies it. Tag values are treated as single tokens.
+    """
+    for clause in cached:
+        if clause in requested:
+            continue
+        key = clause[0]
+        alternatives = [value for k, op, value in requested if k == key and op == '~' and re.fullmatch(r'[\w|]+', value)]
+        if not alternatives:
+            return False
+        if not all(tags_match({key: alt}, [clause]) for alt in alternatives[0].split('|')):
+            return False
+    return True
+
+def bbox_contains(outer, inner):
+    """Return True if (north, south, east, west) box outer contains inner"""
+    return outer[0] >= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] <= inner[3]
+
+class NetworkCache:
+    """
+    Size-bounded LRU store of downloaded networks
+
+    The catalog (cache_dir/catalog.sqlite) lists each entry's box, filter,
+    size, download time and last use; the ways themselves live in one
+    WayIndex file per entry. Entries older than max_age seconds are not
+    used, so edits in OpenStreetMap reach the output eventually.
+
+    Several processes (e.g. the process pool's workers) may share a cache
+    directory. Every reader of an entry holds a shared flock on its
+    <id>.lock file, and an evicted or replaced entry's files are deleted
+    only once its exclusive lock can be taken; until then it stays listed
+    in the catalog's 'dropped' table and the next release retries. Where
+    flock is unavailable (Windows) only readers in the same process are
+    waited for, so such a cache must not be shared between processes.
+    """
+
+    def __init__(self, cache_dir=NETWORK_CACHE_DIR, max_bytes=2048 * 1024 * 1024,
+                 max_age=NETWORK_CACHE_MAX_AGE_HOURS * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.counters = Counter(hits=0, misses=0, clips=0)
+        self._lock = threading.Lock()
+        # Readers of each entry in this process
+        self._in_use = Counter()
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " id TEXT PRIMARY KEY, north REAL, south REAL, east REAL, west REAL,"
+                " filter TEXT, size INTEGER, last_used REAL, created REAL)"
+            )
+            if 'created' not in [row[1] for row in conn.execute("PRAGMA table_info(entries)")]:
+                # Catalogs from before max_age: their entries count as expired
+                conn.execute("ALTER TABLE entries ADD COLUMN created REAL DEFAULT 0")
+            # Entries removed from the catalog whose files are deleted once no process reads them
+            conn.execute("CREATE TABLE IF NOT EXISTS dropped (id TEXT PRIMARY KEY)")
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.cache_dir, 'catalog.sqlite'), timeout=30)
+
+    @contextmanager
+    def _transaction(self):
+        """Catalog write transaction, serialized with every other thread and process using the cache"""
+        with self._lock, self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+
+    def _index_path(self, entry_id):
+        return os.path.join(self.cache_dir, f"{entry_id}.sqlite")
+
+    def _lock_path(self, entry_id):
+        return os.path.join(self.cache_dir, f"{entry_id}.lock")
+
+    def _acquire(self, entry_id):
+        """Register a reader of an entry (in a catalog transaction); returns the handle to pass to _release"""
+        self._in_use[entry_id] += 1
+        if fcntl is None:
+            return None
+        fd = os.open(self._lock_path(entry_id), os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        return fd
+
+    @contextmanager
+    def lookup(self, bbox, clauses):
+        """
+        Find the smallest fresh entry covering bbox whose filter covers clauses
+
+        The entry's file is not deleted by eviction or replacement, in this or
+        another process, until the block exits, so it can be queried safely inside it.
+
+        Yields:
+            Tuple of (WayIndex, exact) or None; exact is True when box and filter match exactly
+        """
+        found = self._find(bbox, clauses)
+        try:
+            yield found and found[2:]
+        finally:
+            if found is not None:
+                self._release(*found[:2])
+
+    def _find(self, bbox, clauses):
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, north, south, east, west, filter FROM entries"
+                " WHERE north >= ? AND south <= ? AND east >= ? AND west <= ? AND created >= ?"
+                " ORDER BY (north - south) * (east - west)",
+                (*bbox, time.time() - self.max_age)
+            ).fetchall()
+            for entry_id, north, south, east, west, osm_filter in rows:
+                cached = parse_overpass_filter(osm_filter)
+                if not filter_covers(cached, clauses) or not os.path.exists(self._index_path(entry_id)):
+                    continue
+                conn.execute("UPDATE entries SET last_used = ? WHERE id = ?", (time.time(), entry_id))
+                handle = self._acquire(entry_id)
+                exact = (north, south, east, west) == tuple(bbox) and cached == fetch_clauses(clauses)
+                self.counters['hits' if exact else 'clips'] += 1
+                increment('mapgen_network_cache_requests_total', result='hit' if exact else 'clip')
+                return entry_id, handle, WayIndex(self._index_path(entry_id)), exact
+            self.counters['misses'] += 1
+            increment('mapgen_network_cache_requests_total', result='miss')
+            return None
+
+    def _release(self, entry_id, handle):
+        with self._transaction() as conn:
+            self._in_use[entry_id] -= 1
+            if self._in_use[entry_id] <= 0:
+                del self._in_use[entry_id]
+            if handle is not None:
+                os.close(handle)
+            self._purge(conn)
+
+    def _try_delete(self, entry_id):
+        """Delete an entry's files unless it is being read; returns True once they are gone"""
+        if self._in_use[entry_id] > 0:
+            return False
+        if fcntl is None:
+            self._delete_files(entry_id)
+            return True
+        fd = os.open(self._lock_path(entry_id), os.O_RDWR | os.O_CREAT)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            self._delete_files(entry_id)
+            return True
+        finally:
+            os.close(fd)
+
+    def _delete_files(self, entry_id):
+        for path in (self._index_path(entry_id), self._lock_path(entry_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _purge(self, conn):
+        """Delete the files of dropped entries that no process reads any more"""
+        for (entry_id,) in conn.execute("SELECT id FROM dropped").fetchall():
+            if self._try_delete(entry_id):
+                conn.execute("DELETE FROM dropped WHERE id = ?", (entry_id,))
+
+    def _drop(self, conn, entry_id):
+        """Remove an entry from the catalog; its files go now, or once its last reader is done"""
+        conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+        if not self._try_delete(entry_id):
+            conn.execute("INSERT OR IGNORE INTO dropped VALUES (?)", (entry_id,))
+
+    @contextmanager
+    def add(self, bbox, osm_filter, fill, replace=False):
+        """
+        Store a new entry; fill(writer) adds the downloaded nodes and ways
+
+        With replace, entries with the same box and filter are dropped, so
+        lookups cannot return their older data. Like lookup, the entry is
+        kept on disk until the block exits.
+
+        Yields:
+            WayIndex of the new entry
+        """
+        entry_id = uuid.uuid4().hex
+        index = WayIndex(self._index_path(entry_id))
+        index.build(fill, osm_filter)
+        size = os.path.getsize(index.index_path)
+        now = time.time()
+        with self._transaction() as conn:
+            if replace:
+                stale = conn.execute("SELECT id FROM entries WHERE north = ? AND south = ? AND east = ? AND west = ?"
+                                     " AND filter = ?", (*bbox, osm_filter)).fetchall()
+                for (stale_id,) in stale:
+                    self._drop(conn, stale_id)
+            conn.execute("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (entry_id, *bbox, osm_filter, size, now, now))
+            handle = self._acquire(entry_id)
+            self._evict(conn, keep=entry_id)
+        try:
+            yield index
+        finally:
+            self._release(entry_id, handle)
+
+    def _evict(self, conn, keep=None):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        for (entry_id,) in conn.execute("SELECT id FROM entries WHERE created < ?",
+                                        (time.time() - self.max_age,)).fetchall():
+            self._drop(conn, entry_id)
+        rows = conn.execute("SELECT id, size FROM entries ORDER BY last_used").fetchall()
+        total = sum(size for _, size in rows)
+        for entry_id, size in rows:
+            if total <= self.max_bytes:
+                break
+            if entry_id == keep:
+                continue
+            self._drop(conn, entry_id)
+            total -= size
+
+    def stats(self):
+        """Return hit/miss/clip counters and the current entry count and size"""
+        with self._lock, self._connect() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return dict(self.counters, entries=entries, bytes=size)
+
+def _fill_from_overpass(responses):
+    def fill(writer):
+        for response_json in responses:
+            for element in response_json.get('elements', []):
+                if element['type'] == 'node':
+                    writer.add_node(element['id'], element['lat'], element['lon'])
+                elif element['type'] == 'way' and 'highway' in element.get('tags', {}):
+                    writer.add_way(element['id'], element['tags'], element['nodes'])
+    return fill
+
+def overpass_request(query):
+    """
+    Send one Overpass QL query and return its JSON response
+
+    Unlike osmnx's downloads, the response is never read from or saved to
+    osmnx's response cache: callers ask for the data as it is now.
+    """
+    import requests
+    from osmnx import _downloader, _overpass, settings
+    url = settings.overpass_endpoint.rstrip('/') + '/interpreter'
+    while True:
+        time.sleep(_overpass._get_overpass_pause(settings.overpass_endpoint))
+        response = requests.post(url, data={'data': query}, timeout=settings.timeout,
+                                 headers=_downloader._get_http_headers(), **settings.requests_kwargs)
+        # Rate limited or overloaded: wait for a free slot and retry, like osmnx
+        if response.status_code not in (429, 504):
+            return _downloader._parse_response(response)
+
+def _overpass_polygons(bbox):
+    """Return the Overpass (poly:...) strings covering a (north, south, east, west) box"""
+    from shapely.geometry import box
+    from osmnx import _overpass
+    north, south, east, west = bbox
+    return _overpass._make_overpass_polygon_coord_strs(box(west, south, east, north))
+
+def download_overpass_network(bbox, osm_filter, fresh=False):
+    """
+    Download raw Overpass responses for the ways matching osm_filter in a (north, south, east, west) box
+
+    With fresh, osmnx's response cache is bypassed, so a repeated download sees edits made since.
+    """
+    from shapely.geometry import box
+    from osmnx import _overpass
+    if not fresh:
+        north, south, east, west = bbox
+        return _overpass._download_overpass_network(box(west, south, east, north), 'drive', osm_filter)
+    settings = _overpass._make_overpass_settings()
+    return (overpass_request(f"{settings};(way{osm_filter}(poly:{polygon!r});>;);out;")
+            for polygon in _overpass_polygons(bbox))
+
+def check_overpass_ways(bbox, osm_filter, since=None):
+    """
+    Ask Overpass which ways match osm_filter in a box, and how many of them or their nodes were edited after since
+
+    Only way ids and a count are transferred, not tags or geometry, so
+    checking an area costs a fraction of downloading it. A way removed
+    from the area shows as a missing id; any other edit that can change
+    the ways (tags, node list or a moved node) bumps an element's timestamp.
+
+    Args:
+        since: Overpass timestamp (e.g. '2024-05-01T12:00:00Z') of an earlier check, or None
+
+    Returns:
+        Tuple of (timestamp of the data checked, set of way ids, number of
+        ways and nodes edited after since, or None without since)
+    """
+    from osmnx import _overpass
+    settings = _overpass._make_overpass_settings()
+    timestamp, way_ids, edited = None, set(), 0
+    for polygon in _overpass_polygons(bbox):
+        query = f"{settings};way{osm_filter}(poly:{polygon!r})->.ways;.ways out ids;"
+        if since:
+            query += f'node(w.ways)->.nodes;(way.ways(newer:"{since}");node.nodes(newer:"{since}"););out count;'
+        response = overpass_request(query)
+        timestamp = response['osm3s']['timestamp_osm_base']
+        for element in response.get('elements', []):
+            if element['type'] == 'way':
+                way_ids.add(element['id'])
+            elif element['type'] == 'count':
+                edited += int(element['tags']['total'])
+    return timestamp, way_ids, edited if since else None
+
+class CachingOverpassSource(IndexedSource):
+    """Overpass data source that reuses cached downloads covering the requested area and filter"""
+
+    name = 'overpass-cached'
+
+    def __init__(self, cache=None):
+        self.cache = cache or NetworkCache()
+
+    def graph_from_bbox(self, bbox, custom_filter=None, retain_all=False, truncate_by_edge=False):
+        clauses = parse_overpass_filter(network_filter(custom_filter))
+        area = buffer_bbox(bbox, SIMPLIFY_BUFFER_M)
+        with self.cache.lookup(area, clauses) as found:
+            if found is not None:
+                index, exact = found
+                print(f"   Network cache {'hit' if exact else 'clip'} for {bbox}")
+                ways, nodes = index.query(area, clauses)
+        if found is None:
+            osm_filter = format_overpass_filter(fetch_clauses(clauses))
+            with self.cache.add(area, osm_filter,
+                                _fill_from_overpass(download_overpass_network(area, osm_filter))) as index:
+                ways, nodes = index.query(area, clauses)
+
+        if not ways:
+            import osmnx as ox
+            raise ox._errors.InsufficientResponseError(f"No matching ways for {bbox}")
+        return graph_from_ways(ways, nodes, bbox, retain_all, truncate_by_edge)
+
+    def fetch_ways(self, bbox, custom_filter=None):
+        """Download bbox again, bypassing the cache, and replace the cached copy of that area"""
+        clauses = parse_overpass_filter(network_filter(custom_filter))
+        area = buffer_bbox(bbox, SIMPLIFY_BUFFER_M)
+        osm_filter = format_overpass_filter(fetch_clauses(clauses))
+        with self.cache.add(area, osm_filter,
+                            _fill_from_overpass(download_overpass_network(area, osm_filter, fresh=True)),
+                            replace=True) as index:
+            return index.query(area, clauses)
+
+    def check_ways(self, bbox, custom_filter=None, since=None):
+        """Check the ways fetch_ways would return without downloading them (see check_overpass_ways)"""
+        return check_overpass_ways(buffer_bbox(bbox, SIMPLIFY_BUFFER_M), network_filter(custom_filter), since)
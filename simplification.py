@@ -0,0 +1,206 @@
+# Optional reduction of projected road geometries before they are written
+# Douglas-Peucker simplification with a tolerance in meters (applied in the UTM
+# projection), merging of degree-2 chains into single linestrings, and the number
+# of decimals coordinates are written with. The defaults leave the output unchanged.
+
+from collections import defaultdict, namedtuple
+
+import numpy as np
+import shapely
+
+GeometryOptions = namedtuple('GeometryOptions', ['tolerance_m', 'precision', 'merge_chains'],
+                             defaults=(0.0, 2, False))
+DEFAULT_GEOMETRY = GeometryOptions()
+MAX_TOLERANCE_M = 1000
+MAX_PRECISION = 6
+
+def parse_geometry_options(tolerance_m=None, precision=None, merge_chains=None):
+    """
+    Validate geometry options given as form, manifest or command line values
+
+    Args:
+        tolerance_m: Simplification tolerance in meters (empty or 0 disables it)
+        precision: Decimals per coordinate, 0 to MAX_PRECISION (default 2)
+        merge_chains: Merge degree-2 chains; accepts booleans and strings like 'on' or 'true'
+
+    Returns:
+        GeometryOptions
+
+    Raises:
+        ValueError: If a value is invalid
+    """
+    try:
+        tolerance_m = float(tolerance_m) if tolerance_m not in (None, '') else DEFAULT_GEOMETRY.tolerance_m
+    except (TypeError, ValueError):
+        raise ValueError('Invalid simplification tolerance')
+    if not 0 <= tolerance_m <= MAX_TOLERANCE_M:
+        raise ValueError(f'Simplification tolerance must be between 0 and {MAX_TOLERANCE_M} meters')
+    try:
+        precision = int(precision) if precision not in (None, '') else DEFAULT_GEOMETRY.precision
+    except (TypeError, ValueError):
+        raise ValueError('Invalid coordinate precision')
+    if not 0 <= precision <= MAX_PRECISION:
+        raise ValueError(f'Coordinate precision must be between 0 and {MAX_PRECISION} decimals')
+    if isinstance(merge_chains, str):
+        merge_chains = merge_chains.strip().lower() in ('1', 'true', 'yes', 'on')
+    return GeometryOptions(tolerance_m, precision, bool(merge_chains))
+
+def vertex_counts(geometries):
+    """Return the number of vertices of each geometry"""
+    return shapely.get_num_coordinates(np.asarray(geometries, dtype=object))
+
+def simplify_lines(geometries, tolerance_m):
+    """
+    Douglas-Peucker simplify every line at once
+
+    Endpoints are kept, so simplified edges still meet at their junctions.
+    Closed lines that would collapse to two points are simplified with
+    topology preservation instead, which keeps them rings.
+
+    Returns:
+        Array of simplified geometries
+    """
+    geoms = np.asarray(geometries, dtype=object)
+    simplified = shapely.simplify(geoms, tolerance_m, preserve_topology=False)
+    collapsed = shapely.is_closed(geoms) & (shapely.get_num_coordinates(simplified) < 4)
+    if collapsed.any():
+        simplified[collapsed] = shapely.simplify(geoms[collapsed], tolerance_m, preserve_topology=True)
+    return simplified
+
+def _merge_key(highway_type):
+    return tuple(highway_type) if isinstance(highway_type, list) else highway_type
+
+def chain_order(u, v, groups):
+    """
+    Group edges into chains joined at degree-2 nodes
+
+    A node continues a chain when the road just passes through it: one edge
+    in and one out (a one-way road), or one edge in and out towards each of
+    two neighbours (a two-way road), with no loops, parallel edges or change
+    of group (highway type) among them. Chains follow edge direction, so the
+    two directions of a two-way road become two chains.
+
+    Args:
+        u, v: Start and end node of each edge
+        groups: Hashable group of each edge; only edges of one group are merged
+
+    Returns:
+        List of chains, each a list of edge positions in travel order; every
+        edge is in exactly one chain
+    """
+    incoming = defaultdict(list)
+    outgoing = defaultdict(list)
+    for i, (a, b) in enumerate(zip(u, v)):
+        outgoing[a].append(i)
+        incoming[b].append(i)
+
+    following = {}
+    for node, ins in incoming.items():
+        outs = outgoing.get(node, [])
+        if len(ins) != len(outs) or len(ins) not in (1, 2):
+            continue
+        sources = [u[i] for i in ins]
+        targets = [v[i] for i in outs]
+        if node in sources or node in targets or len(set(sources) | set(targets)) != 2:
+            continue
+        if len(set(sources)) != len(ins) or len(set(targets)) != len(outs):
+            continue
+        if len({groups[i] for i in ins + outs}) != 1:
+            continue
+        for i in ins:
+            following[i] = next(j for j in outs if v[j] != u[i])
+
+    preceded = set(following.values())
+    chains = []
+    visited = np.zeros(len(u), dtype=bool)
+    # Chains starting at a junction or dead end first, then closed rings of pass-through nodes
+    for starts in ([i for i in range(len(u)) if i not in preceded], range(len(u))):
+        for i in starts:
+            if visited[i]:
+                continue
+            chain = []
+            while i is not None and not visited[i]:
+                visited[i] = True
+                chain.append(i)
+                i = following.get(i)
+            chains.append(chain)
+    return chains
+
+def merge_chains(edges):
+    """
+    Merge the edges of every degree-2 chain into one linestring
+
+    Edge geometries run from u to v, so a chain's coordinates are its edges'
+    coordinates in order, without the repeated vertex at each joint. The
+    merged row keeps the first edge's attributes and is indexed by the
+    chain's first node, last node and first key.
+
+    Args:
+        edges: Projected edges GeoDataFrame indexed by (u, v, key)
+
+    Returns:
+        Tuple of (merged edges, vertices of the original edges in each merged row)
+    """
+    counts = vertex_counts(edges.geometry)
+    if len(edges) == 0:
+        return edges, counts
+    u = edges.index.get_level_values(0).tolist()
+    v = edges.index.get_level_values(1).tolist()
+    if 'highway' in edges.columns:
+        groups = [_merge_key(value) for value in edges['highway'].tolist()]
+    else:
+        groups = [None] * len(edges)
+    chains = chain_order(u, v, groups)
+    if len(chains) == len(edges):
+        return edges, counts
+
+    order = np.fromiter((i for chain in chains for i in chain), dtype=np.int64, count=len(edges))
+    chain_ids = np.repeat(np.arange(len(chains)), [len(chain) for chain in chains])
+    chain_start = np.ones(len(order), dtype=bool)
+    chain_start[1:] = chain_ids[1:] != chain_ids[:-1]
+
+    geoms = np.asarray(edges.geometry, dtype=object)[order]
+    coords, index = shapely.get_coordinates(geoms, return_index=True)
+    first_vertex = np.ones(len(index), dtype=bool)
+    first_vertex[1:] = index[1:] != index[:-1]
+    keep = ~(first_vertex & ~chain_start[index])
+    lines = shapely.linestrings(coords[keep], indices=chain_ids[index[keep]])
+
+    firsts = [chain[0] for chain in chains]
+    merged = edges.iloc[firsts].copy()
+    keys = merged.index.get_level_values(2).tolist()
+    merged.index = merged.index.from_arrays([[u[chain[0]] for chain in chains], [v[chain[-1]] for chain in chains],
+                                             keys], names=edges.index.names)
+    merged = merged.set_geometry(lines, crs=edges.crs)
+    return merged, np.bincount(chain_ids, weights=counts[order]).astype(np.int64)
+
+def apply_geometry_options(edges, options):
+    """
+    Merge chains and simplify projected edges as the options ask
+
+    Args:
+        edges: Projected edges GeoDataFrame indexed by (u, v, key)
+        options: GeometryOptions, or None for the defaults
+
+    Returns:
+        Tuple of (edges, vertices of the original edges in each returned row)
+    """
+    options = options or DEFAULT_GEOMETRY
+    if options.merge_chains:
+        edges, before = merge_chains(edges)
+    else:
+        before = vertex_counts(edges.geometry)
+    if options.tolerance_m > 0 and len(edges):
+        edges = edges.set_geometry(simplify_lines(edges.geometry, options.tolerance_m), crs=edges.crs)
+    return edges, before
+
+def describe_geometry_options(options):
+    """Return header lines describing non-default options, without the leading '# '"""
+    lines = []
+    if options.tolerance_m > 0:
+        lines.append(f"Simplification: Douglas-Peucker, tolerance {options.tolerance_m:g}m")
+    if options.merge_chains:
+        lines.append("Degree-2 chains merged into single linestrings")
+    if options.precision != DEFAULT_GEOMETRY.precision:
+        lines.append(f"Coordinate precision: {options.precision} decimals")
+    return lines
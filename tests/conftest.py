@@ -0,0 +1,34 @@
+# Shared test setup: the app modules and the offline fixtures of the benchmarks
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+# Center of the grid fixtures (see fixtures.write_grid_osm_xml)
+GRID_CENTER = (23.8103, 90.4125)
+
+@pytest.fixture
+def overpass(tmp_path, monkeypatch):
+    """Answer Overpass downloads and geocoding of this test from a 60 x 60 street grid; returns the FixtureOverpass"""
+    from bench_pipeline import FixtureOverpass, StubGeocoder
+    from fixtures import write_grid_osm_xml
+    from osmnx import _overpass
+
+    import data_sources
+    import geocoding
+    import network_cache
+
+    overpass = FixtureOverpass(write_grid_osm_xml(str(tmp_path / 'grid.osm'), 60, way_length=5))
+    lats = [lat for lat, _ in overpass.nodes.values()]
+    lons = [lon for _, lon in overpass.nodes.values()]
+    monkeypatch.setattr(_overpass, '_download_overpass_network', overpass.download)
+    monkeypatch.setattr(network_cache, 'overpass_request', overpass.request)
+    monkeypatch.setattr(data_sources, '_source', data_sources.OverpassSource())
+    monkeypatch.setattr(geocoding, '_service', geocoding.GeocodingService(
+        StubGeocoder(*GRID_CENTER, (min(lons), min(lats), max(lons), max(lats))), db_path=None))
+    return overpass
@@ -0,0 +1,102 @@
+# Geocoding cache behaviour, with a stub geocoder
+
+import pytest
+from bench_pipeline import StubLocation
+
+import geocoding
+from geocoding import GeocodingService
+
+class RecordingGeocoder:
+    """geopy-style geocoder knowing a few places, recording every query it is asked"""
+
+    def __init__(self, places):
+        self.places = places
+        self.calls = []
+
+    def geocode(self, query, **kwargs):
+        self.calls.append(query)
+        if query not in self.places:
+            return None
+        lat, lon = self.places[query]
+        return StubLocation(lat, lon, {'boundingbox': [lat - 0.1, lat + 0.1, lon - 0.1, lon + 0.1]})
+
+PLACES = {
+    'Dhaka, Bangladesh': (23.81, 90.41),
+    'Sylhet, Bangladesh': (24.89, 91.87),
+    'London, England, UK': (51.5, -0.12),
+}
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(geocoding.time, 'time', clock)
+    return clock
+
+def test_lookup_is_served_from_memory():
+    geocoder = RecordingGeocoder(PLACES)
+    service = GeocodingService(geocoder, db_path=None, max_entries=2)
+
+    first = service.lookup('Dhaka, Bangladesh')
+    assert service.lookup('dhaka,bangladesh') == first
+    assert geocoder.calls == ['Dhaka, Bangladesh']
+    assert first.bbox == pytest.approx((90.31, 23.71, 90.51, 23.91))
+
+    # The least recently used entry is dropped once max_entries is exceeded
+    service.lookup('Sylhet, Bangladesh')
+    service.lookup('London, England, UK')
+    service.lookup('Dhaka, Bangladesh')
+    assert geocoder.calls == ['Dhaka, Bangladesh', 'Sylhet, Bangladesh', 'London, England, UK', 'Dhaka, Bangladesh']
+
+def test_lookup_is_served_from_sqlite_after_restart(tmp_path):
+    db_path = str(tmp_path / 'geocode.sqlite')
+    first = GeocodingService(RecordingGeocoder(PLACES), db_path=db_path).lookup('Dhaka, Bangladesh')
+
+    geocoder = RecordingGeocoder(PLACES)
+    restarted = GeocodingService(geocoder, db_path=db_path)
+    assert restarted.lookup('Dhaka, Bangladesh') == first
+    assert geocoder.calls == []
+
+@pytest.mark.parametrize('persistent', [False, True])
+def test_misses_are_remembered_until_negative_ttl(tmp_path, clock, persistent):
+    geocoder = RecordingGeocoder(PLACES)
+    service = GeocodingService(geocoder, db_path=str(tmp_path / 'geocode.sqlite') if persistent else None,
+                               negative_ttl=60)
+
+    assert service.lookup('Atlantis') is None
+    clock.now += 59
+    assert service.lookup('Atlantis') is None
+    assert geocoder.calls == ['Atlantis']
+
+    clock.now += 2
+    assert service.lookup('Atlantis') is None
+    assert geocoder.calls == ['Atlantis', 'Atlantis']
+
+def test_resolve_tries_each_fallback_once():
+    geocoder = RecordingGeocoder(PLACES)
+    service = GeocodingService(geocoder, db_path=None)
+
+    for _ in range(3):
+        assert service.resolve('Dhaka').query == 'Dhaka, Bangladesh'
+        assert service.resolve('London').query == 'London, England, UK'
+    assert geocoder.calls == ['Dhaka', 'Dhaka, Bangladesh', 'London', 'London, England, UK']
+
+def test_test_city_is_served_from_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import app
+
+    geocoder = RecordingGeocoder(PLACES)
+    monkeypatch.setattr(geocoding, '_service', GeocodingService(geocoder, db_path=None))
+    client = app.app.test_client()
+
+    for _ in range(2):
+        response = client.post('/test_city', json={'city_name': 'Dhaka'})
+        assert response.get_json()['available']
+        assert 'Dhaka, Bangladesh' in response.get_json()['message']
+    assert geocoder.calls == ['Dhaka', 'Dhaka, Bangladesh']
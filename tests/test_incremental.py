@@ -0,0 +1,56 @@
+# Incremental refreshes on the offline Overpass stand-in
+
+from conftest import GRID_CENTER
+from fixtures import write_edited_snapshot, write_grid_osm_xml
+
+import incremental
+import map_generator
+
+def segments(path):
+    with open(path) as f:
+        return sorted(line for line in f if line.startswith('LINESTRING'))
+
+def generate(tmp_path, name, index_name):
+    """Generate the complete network around the grid center incrementally; returns (counts, WKT text)"""
+    custom_filter, road_desc = map_generator.get_road_filter('complete')
+    wkt_file = str(tmp_path / f'{name}.wkt')
+    counts = incremental.generate_incremental_wkt('Grid', GRID_CENTER, 2000, custom_filter, road_desc, wkt_file,
+                                                  index_dir=str(tmp_path / index_name), tile_size=1000)
+    with open(wkt_file) as f:
+        return counts, f.read()
+
+def test_refresh_downloads_only_changed_tiles(overpass, tmp_path):
+    first = generate(tmp_path, 'first', 'index')
+    assert overpass.requests == 16
+
+    # Nothing changed: every tile is checked, none is downloaded again
+    assert generate(tmp_path, 'unchanged', 'index') == first
+    assert overpass.requests == 16
+    assert overpass.checks == 32
+
+    lat, lon = GRID_CENTER
+    moved = write_edited_snapshot(str(tmp_path / 'grid.osm'), str(tmp_path / 'edited.osm'),
+                                  (lat + 0.0015, lat - 0.0015, lon + 0.0015, lon - 0.0015))
+    assert moved
+    overpass.load(str(tmp_path / 'edited.osm'))
+
+    refreshed = generate(tmp_path, 'refreshed', 'index')
+    downloaded = overpass.requests - 16
+    assert 0 < downloaded < 16
+    assert refreshed != first
+    assert refreshed == generate(tmp_path, 'fresh', 'fresh_index')
+
+def test_output_matches_single_download_with_long_ways(overpass, tmp_path):
+    # Ways running across several tiles are split and simplified differently per tile unless
+    # every edge is taken whole from the tile it starts in
+    overpass.load(write_grid_osm_xml(str(tmp_path / 'long.osm'), 60, way_length=40))
+    custom_filter, road_desc = map_generator.get_road_filter('major')
+    single = str(tmp_path / 'single.wkt')
+    tiled = str(tmp_path / 'incremental.wkt')
+
+    single_counts = map_generator._generate_graph_wkt('Grid', GRID_CENTER, 2000, custom_filter, road_desc, single)
+    counts = incremental.generate_incremental_wkt('Grid', GRID_CENTER, 2000, custom_filter, road_desc, tiled,
+                                                  index_dir=str(tmp_path / 'index'), tile_size=1000)
+
+    assert counts == single_counts
+    assert segments(tiled) == segments(single)
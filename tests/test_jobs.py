@@ -0,0 +1,61 @@
+# Jobs sharing one generation task through /generate and /cancel
+
+import re
+import threading
+import time
+from collections import Counter
+
+from bench_pipeline import StubGeocoder
+from conftest import GRID_CENTER
+
+import geocoding
+from geocoding import GeocodingService
+from wkt_cache import WKTCache
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def test_job_attached_after_owner_cancelled_completes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import app
+
+    started, release = threading.Event(), threading.Event()
+
+    def fake_generate(city_name, output_name, detail_level, map_size, save_path, **kwargs):
+        started.set()
+        assert release.wait(10)
+        path = str(tmp_path / save_path / f"{output_name}.wkt")
+        with open(path, 'w') as f:
+            f.write("LINESTRING (0 0, 1 1)\n")
+        return True, Counter(primary=1), path
+
+    monkeypatch.setattr(app, 'create_detailed_city_wkt', fake_generate)
+    monkeypatch.setattr(app, 'wkt_cache', WKTCache(str(tmp_path / 'wkt_cache')))
+    monkeypatch.setattr(geocoding, '_service', GeocodingService(StubGeocoder(*GRID_CENTER, (0, 0, 1, 1)), db_path=None))
+    client = app.app.test_client()
+
+    def submit(output_name):
+        response = client.post('/generate', data={'location': 'Grid', 'detail_level': 'major', 'map_size': '2000',
+                                                  'output_name': output_name})
+        return re.search(rf"{output_name}_\d{{8}}_\d{{6}}_[0-9a-f]{{6}}", response.get_data(as_text=True)).group(0)
+
+    def status(job_id):
+        return app.job_store.get(job_id)['status']
+
+    owner = submit('owner')
+    assert started.wait(10)
+    attached = submit('attached')
+    assert client.post(f'/cancel/{owner}').get_json()['cancelled']
+    # The task keeps running for the attached job; a job arriving now joins it
+    late = submit('late')
+    assert status(late) != 'cancelled'
+    assert app.job_store.get(late)['attached_to'] == owner
+
+    release.set()
+    wait_for(lambda: status(late) in app.TERMINAL_STATES)
+    assert status(late) == 'completed'
+    assert status(attached) == 'completed'
+    assert status(owner) == 'cancelled'
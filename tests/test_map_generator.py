@@ -0,0 +1,66 @@
+# End-to-end generation on the offline grid fixture
+
+import os
+import threading
+
+from conftest import GRID_CENTER
+
+import map_generator
+import tiled_generator
+
+def test_cancelled_generation_writes_nothing(overpass, tmp_path):
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    result = map_generator.create_detailed_city_wkt('Grid', 'grid', 'major', 2500, save_path=str(tmp_path / 'out'),
+                                                    cancel_event=cancel_event)
+
+    assert result == (False, {}, None)
+    assert overpass.requests == 0
+    assert not os.path.exists(tmp_path / 'out')
+
+def test_cancel_stops_tiled_generation_at_next_tile(overpass, tmp_path, monkeypatch):
+    monkeypatch.setattr(map_generator, 'TILED_MIN_RADIUS_M', 1000)
+    monkeypatch.setattr(tiled_generator, 'TILE_SIZE_M', 700)
+    monkeypatch.setattr(tiled_generator, 'TILE_WORKERS', 1)
+    cancel_event = threading.Event()
+
+    def progress(message, stage=None, **fields):
+        if fields.get('tiles_done') == 2:
+            cancel_event.set()
+
+    result = map_generator.create_detailed_city_wkt('Grid', 'grid', 'major', 2500, save_path=str(tmp_path / 'out'),
+                                                    progress_callback=progress, cancel_event=cancel_event)
+
+    assert result == (False, {}, None)
+    assert overpass.requests < 64
+    assert os.listdir(tmp_path / 'out') == []
+
+def test_radius_job_builds_one_graph(overpass, tmp_path, monkeypatch):
+    import osmnx as ox
+    from fixtures import write_grid_osm_xml
+
+    graph = ox.graph_from_xml(write_grid_osm_xml(str(tmp_path / 'small.osm'), 20))
+    builds = []
+
+    def graph_from_point(center_point, dist=1000, **kwargs):
+        builds.append(('point', center_point, dist))
+        return graph.copy()
+
+    def graph_from_place(query, **kwargs):
+        builds.append(('place', query))
+        return graph.copy()
+
+    monkeypatch.setattr(ox, 'graph_from_point', graph_from_point)
+    monkeypatch.setattr(ox, 'graph_from_place', graph_from_place)
+    monkeypatch.setattr(ox, 'graph_from_bbox', lambda *args, **kwargs: builds.append(('bbox',)) or graph.copy())
+
+    success, counts, wkt_file = map_generator.create_detailed_city_wkt('Grid', 'grid', 'complete', 1000,
+                                                                       save_path=str(tmp_path / 'out'))
+
+    assert success
+    assert builds == [('point', GRID_CENTER, 1000)]
+    assert sum(counts.values()) == len(graph.edges)
+    assert overpass.requests == 0
+    with open(wkt_file) as f:
+        assert sum(line.startswith('LINESTRING') for line in f) == len(graph.edges)
@@ -0,0 +1,43 @@
+# Per-job stage collection and profiling
+
+import os
+import threading
+
+import metrics
+from metrics import current_profile, job_metrics, stage
+
+def test_concurrent_profiled_jobs_both_run(tmp_path):
+    first_started = threading.Event()
+    second_done = threading.Event()
+    profiles = {}
+
+    def first():
+        with job_metrics(str(tmp_path), 'first') as profile:
+            first_started.set()
+            # Keep profiling until the second job has run to the end
+            second_done.wait(5)
+            with stage('work'):
+                pass
+        profiles['first'] = profile
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    assert first_started.wait(5)
+    with job_metrics(str(tmp_path), 'second') as profile:
+        with stage('work'):
+            pass
+        assert current_profile() is profile
+    profiles['second'] = profile
+    second_done.set()
+    thread.join(5)
+
+    assert current_profile() is None
+    assert [record['stage'] for record in profiles['second'].stages] == ['work']
+    assert profiles['second'].profile_path is None
+    assert [record['stage'] for record in profiles['first'].stages] == ['work']
+    assert os.path.exists(profiles['first'].profile_path)
+    # The profiler is free again for the next job
+    assert not metrics._profiler_lock.locked()
+    with job_metrics(str(tmp_path), 'third') as profile:
+        pass
+    assert os.path.exists(profile.profile_path)
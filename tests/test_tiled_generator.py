@@ -0,0 +1,47 @@
+# Tiled generation against a single download of the same box, answered offline
+
+from concurrent.futures import Future
+
+import pytest
+from conftest import GRID_CENTER
+
+import map_generator
+import tiled_generator
+
+def segments(path):
+    with open(path) as f:
+        return sorted(line for line in f if line.startswith('LINESTRING'))
+
+@pytest.mark.parametrize('detail_level', ['major', 'complete'])
+def test_tiled_output_matches_single_download(overpass, tmp_path, detail_level):
+    custom_filter, road_desc = map_generator.get_road_filter(detail_level)
+    single = str(tmp_path / 'single.wkt')
+    tiled = str(tmp_path / 'tiled.wkt')
+
+    single_counts = map_generator._generate_graph_wkt('Grid', GRID_CENTER, 2500, custom_filter, road_desc, single)
+    tiled_counts = tiled_generator.generate_tiled_wkt('Grid', GRID_CENTER, 2500, custom_filter, road_desc, tiled,
+                                                      tile_size=700)
+
+    assert overpass.requests > 64
+    assert tiled_counts == single_counts
+    assert segments(tiled) == segments(single)
+
+class ImmediateExecutor:
+    """Executor running every call as it is submitted, counting the submissions"""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+def test_map_in_order_bounds_submitted_calls():
+    executor = ImmediateExecutor()
+    collected = []
+    for result in tiled_generator.map_in_order(executor, lambda x: x * 2, ((i,) for i in range(10)), 3):
+        collected.append(result)
+        assert executor.submitted - len(collected) <= 3
+    assert collected == [i * 2 for i in range(10)]
@@ -0,0 +1,340 @@
+# Tiled generation for large map radii
+# Splits the download box into a grid, fetches and projects tiles concurrently,
+# takes every edge from the tile it starts in and spools them, then writes the
+# largest connected component to WKT.
+
+import math
+import os
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+import osmnx as ox
+import shapely
+
+from data_sources import SIMPLIFY_BUFFER_M, buffer_bbox, get_data_source
+from map_generator import (WKT_WRITE_CHUNK, check_cancelled, close_binary_writers, format_linestrings_wkt,
+                           get_utm_zone, highway_labels, open_binary_writers, reduce_edges, temp_path_for, utm_crs,
+                           write_wkt_header)
+from metrics import stage
+from simplification import DEFAULT_GEOMETRY, vertex_counts
+
+# Side length of one tile in meters
+TILE_SIZE_M = int(os.environ.get('MAPGEN_TILE_SIZE_M', 10000))
+# Number of tiles downloaded and projected at the same time
+TILE_WORKERS = int(os.environ.get('MAPGEN_TILE_WORKERS', 4))
+
+def split_bbox(north, south, east, west, rows, cols):
+    """Split a bounding box into rows x cols (north, south, east, west) tiles, row by row from the north"""
+    lat_step = (north - south) / rows
+    lon_step = (east - west) / cols
+    tiles = []
+    for r in range(rows):
+        for c in range(cols):
+            tiles.append((north - r * lat_step, north - (r + 1) * lat_step,
+                          west + (c + 1) * lon_step, west + c * lon_step))
+    return tiles
+
+def tile_grid(bbox, dist, tile_size=None):
+    """Return the tiles covering a (north, south, east, west) box of half-width dist meters"""
+    tile_size = tile_size or TILE_SIZE_M
+    n = max(1, math.ceil(2 * dist / tile_size))
+    return split_bbox(*bbox, n, n)
+
+def map_in_order(executor, fn, calls, max_in_flight):
+    """
+    Run fn(*args) on executor for every args in calls and yield the results in order
+
+    At most max_in_flight calls are submitted at a time, so tiles finished
+    ahead of a slow one do not pile up in memory. The next call is submitted
+    before a result is handed out, keeping the workers busy meanwhile. Calls
+    not started yet are cancelled if the caller stops early.
+    """
+    calls = iter(calls)
+    pending = deque(executor.submit(fn, *args) for _, args in zip(range(max(1, max_in_flight)), calls))
+    try:
+        while pending:
+            future = pending.popleft()
+            args = next(calls, None)
+            if args is not None:
+                pending.append(executor.submit(fn, *args))
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def download_graph_from_bbox(bbox, custom_filter=None):
+    """
+    Download the road network of one tile
+
+    Edges crossing the box border are kept (truncate_by_edge), so an edge
+    starting in the tile is returned even when it ends outside the box.
+    """
+    try:
+        return get_data_source().graph_from_bbox(bbox, custom_filter, retain_all=True, truncate_by_edge=True)
+    except (ox._errors.InsufficientResponseError, ValueError) as e:
+        # Tiles over water or empty land have no roads
+        print(f"   Empty tile {bbox}: {e}")
+        return None
+
+def starts_in_tile(nodes, edges, tile, outer_bbox):
+    """
+    Return a mask of the edges whose first node lies in tile
+
+    Tiles share their borders; a node on a seam belongs to the tile south
+    and east of it, so every edge inside the outer box starts in exactly one tile.
+    """
+    north, south, east, west = tile
+    start = nodes.loc[edges.index.get_level_values(0), ['y', 'x']].to_numpy()
+    y, x = start[:, 0], start[:, 1]
+    in_lat = (y <= north) & ((y > south) | ((y == south) & (south == outer_bbox[1])))
+    in_lon = (x >= west) & ((x < east) | ((x == east) & (east == outer_bbox[2])))
+    return in_lat & in_lon
+
+def grow_to_whole_edges(bbox, edges, outer_bbox):
+    """
+    Return bbox grown to cover the edges that may have been cut short when simplifying on it
+
+    Edges within half of SIMPLIFY_BUFFER_M of the box are whole; the box is
+    grown to cover any edge going further, up to the outer box. Returns
+    bbox itself when every edge is whole.
+    """
+    whole = buffer_bbox(bbox, SIMPLIFY_BUFFER_M / 2)
+    west, south, east, north = shapely.bounds(np.asarray(edges.geometry, dtype=object)).T
+    cut = (north > whole[0]) | (south < whole[1]) | (east > whole[2]) | (west < whole[3])
+    if not cut.any():
+        return bbox
+    return (min(max(bbox[0], north[cut].max()), outer_bbox[0]),
+            max(min(bbox[1], south[cut].min()), outer_bbox[1]),
+            min(max(bbox[2], east[cut].max()), outer_bbox[2]),
+            max(min(bbox[3], west[cut].min()), outer_bbox[3]))
+
+def download_tile_edges(tile, outer_bbox, custom_filter=None):
+    """
+    Download the edges starting in one tile, simplified like a single download of the outer box
+
+    osmnx simplifies a download on the requested box plus SIMPLIFY_BUFFER_M,
+    so an edge running further than that past the box is cut short, at a
+    node that is not a real junction. Edges within half the buffer of the
+    box are whole. While some edge starting in the tile goes further, the
+    box is grown to cover those edges and the tile is downloaded again, up
+    to the outer box (whose buffer is the area a single download simplifies on).
+
+    Returns:
+        Tuple of (nodes, edges) GeoDataFrames in lat/lon, or None if no edge starts in the tile
+    """
+    bbox = tile
+    while True:
+        with stage('download'):
+            G = download_graph_from_bbox(bbox, custom_filter)
+        if G is None or len(G.edges) == 0:
+            return None
+        with stage('graph_to_gdfs'):
+            nodes, edges = ox.graph_to_gdfs(G)
+        del G
+        edges = edges[starts_in_tile(nodes, edges, tile, outer_bbox)]
+        grown = grow_to_whole_edges(bbox, edges, outer_bbox)
+        if grown == bbox:
+            break
+        bbox = grown
+    if len(edges) == 0:
+        return None
+    return nodes, edges
+
+def _fetch_tile(tile, outer_bbox, custom_filter, utm_epsg):
+    """
+    Download one tile and return the edges starting in it projected to utm_epsg, or None if it has none
+
+    Its stages count towards /metrics only: the worker thread is not running the job.
+    """
+    tile_edges = download_tile_edges(tile, outer_bbox, custom_filter)
+    if tile_edges is None:
+        return None
+    return project_edges(*tile_edges, outer_bbox, utm_epsg)
+
+def project_edges(nodes, edges, outer_bbox, utm_epsg):
+    """
+    Return edges projected to utm_epsg, or None if none are left
+
+    Edges leaving the outer box are dropped, matching a single download of
+    the whole box, which only keeps nodes inside it.
+    """
+    north, south, east, west = outer_bbox
+    inside = nodes.index[(nodes['y'] <= north) & (nodes['y'] >= south) & (nodes['x'] <= east) & (nodes['x'] >= west)]
+    edges = edges[edges.index.get_level_values(0).isin(inside) & edges.index.get_level_values(1).isin(inside)]
+    if len(edges) == 0:
+        return None
+    with stage('to_crs'):
+        return edges.to_crs(utm_crs(utm_epsg))
+
+class SegmentSpool:
+    """
+    Formatted road segments held in a temporary file until every tile is in
+
+    A single download keeps only the largest connected component of the
+    network (osmnx's retain_all=False). Tiles are fetched with all their
+    components, so that roads crossing a seam still connect; the spool
+    tracks connectivity with a union-find over the segments' end nodes and
+    writes only the segments of the largest component.
+
+    Args:
+        path: Temporary file for the formatted segments
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._body = open(path, 'w')
+        self._parent = {}
+        self._nodes = {}
+        self._starts = array('q')
+        self._codes = array('I')
+        self._labels = {}
+        self._before = array('q')
+        self._after = array('q')
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _find(self, node):
+        parent = self._parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def add(self, keys, labels, lines, vertices=None):
+        """
+        Spool segments
+
+        Args:
+            keys: (u, v, key) of each segment
+            labels: Highway label of each segment
+            lines: WKT line of each segment
+            vertices: Optional (before, after) vertex counts of each segment
+        """
+        parent, nodes = self._parent, self._nodes
+        for (u, v, _), label in zip(keys, labels):
+            for node in (u, v):
+                if node not in parent:
+                    parent[node] = node
+                    nodes[node] = 1
+            root_u, root_v = self._find(u), self._find(v)
+            if root_u != root_v:
+                if nodes[root_u] < nodes[root_v]:
+                    root_u, root_v = root_v, root_u
+                parent[root_v] = root_u
+                nodes[root_u] += nodes.pop(root_v)
+            self._starts.append(u)
+            self._codes.append(self._labels.setdefault(label, len(self._labels)))
+        if lines:
+            self._body.write("\n".join(lines))
+            self._body.write("\n")
+        if vertices is not None:
+            self._before.extend(int(count) for count in vertices[0])
+            self._after.extend(int(count) for count in vertices[1])
+
+    def largest_component(self):
+        """Return a mask of the spooled segments in the connected component with the most nodes"""
+        root = max(self._nodes, key=self._nodes.get)
+        return np.fromiter((self._find(u) == root for u in self._starts), dtype=bool, count=len(self._starts))
+
+    def write(self, wkt_file, city_name, road_desc, utm_epsg, custom_size=None, writers=(), geometry=None):
+        """
+        Write the segments of the largest component as a WKT file, and to the binary writers
+
+        Returns:
+            Counter of road segments per highway type, or None if nothing was spooled
+        """
+        self._body.close()
+        if not len(self):
+            return None
+        geometry = geometry or DEFAULT_GEOMETRY
+        keep = self.largest_component()
+        names = sorted(self._labels, key=self._labels.get)
+        codes = np.frombuffer(self._codes, dtype=np.uint32)
+        highway_counts = Counter()
+        for code, count in enumerate(np.bincount(codes[keep], minlength=len(names)).tolist()):
+            if count:
+                highway_counts[names[code]] = count
+        vertices = None
+        if len(self._before):
+            vertices = (int(np.frombuffer(self._before, dtype=np.int64)[keep].sum()),
+                        int(np.frombuffer(self._after, dtype=np.int64)[keep].sum()))
+
+        tmp_file = temp_path_for(wkt_file)
+        try:
+            with open(tmp_file, 'w') as f, open(self.path) as body:
+                write_wkt_header(f, city_name, road_desc, utm_epsg, highway_counts, custom_size, geometry, vertices)
+                for start in range(0, len(keep), WKT_WRITE_CHUNK):
+                    lines = [line for line, selected in zip(islice(body, WKT_WRITE_CHUNK), keep[start:])
+                             if selected]
+                    f.writelines(lines)
+                    if writers and lines:
+                        chunk = slice(start, start + WKT_WRITE_CHUNK)
+                        labels = [names[code] for code in codes[chunk][keep[chunk]].tolist()]
+                        geometries = shapely.from_wkt(lines)
+                        for writer in writers:
+                            writer.append(geometries, labels)
+            close_binary_writers(writers, city_name, road_desc, utm_epsg, highway_counts, custom_size, geometry,
+                                 vertices)
+            os.replace(tmp_file, wkt_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        return highway_counts
+
+    def close(self):
+        """Delete the temporary file"""
+        self._body.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def generate_tiled_wkt(city_name, point, custom_size, custom_filter, road_desc, wkt_file,
+                       tile_size=None, max_workers=None, progress_callback=None, binary_formats=(), geometry=None,
+                       cancel_event=None):
+    """
+    Generate a WKT file for a large radius by downloading it tile by tile
+
+    Tiles are merged in grid order as they arrive. Every edge is taken from
+    the one tile it starts in (see download_tile_edges), and only the
+    connectivity of the nodes written so far is kept in memory, so the full
+    network is never held as one graph. Like a single download, only the
+    largest connected component is written (see SegmentSpool). Geometry
+    options are applied tile by tile, so merged chains stop at tile borders.
+    A set cancel_event stops the merge at the next tile (see check_cancelled).
+
+    Returns:
+        Counter of road segments per highway type, or None if no tile had roads
+    """
+    outer_bbox = ox.utils_geo.bbox_from_point(point, custom_size)
+    tiles = tile_grid(outer_bbox, custom_size, tile_size)
+    utm_epsg = get_utm_zone(*point)
+    print(f"   Downloading {len(tiles)} tiles, using coordinate system: {utm_epsg}")
+
+    geometry = geometry or DEFAULT_GEOMETRY
+    spool = SegmentSpool(temp_path_for(wkt_file, 'body'))
+    writers = open_binary_writers(wkt_file, binary_formats, geometry.precision)
+    try:
+        max_workers = max_workers or TILE_WORKERS
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            calls = ((bbox, outer_bbox, custom_filter, utm_epsg) for bbox in tiles)
+            for i, edges in enumerate(map_in_order(executor, _fetch_tile, calls, max_workers)):
+                check_cancelled(cancel_event)
+                if edges is not None:
+                    edges, before = reduce_edges(edges, geometry)
+                    vertices = None if before is None else (before, vertex_counts(edges.geometry))
+                    spool.add(edges.index.tolist(), highway_labels(edges),
+                              format_linestrings_wkt(edges.geometry, geometry.precision), vertices)
+                if progress_callback:
+                    progress_callback(f'Downloaded tile {i + 1} of {len(tiles)} ({len(spool)} road segments so far)',
+                                      stage='downloading', tiles_done=i + 1, tiles_total=len(tiles),
+                                      edges=len(spool))
+
+        with stage('serialize'):
+            return spool.write(wkt_file, city_name, road_desc, utm_epsg, custom_size, writers, geometry)
+    finally:
+        for writer in writers:
+            writer.discard()
+        spool.close()
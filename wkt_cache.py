@@ -0,0 +1,179 @@
+# Persistent cache of generated WKT files
+# Entries are keyed on the normalized request (location, road filter, map size and any
+# geometry options) and evicted least-recently-used once the cache grows past its size
+# or age limit.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from binary_formats import BINARY_FORMATS, binary_path_for
+from compression import variant_files, write_compressed_variants
+from geocoding import normalize_location
+from map_generator import get_road_filter
+from metrics import increment
+from simplification import DEFAULT_GEOMETRY
+
+def make_cache_key(location, detail_level, map_size, geometry=None, derived=False):
+    """
+    Build the content-addressed key for a generation request; default geometry options keep the plain key
+
+    derived marks output filtered from a download of the complete network
+    (see create_city_wkt_levels), which is segmented differently from a
+    download with the level's own filter and so never shares its key.
+    """
+    custom_filter, road_desc = get_road_filter(detail_level)
+    fields = {
+        'location': normalize_location(location),
+        'filter': custom_filter or road_desc,
+        'map_size': int(map_size) if map_size else None,
+    }
+    if geometry and geometry != DEFAULT_GEOMETRY:
+        fields['geometry'] = geometry._asdict()
+    if derived:
+        fields['derived'] = True
+    payload = json.dumps(fields, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class WKTCache:
+    """
+    On-disk LRU cache of WKT artifacts
+
+    Each entry is stored as <key>.wkt plus a <key>.json metadata file holding
+    the highway counts, and any binary variants (<key>.wkb, <key>.roads)
+    generated with it. Every served file also gets precompressed copies in
+    the given encodings (see compression). The metadata file's mtime records
+    the last access.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024, max_age=7 * 24 * 3600, encodings=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.encodings = encodings
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, f"{key}.wkt"),
+                os.path.join(self.cache_dir, f"{key}.json"))
+
+    def _binary_paths(self, key):
+        wkt_path = self._paths(key)[0]
+        return [binary_path_for(wkt_path, fmt) for fmt in BINARY_FORMATS]
+
+    def _files(self, key):
+        """Every file that may belong to an entry"""
+        wkt_path, meta_path = self._paths(key)
+        served = [wkt_path, *self._binary_paths(key)]
+        return [meta_path, *served, *(variant for path in served for variant in variant_files(path))]
+
+    def _remove(self, key):
+        for path in self._files(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        """Return (file_path, counts) for a cached entry, or None on a miss"""
+        wkt_path, meta_path = self._paths(key)
+        with self._lock:
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                increment('mapgen_wkt_cache_requests_total', result='miss')
+                return None
+            if not os.path.exists(wkt_path) or time.time() - meta.get('created', 0) > self.max_age:
+                self._remove(key)
+                increment('mapgen_wkt_cache_requests_total', result='miss')
+                return None
+            os.utime(meta_path)  # mark as recently used
+            increment('mapgen_wkt_cache_requests_total', result='hit')
+            return os.path.abspath(wkt_path), meta.get('counts', {})
+
+    def put(self, key, file_path, counts, **info):
+        """
+        Store a generated WKT file, and binary variants next to it, in the cache and return the cached path
+
+        Copying, hashing and compressing happen in a private staging directory
+        without the lock, so lookups are not blocked while a large entry is
+        prepared; the lock is only held to move the finished files into place.
+        """
+        wkt_path, meta_path = self._paths(key)
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=self.cache_dir)
+        try:
+            # Copy: the caller publishes or deletes its own file afterwards
+            staged = {}
+            sources = [(file_path, wkt_path)] + [(binary_path_for(file_path, fmt), binary_path_for(wkt_path, fmt))
+                                                 for fmt in BINARY_FORMATS]
+            for source, target in sources:
+                if target != wkt_path and not os.path.exists(source):
+                    continue
+                staged[target] = os.path.join(staging, os.path.basename(target))
+                shutil.copyfile(source, staged[target])
+                write_compressed_variants(staged[target], self.encodings)
+            meta = dict(info, counts=dict(counts), created=time.time())
+            staged_meta = os.path.join(staging, os.path.basename(meta_path))
+            with open(staged_meta, 'w') as f:
+                json.dump(meta, f)
+
+            with self._lock:
+                # Renames keep mtimes, so the ETag sidecars recorded while staging stay valid
+                for _, target in sources:
+                    for path in (target, *variant_files(target)):
+                        staged_path = staged[target] + path[len(target):] if target in staged else None
+                        if staged_path and os.path.exists(staged_path):
+                            os.replace(staged_path, path)
+                        elif os.path.exists(path):
+                            os.remove(path)
+                os.replace(staged_meta, meta_path)
+                self._evict()
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return os.path.abspath(wkt_path)
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('.staging-'):
+                # Left behind by a put interrupted before its cleanup
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    if now - os.path.getmtime(path) > self.max_age:
+                        shutil.rmtree(path, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            wkt_path, meta_path = self._paths(key)
+            try:
+                with open(meta_path) as f:
+                    created = json.load(f).get('created', 0)
+                last_used = os.path.getmtime(meta_path)
+                size = os.path.getsize(wkt_path)
+                size += sum(os.path.getsize(path) for path in self._files(key)
+                            if path != wkt_path and os.path.exists(path))
+            except (OSError, ValueError):
+                self._remove(key)
+                continue
+            if now - created > self.max_age:
+                self._remove(key)
+                continue
+            entries.append((last_used, size, key))
+
+        total = sum(size for _, size, _ in entries)
+        for last_used, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size